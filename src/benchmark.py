@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gc
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from requests import Request
+import orobnat
+import orobnat_dl
+from logger import logger
+from replay import Fixtures, ReplayAdapter
+
+
+def sample_page(date, parameters=60):
+    """
+    Build a page similar to a report page served by orobnat.sante.gouv.fr.
+    :param date: datetime : Sampling date of the report.
+    :param parameters: int : Number of analysed parameters.
+    :return: str : HTML content of the page.
+    """
+    options = ''.join(['<option value="{0:06d}">COMMUNE {0}</option>'.format(i) for i in range(300)])
+    rows = ''.join(['<tr><td>Paramètre {0} (en mg/L)</td><td>{1},{2:02d} mg/L</td><td>&lt;={3} mg/L</td>'
+                    '<td></td></tr>'.format(i, i % 17, i % 100, 50 + i) for i in range(parameters)])
+    return '<!DOCTYPE html><html lang="fr"><head><meta http-equiv="Content-Type" content="text/html; charset=UTF-8">' \
+           '<title>Résultats des analyses</title><link rel="stylesheet" href="style.css"></head><body>' \
+           '<div id="header"><ul>{nav}</ul></div>' \
+           '<form name="rechercherResultatQualiteForm"><select name="departement">{options}</select>' \
+           '<select name="communeDepartement">{options}</select><select name="reseau">{options}</select></form>' \
+           '<div class="block-content"><h3 class="infos">Informations générales</h3><table>' \
+           '<tr><th>Date du prélèvement</th><td>{date}</td></tr>' \
+           '<tr><th>Commune de prélèvement</th><td>DIJON</td></tr>' \
+           '<tr><th>Installation</th><td>DIJON VILLE</td></tr>' \
+           '<tr><th>Service public de distribution</th><td>DIJON</td></tr>' \
+           '<tr><th>Responsable de distribution</th><td>SUEZ EAU FRANCE</td></tr>' \
+           '<tr><th>Maître d\'ouvrage</th><td>DIJON METROPOLE</td></tr></table></div>' \
+           '<div class="block-content"><h3 class="common">Conformité</h3><table>' \
+           '<tr><th>Conclusions sanitaires</th><td>Eau d\'alimentation conforme aux exigences de qualité en ' \
+           'vigueur pour l\'ensemble des paramètres mesurés.</td></tr>' \
+           '<tr><th>Conformité bactériologique</th><td>oui</td></tr>' \
+           '<tr><th>Conformité physico-chimique</th><td>oui</td></tr></table></div>' \
+           '<div class="block-content"><h3 class="params">Paramètres analytiques</h3><table>' \
+           '<tr><th>Paramètre</th><th>Valeur</th><th>Limite de qualité</th><th>Référence de qualité</th></tr>' \
+           '{rows}</table></div>' \
+           '<div class="block-content"><h3>Aide</h3><p>{help}</p></div>' \
+           '<div id="footer">{footer}</div></body></html>'.format(
+               nav=''.join(['<li><a href="#{0}">Menu {0}</a></li>'.format(i) for i in range(40)]),
+               options=options, date=date.strftime('%d/%m/%Y %Hh%M'), rows=rows, help='Aide. ' * 200,
+               footer='<p>Ministère de la santé</p>' * 20)
+
+
+class StubResponse:
+    """
+    A canned HTTP response.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.content = text.encode('utf-8')
+        self.status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StubSession(orobnat.Session):
+    """
+    A session serving canned report pages instead of orobnat.sante.gouv.fr.
+    """
+
+    def __init__(self, pages):
+        """
+        :param pages: list : Report pages, served in order for posPLV = 0, 1, ...
+        """
+        super(StubSession, self).__init__(dict())
+        self.__pages = pages
+
+    def start(self, force=False):
+        pass
+
+    def post(self, url, data=None, **kwargs):
+        return StubResponse(self.__pages[data['posPLV'] % len(self.__pages)])
+
+
+def measure(func, number, repeat):
+    """
+    :return: float : Median time of one call to func, in milliseconds.
+    """
+    return statistics.median(timeit.repeat(func, number=number, repeat=repeat)) / number * 1000
+
+
+def bench_parse(number, repeat):
+    """
+    Measure the CPU cost of building a report from a downloaded page, and of parsing all properties of a report
+    loaded from an exported file, with every available HTML parser.
+    """
+    page = sample_page(datetime(2024, 1, 1))
+    session = StubSession([page])
+    payload = session.payload_base
+    html = session.dl_report(payload)['html']
+    parsers = ['html.parser']
+    try:
+        import lxml  # noqa
+        parsers.append('lxml')
+    except ImportError:
+        pass
+    default_parser = orobnat.PARSER
+    results = dict()
+    print('{:<12} {:>16} {:>16}'.format('parser', 'dl_report (ms)', 'Report (ms)'))
+    try:
+        for parser in parsers:
+            orobnat.PARSER = parser
+            results['dl_report.{}'.format(parser)] = measure(lambda: session.dl_report(payload), number, repeat)
+            results['Report.{}'.format(parser)] = measure(lambda: orobnat.Report(html)['paramètres'], number, repeat)
+            print('{:<12} {:>16.3f} {:>16.3f}'.format(parser, results['dl_report.{}'.format(parser)],
+                                                     results['Report.{}'.format(parser)]))
+    finally:
+        orobnat.PARSER = default_parser
+    return results
+
+
+def footprint(build, count):
+    """
+    :param build: function : Build an object from an index.
+    :param count: int : Number of objects to build.
+    :return: float : Memory allocated per object, in bytes, for objects kept alive in a list.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [build(i) for i in range(count)]
+        gc.collect()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del objects
+    return allocated / count
+
+
+def bench_memory(number, repeat):
+    """
+    Measure the memory footprint of materialized reports: as returned by dl_report, loaded from exported HTML files
+    without reading any property, and loaded then read.
+    The corpus mixes reports with 10 to 120 analysed parameters.
+    """
+    count = number * repeat
+    session = StubSession([sample_page(datetime(2024, 1, 1) - timedelta(days=30 * i), parameters=10 + i % 12 * 10)
+                           for i in range(count)])
+    payload = session.payload_base
+    htmls = [session.dl_report(dict(payload, posPLV=i))['html'] for i in range(count)]
+
+    def load_and_read(i):
+        report = orobnat.Report(htmls[i])
+        report['paramètres']
+        return report
+
+    print('{} reports, {:.0f} bytes of HTML per report'.format(count, sum(len(html.encode('utf-8'))
+                                                                          for html in htmls) / count))
+    results = dict()
+    print('{:<24} {:>16}'.format('report', 'bytes/report'))
+    for name, build in [('dl_report', lambda i: session.dl_report(dict(payload, posPLV=i))),
+                        ('Report(html)', lambda i: orobnat.Report(htmls[i])),
+                        ('Report(html) + read', load_and_read)]:
+        results[name] = footprint(build, count)
+        print('{:<24} {:>16.0f}'.format(name, results[name]))
+    return results
+
+
+def write_fixtures(path, pages, target=None):
+    """
+    Write the fixtures replayed for downloading all reports of a target.
+    :param path: str : Directory of the fixtures.
+    :param pages: list : Report pages, for posPLV = 0, 1, ... The page following the last one holds no report.
+    :param target: orobnat.Target : The target. Default to a reseau of Dijon.
+    :return: orobnat.Target : The target.
+    """
+    fixtures = Fixtures(path)
+    target = target or orobnat.Target('27', '021', '021231', '021000')
+    headers = {'Content-Type': 'text/html;charset=UTF-8'}
+    fixtures.save(Request('GET', '{}?methode=menu&usd=AEP&idRegion=27'.format(orobnat.Session.URL_BASE)).prepare(),
+                  200, headers, b'<html></html>')
+    for position, page in enumerate(pages + ['<html></html>']):
+        fixtures.save(Request('POST', orobnat.Session.URL_RECHERCHE, data=dict(target.payload,
+                                                                               posPLV=position)).prepare(),
+                      200, headers, page.encode('utf-8'))
+    return target
+
+
+def write_departement_fixtures(path, communes, reseaux, reports):
+    """
+    Write the fixtures replayed for downloading all reports of a departement with --all-communes.
+    :param path: str : Directory of the fixtures.
+    :param communes: int : Number of communes of the departement.
+    :param reseaux: int : Number of reseaux of each commune.
+    :param reports: int : Number of reports of each reseau.
+    :return: list : orobnat.Target instances of the departement.
+    """
+    def select(name, ids):
+        return '<html><select name="{}">{}</select></html>'.format(name, ''.join([
+            '<option value="{0}">{0}</option>'.format(an_id) for an_id in ids])).encode('utf-8')
+
+    fixtures = Fixtures(path)
+    headers = {'Content-Type': 'text/html;charset=UTF-8'}
+    payload_base = orobnat.Session(dict()).payload_base
+    pages = [sample_page(datetime(2024, 1, 1) - timedelta(days=30 * i)) for i in range(reports)]
+    targets = list()
+    commune_ids = ['021{:03d}'.format(i) for i in range(communes)]
+    for commune in commune_ids:
+        reseau_ids = ['{}{:02d}'.format(commune, i) for i in range(reseaux)]
+        fixtures.save(Request('POST', orobnat.Session.URL_RECHERCHE, data={
+            **payload_base, 'methode': 'changerReseau', 'idRegion': '27', 'departement': '021',
+            'communeDepartement': commune}).prepare(), 200, headers, select('reseau', reseau_ids))
+        for reseau in reseau_ids:
+            targets.append(write_fixtures(path, pages, orobnat.Target('27', '021', commune, reseau)))
+    fixtures.save(Request('GET', orobnat.Session.URL_REGIONS).prepare(), 200, headers,
+                  b'<html><blockquote class="spip"><a class="spip_out" href="https://orobnat.sante.gouv.fr/orobnat/'
+                  b'afficherPage.do?methode=menu&amp;usd=AEP&amp;idRegion=27">Bourgogne-Franche-Comte</a>'
+                  b'</blockquote></html>')
+    fixtures.save(Request('GET', '{}?methode=menu&usd=AEP&idRegion=27'.format(orobnat.Session.URL_BASE)).prepare(),
+                  200, headers, select('departement', ['021']))
+    fixtures.save(Request('POST', orobnat.Session.URL_RECHERCHE, data={
+        **payload_base, 'methode': 'changerDepartement', 'idRegion': '27', 'departement': '021'}).prepare(),
+                  200, headers, select('communeDepartement', commune_ids))
+    return targets
+
+
+def bench_download(number, repeat):
+    """
+    Measure end-to-end downloads of number reports to HTML, replayed with a simulated latency of 50ms per request,
+    for several numbers of parallel downloads.
+    """
+    path = tempfile.mkdtemp(prefix='orobnat_bench_')
+    try:
+        target = write_fixtures(os.path.join(path, 'fixtures'), [
+            sample_page(datetime(2024, 1, 1) - timedelta(days=30 * i)) for i in range(number)])
+        results = dict()
+        print('{:<8} {:>16} {:>16}'.format('jobs', 'total (ms)', 'reports/s'))
+        for jobs in [1, 2, 4, 8]:
+            timings = list()
+            for run in range(repeat):
+                session = orobnat.Session(dict())
+                session.mount('https://', ReplayAdapter(os.path.join(path, 'fixtures'), latency=.05))
+                export_path = os.path.join(path, 'export-{}-{}'.format(jobs, run))
+                start = time.perf_counter()
+                orobnat_dl.dl_reports(session, CHEMIN=export_path, format=['HTML'], region=target.region,
+                                      departement=target.departement, commune=target.commune,
+                                      reseau=target.reseau, jobs=jobs, since=None, until=None, incremental=False,
+                                      resume=False, dedup=False, catalog=False, shard=None, queue=None,
+                                      export_jobs=None,
+                                      dry_run=False)
+                timings.append(time.perf_counter() - start)
+                session.close()
+                shutil.rmtree(export_path)
+            results['dl_reports.jobs{}'.format(jobs)] = statistics.median(timings) * 1000
+            print('{:<8} {:>16.1f} {:>16.1f}'.format(jobs, results['dl_reports.jobs{}'.format(jobs)],
+                                                     number / statistics.median(timings)))
+    finally:
+        shutil.rmtree(path)
+    return results
+
+
+def bench_export(number, repeat):
+    """
+    Measure the export of number reports with each export format. PDF formats are measured only if wkhtmltopdf is
+    installed.
+    """
+    session = StubSession([sample_page(datetime(2024, 1, 1) - timedelta(days=30 * i)) for i in range(number)])
+    reports = [session.dl_report(dict(session.payload_base, posPLV=i)) for i in range(number)]
+    formats = [name for name in orobnat_dl.EXPORT_FORMATS if name not in ['PDF', 'PDF-ANNUEL']]
+    if None is not shutil.which('wkhtmltopdf'):
+        formats.extend(['PDF', 'PDF-ANNUEL'])
+    results = dict()
+    print('{:<12} {:>16}'.format('format', 'ms/report'))
+    for name in formats:
+        timings = list()
+        for _ in range(repeat):
+            path = tempfile.mkdtemp(prefix='orobnat_bench_')
+            try:
+                start = time.perf_counter()
+                with orobnat.ReportExporter(path, [orobnat_dl.EXPORT_FORMATS[name]]) as exporter:
+                    for report in reports:
+                        exporter.export(report)
+                timings.append(time.perf_counter() - start)
+            finally:
+                shutil.rmtree(path)
+        results['export.{}'.format(name)] = statistics.median(timings) / number * 1000
+        print('{:<12} {:>16.3f}'.format(name, results['export.{}'.format(name)]))
+    return results
+
+
+def bench_startup(number, repeat):
+    """
+    Measure the cold start time of orobnat_dl.py, in a new interpreter for each run : displaying the help and rejecting
+    an invalid argument must not send any request, nor import modules only needed to parse or export reports.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'orobnat_dl.py')
+    results = dict()
+    print('{:<24} {:>16}'.format('command', 'total (ms)'))
+    for name, command in [('python', ['-c', 'pass']),
+                          ('import orobnat_dl', ['-c', 'import orobnat_dl']),
+                          ('--help', [script, '--help']),
+                          ('invalid argument', [script, '--jobs', '0'])]:
+        timings = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *command], cwd=os.path.dirname(script), stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+            timings.append(time.perf_counter() - start)
+        results[name] = statistics.median(timings) * 1000
+        print('{:<24} {:>16.1f}'.format(name, results[name]))
+    return results
+
+
+def bench_shard(number, repeat):
+    """
+    Measure the download of number reports of a departement of 16 reseaux, replayed, by a single process and by
+    4 local processes splitting the targets with --shard, then merging their export directories with --merge, or
+    sharing them with --queue. Every run must export the same files.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'orobnat_dl.py')
+    path = tempfile.mkdtemp(prefix='orobnat_bench_')
+
+    def run(*commands):
+        processes = [subprocess.Popen([sys.executable, script, *command], cwd=os.path.dirname(script),
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for command in commands]
+        if any([0 != process.wait() for process in processes]):
+            raise RuntimeError('orobnat_dl.py failed : {}'.format(commands))
+
+    def exported(export_path):
+        return sorted([os.path.relpath(os.path.join(dir_path, name), export_path)
+                       for dir_path, dir_names, file_names in os.walk(export_path)
+                       for name in file_names if not name.startswith('.')])
+
+    try:
+        fixtures_path = os.path.join(path, 'fixtures')
+        targets = write_departement_fixtures(fixtures_path, 8, 2, max(1, number // 16))
+        base = ['--replay', fixtures_path, '--format', 'HTML', '--region', '27', '--departement', '021',
+                '--all-communes']
+        shards = 4
+        results = dict()
+        print('{:<12} {:>16}'.format('mode', 'total (ms)'))
+        for name in ['single', 'shard', 'queue']:
+            timings = list()
+            for run_number in range(repeat):
+                export_path = os.path.join(path, '{}-{}'.format(name, run_number))
+                start = time.perf_counter()
+                if 'single' == name:
+                    run([*base, export_path])
+                elif 'shard' == name:
+                    shard_paths = ['{}.{}'.format(export_path, i) for i in range(1, shards + 1)]
+                    run(*[[*base, '--shard', '{}/{}'.format(i, shards), shard_path]
+                          for i, shard_path in enumerate(shard_paths, 1)])
+                    run([*[argument for shard_path in shard_paths for argument in ['--merge', shard_path]],
+                         export_path])
+                else:
+                    run(*[[*base, '--queue', '{}.queue'.format(export_path), export_path]] * shards)
+                timings.append(time.perf_counter() - start)
+                files = exported(export_path)
+                if len(files) != len(targets) * max(1, number // 16):
+                    raise RuntimeError('{} : {} files exported'.format(name, len(files)))
+                if ('single' != name) and (files != exported(os.path.join(path, 'single-0'))):
+                    raise RuntimeError('{} : exported files differ from a single process'.format(name))
+            results[name] = statistics.median(timings) * 1000
+            print('{:<12} {:>16.1f}'.format(name, results[name]))
+    finally:
+        shutil.rmtree(path)
+    return results
+
+
+BENCHMARKS = {'parse': bench_parse, 'memory': bench_memory, 'download': bench_download, 'export': bench_export,
+              'startup': bench_startup, 'shard': bench_shard}
+
+
+def main():
+    parser = ArgumentParser(description='Benchmarks for orobnat_dl. No request is sent to orobnat.sante.gouv.fr.')
+    parser.add_argument('benchmark', nargs='*', help='Benchmarks to run among {}. Default : all.'.format(
+        ', '.join(BENCHMARKS.keys())))
+    parser.add_argument('--number', type=int, default=50, help='Number of calls per measure.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of measures, the median is reported.')
+    parser.add_argument('--json', help='Write the results to a JSON file, to track them across releases.',
+                        metavar='FILE')
+    args = parser.parse_args()
+    logger.setLevel('WARNING')
+    for name in args.benchmark:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark : {}'.format(name))
+    results = dict()
+    for name in args.benchmark or BENCHMARKS.keys():
+        print('# {}'.format(name))
+        results[name] = BENCHMARKS[name](args.number, args.repeat)
+    if None is not args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'parser': orobnat.PARSER, 'number': args.number, 'repeat': args.repeat, 'results': results}, f,
+                      indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
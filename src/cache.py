@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class CacheMissError(Exception):
+    """
+    Raised when an offline cache does not hold the requested response.
+    """
+    pass
+
+
+class ResponseCache:
+    """
+    A persistent cache of values parsed from HTTP responses, stored as JSON, evicted by age and total size.
+    """
+
+    DEFAULT_TTL = 7 * 24 * 3600
+    DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+    # eviction frees space down to this fraction of the maximum size, so that it does not run on every set().
+    LOW_WATER = .9
+    # format of the stored values, entries stored in another format are never read.
+    VERSION = 2
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, refresh=False, offline=False):
+        """
+        :param path: str : Directory of the cache. Default to ResponseCache.default_path().
+        :param ttl: float : Time to live of entries, in seconds.
+        :param max_size: int : Maximum total size of entries, in bytes.
+        :param refresh: bool : Ignore cached entries and replace them with fresh responses.
+        :param offline: bool : Never expire entries and never allow network requests on a cache miss.
+        """
+        self.__path = path if None is not path else self.default_path()
+        self.__ttl = ttl
+        self.__max_size = max_size
+        self.__refresh = refresh
+        self.__offline = offline
+        self.__lock = threading.Lock()
+        os.makedirs(self.__path, exist_ok=True)
+        self.__size = sum(size for _, _, size in self.__entries())
+        self.evict()
+
+    @staticmethod
+    def default_path():
+        """
+        :return: str : The user cache directory for orobnat_dl.
+        """
+        return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                            'orobnat_dl')
+
+    @staticmethod
+    def key(method, url, data=None):
+        """
+        :param method: str : HTTP method.
+        :param url: str : URL of the request.
+        :param data: dict : Payload of the request.
+        :return: str : Cache key of the request.
+        """
+        return hashlib.sha256(json.dumps([ResponseCache.VERSION, method.upper(), url, data], sort_keys=True,
+                                         default=str).encode('utf-8')).hexdigest()
+
+    @property
+    def offline(self):
+        """
+        :return: bool : True if network requests are not allowed on a cache miss.
+        """
+        return self.__offline
+
+    def __entries(self):
+        for entry in os.scandir(self.__path):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                yield entry.path, stat.st_mtime, stat.st_size
+
+    def get(self, key):
+        """
+        :param key: str : Cache key of the request.
+        :return: The cached value, None if it is missing, expired or being refreshed.
+        """
+        if self.__refresh:
+            return None
+        path = os.path.join(self.__path, key)
+        try:
+            if (not self.__offline) and (time.time() - os.path.getmtime(path) > self.__ttl):
+                return None
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def set(self, key, value):
+        """
+        Store a value.
+        :param key: str : Cache key of the request.
+        :param value: A value parsed from the response, which can be serialized to JSON.
+        """
+        path = os.path.join(self.__path, key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.__path, prefix='.')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        with self.__lock:
+            if os.path.exists(path):
+                self.__size -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self.__size += os.path.getsize(path)
+        if self.__size > self.__max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove expired entries then, if the cache exceeds its maximum size, the oldest ones until it fits in LOW_WATER
+        of it.
+        """
+        with self.__lock:
+            now = time.time()
+            entries = sorted(self.__entries(), key=lambda entry: entry[1])
+            size = sum(entry[2] for entry in entries)
+            limit = self.__max_size * self.LOW_WATER if size > self.__max_size else self.__max_size
+            for path, mtime, entry_size in entries:
+                if (now - mtime <= self.__ttl or self.__offline) and size <= limit:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+            self.__size = size
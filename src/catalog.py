@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+
+class ReportCatalog:
+    """
+    A queryable SQLite database of report contents : sampling information, conformity and measured parameters.
+    Reports are keyed by target and sampling date, so that databases built from several export directories, or fed
+    while downloading, never hold a report twice. A report of unknown target is matched to the report of any target
+    sampled at the same date with the same content.
+    Changes are buffered and written by commit() in a single short transaction, so that the database may be shared
+    by several processes.
+    """
+
+    FILENAME = '.orobnat_reports.sqlite'
+    TIMEOUT = 60.
+    REPORT_COLUMNS = ['region', 'departement', 'commune', 'reseau', 'date', 'commune_prelevement', 'installation',
+                      'service', 'responsable', 'maitre_ouvrage', 'conclusions', 'conforme', 'digest']
+    MEASURE_COLUMNS = ['report', 'parametre', 'valeur', 'qualificatif', 'unite', 'resultat', 'limite', 'reference',
+                       'conforme']
+
+    def __init__(self, path):
+        """
+        :param path: str : Path of the SQLite database. It is created if it does not exist.
+        """
+        self.__lock = threading.Lock()
+        self.__reports = list()
+        self.__sources = list()
+        import sqlite3
+        self.__connection = sqlite3.connect(path, timeout=self.TIMEOUT, isolation_level='IMMEDIATE',
+                                            check_same_thread=False)
+        with self.__connection:
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS reports ('
+                                      'id INTEGER PRIMARY KEY, '
+                                      'region TEXT, departement TEXT, commune TEXT, reseau TEXT, date TEXT, '
+                                      'commune_prelevement TEXT, installation TEXT, service TEXT, responsable TEXT, '
+                                      'maitre_ouvrage TEXT, conclusions TEXT, conforme INTEGER, digest TEXT, '
+                                      'UNIQUE (region, departement, commune, reseau, date))')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS measures ('
+                                      'report INTEGER REFERENCES reports (id), '
+                                      'parametre TEXT, valeur REAL, qualificatif TEXT, unite TEXT, resultat TEXT, '
+                                      'limite TEXT, reference TEXT, conforme INTEGER)')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS sources ('
+                                      'path TEXT PRIMARY KEY, mtime REAL, size INTEGER)')
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS reports_date ON reports (date)')
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS reports_departement ON reports (departement, date)')
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS measures_report ON measures (report)')
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS measures_parametre ON measures (parametre, valeur)')
+
+    @staticmethod
+    def rows(report):
+        """
+        :param report: orobnat.Report : A report.
+        :return: tuple : (report values, measure values) as stored in the database, without target ids.
+        """
+        measures = report['paramètres']
+        conformity = report['conformité']
+        conform = not (any(value.lower().startswith('non') for key, value in conformity.items()
+                           if key.lower().startswith('conformité'))
+                       or any(False is measure.conform for measure in measures))
+        return ((report['date du prélèvement'].isoformat(), report['commune de prélèvement'].strip(),
+                 report['installation'].strip(), report['service public de distribution'].strip(),
+                 report['responsable de distribution'].strip(), report['maître d\'ouvrage'].strip(),
+                 conformity.get('Conclusions sanitaires', ''), int(conform), report.digest),
+                [(measure.name, measure.value, measure.qualifier, measure.unit, measure.text, measure.limit,
+                  measure.reference, None if None is measure.conform else int(measure.conform))
+                 for measure in measures])
+
+    def add(self, target, report):
+        """
+        Add or update a report. Changes are written by commit().
+        :param target: orobnat.Target : The target of the report, or a tuple of empty ids if it is unknown.
+        :param report: orobnat.Report : The report.
+        """
+        self.add_rows(target, *self.rows(report))
+
+    def add_rows(self, target, values, measures):
+        """
+        Add or update a report from its rows, see rows(). Changes are written by commit().
+        :param target: tuple : "region", "departement", "commune" and "reseau" ids.
+        :param values: tuple : Report values.
+        :param measures: list : Measure values.
+        """
+        with self.__lock:
+            self.__reports.append(((*target, *values), measures))
+
+    def __write(self, values, measures):
+        """
+        :return: bool : True if the report was added or updated, False if it is known with the same digest.
+        """
+        if not any(values[:4]):
+            # a report of unknown target, e.g. indexed from a single target export directory, is known if any target
+            # holds the same report.
+            if None is not self.__connection.execute('SELECT 1 FROM reports WHERE date = ? AND digest = ?',
+                                                     (values[4], values[-1])).fetchone():
+                return False
+        else:
+            self.__delete('SELECT id FROM reports WHERE region = \'\' AND departement = \'\' AND commune = \'\' '
+                          'AND reseau = \'\' AND date = ? AND digest = ?', (values[4], values[-1]))
+        row = self.__connection.execute('SELECT id, digest FROM reports WHERE region = ? AND departement = ? '
+                                        'AND commune = ? AND reseau = ? AND date = ?', values[:5]).fetchone()
+        if None is row:
+            report_id = self.__connection.execute(
+                'INSERT INTO reports ({}) VALUES ({})'.format(', '.join(self.REPORT_COLUMNS),
+                                                              ', '.join(['?'] * len(values))), values).lastrowid
+        elif row[1] == values[-1]:
+            return False
+        else:
+            report_id = row[0]
+            self.__connection.execute('UPDATE reports SET {} WHERE id = ?'.format(
+                ', '.join(['{} = ?'.format(column) for column in self.REPORT_COLUMNS[5:]])),
+                (*values[5:], report_id))
+            self.__connection.execute('DELETE FROM measures WHERE report = ?', (report_id,))
+        self.__connection.executemany('INSERT INTO measures VALUES ({})'.format(
+            ', '.join(['?'] * len(self.MEASURE_COLUMNS))), [(report_id, *measure) for measure in measures])
+        return True
+
+    def __delete(self, ids, parameters):
+        """
+        Delete reports and their measures.
+        :param ids: str : A SQL query selecting the ids of the reports.
+        :param parameters: tuple : Parameters of the query.
+        """
+        self.__connection.execute('DELETE FROM measures WHERE report IN ({})'.format(ids), parameters)
+        self.__connection.execute('DELETE FROM reports WHERE id IN ({})'.format(ids), parameters)
+
+    def indexed(self, path, mtime, size):
+        """
+        :param path: str : Path of an exported file.
+        :param mtime: float : Modification time of the file.
+        :param size: int : Size of the file.
+        :return: bool : True if the reports of the file have been added, and the file did not change since.
+        """
+        with self.__lock:
+            row = self.__connection.execute('SELECT mtime, size FROM sources WHERE path = ?', (path,)).fetchone()
+        return (None is not row) and (row[0] == mtime) and (row[1] == size)
+
+    def set_indexed(self, path, mtime, size):
+        """
+        Record that the reports of a file have been added. Changes are written by commit().
+        :param path: str : Path of an exported file.
+        :param mtime: float : Modification time of the file.
+        :param size: int : Size of the file.
+        """
+        with self.__lock:
+            self.__sources.append((path, mtime, size))
+
+    def commit(self):
+        """
+        Write pending changes.
+        :return: int : Number of reports added or updated. Reports already known with the same digest, e.g. a report
+                 read from both an HTML and a ZIP export, are not counted.
+        """
+        count = 0
+        with self.__lock:
+            if self.__reports or self.__sources:
+                with self.__connection:
+                    self.__connection.execute('BEGIN IMMEDIATE')
+                    for values, measures in self.__reports:
+                        count += self.__write(values, measures)
+                    self.__connection.executemany('INSERT OR REPLACE INTO sources VALUES (?, ?, ?)', self.__sources)
+            self.__reports.clear()
+            self.__sources.clear()
+        return count
+
+    def merge(self, path):
+        """
+        Add the reports of another catalog, e.g. the catalog of another shard, in a single transaction. Reports
+        already known with the same digest are left unchanged, those whose digest differs are replaced.
+        :param path: str : Path of the other catalog.
+        """
+        self.commit()
+        key = ' AND '.join(['r.{0} = o.{0}'.format(column) for column in self.REPORT_COLUMNS[:5]])
+        with self.__lock:
+            self.__connection.execute('ATTACH DATABASE ? AS other', (path,))
+            try:
+                with self.__connection:
+                    self.__connection.execute('BEGIN IMMEDIATE')
+                    # reports whose digest changed are replaced, with their measures.
+                    changed = 'SELECT r.id FROM main.reports r JOIN other.reports o ON {} ' \
+                              'WHERE r.digest IS NOT o.digest'.format(key)
+                    self.__connection.execute('DELETE FROM main.measures WHERE report IN ({})'.format(changed))
+                    self.__connection.execute('DELETE FROM main.reports WHERE id IN ({})'.format(changed))
+                    # reports are added after the last one, so that their measures are found by id.
+                    last = self.__connection.execute('SELECT COALESCE(MAX(id), 0) FROM main.reports').fetchone()[0]
+                    self.__connection.execute('INSERT OR IGNORE INTO main.reports ({0}) SELECT {0} FROM other.reports'
+                                              .format(', '.join(self.REPORT_COLUMNS)))
+                    self.__connection.execute(
+                        'INSERT INTO main.measures SELECT r.id, {} FROM other.measures m '
+                        'JOIN other.reports o ON m.report = o.id JOIN main.reports r ON {} WHERE r.id > ?'.format(
+                            ', '.join(['m.{}'.format(column) for column in self.MEASURE_COLUMNS[1:]]), key),
+                        (last,))
+            finally:
+                self.__connection.execute('DETACH DATABASE other')
+
+    def query(self, sql, parameters=()):
+        """
+        :param sql: str : A SQL query.
+        :param parameters: iterable : Parameters of the query.
+        :return: tuple : (column names, list of rows).
+        """
+        with self.__lock:
+            cursor = self.__connection.execute(sql, tuple(parameters))
+            return [column[0] for column in cursor.description or []], cursor.fetchall()
+
+    def close(self):
+        """
+        Write pending changes and close the database.
+        """
+        self.commit()
+        self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class Checkpoint:
+    """
+    Progress of a download run, periodically saved to a state file so that an interrupted run may be resumed.
+    For each target, the state holds the "posPLV" position from which downloads must restart, and whether the target
+    is done.
+    Reports are listed newest first: if new reports are published in between, resuming from a saved position
+    downloads a few reports again, but never misses any.
+    """
+
+    FILENAME = '.orobnat_state.json'
+    INTERVAL = 5.
+
+    def __init__(self, path, resume=False):
+        """
+        :param path: str : Path of the state file.
+        :param resume: bool : Load the state of the previous run. Otherwise start from scratch.
+        """
+        self.__path = path
+        self.__lock = threading.Lock()
+        self.__saved = time.monotonic()
+        self.__targets = dict()
+        if resume and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.__targets = json.load(f)['targets']
+
+    @staticmethod
+    def __key(target):
+        return '/'.join(target)
+
+    def position(self, target):
+        """
+        :param target: orobnat.Target : A target.
+        :return: int : The "posPLV" position from which downloads of the target must restart.
+        """
+        with self.__lock:
+            return self.__targets.get(self.__key(target), dict()).get('posPLV', 0)
+
+    def done(self, target):
+        """
+        :param target: orobnat.Target : A target.
+        :return: bool : True if all reports of the target have been exported.
+        """
+        with self.__lock:
+            return self.__targets.get(self.__key(target), dict()).get('done', False)
+
+    def update(self, target, position):
+        """
+        Record the progress of a target. The state file is saved at most every INTERVAL seconds.
+        :param target: orobnat.Target : A target.
+        :param position: int : "posPLV" position of the first report whose exports are not complete.
+        """
+        with self.__lock:
+            self.__targets[self.__key(target)] = {'posPLV': position, 'done': False}
+        if time.monotonic() - self.__saved >= self.INTERVAL:
+            self.save()
+
+    def set_done(self, target):
+        """
+        Record that all reports of a target have been exported, and save the state file.
+        :param target: orobnat.Target : A target.
+        """
+        with self.__lock:
+            self.__targets.setdefault(self.__key(target), {'posPLV': 0})['done'] = True
+        self.save()
+
+    def save(self):
+        """
+        Atomically write the state file.
+        """
+        with self.__lock:
+            state = json.dumps({'targets': self.__targets}, indent=1, sort_keys=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.__path)), prefix='.',
+                                            suffix='.part')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(state)
+            os.replace(tmp_path, self.__path)
+            self.__saved = time.monotonic()
+
+    def clear(self):
+        """
+        Remove the state file, once a run is complete.
+        """
+        with self.__lock:
+            self.__targets.clear()
+            if os.path.exists(self.__path):
+                os.remove(self.__path)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+
+# the umask can only be read by changing it, which is not thread safe : read it once, on import.
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+
+def set_default_mode(path):
+    """
+    Give a file created by tempfile.mkstemp(), which is only readable by its owner, the permissions of a file created
+    by open().
+    :param path: str : Path of the file.
+    """
+    os.chmod(path, 0o666 & ~UMASK)
+
+
+class DigestManifest:
+    """
+    Digests of the normalized HTML content of the reports exported in a directory, keyed by exported file.
+    The manifest is an append-only text file of "<digest>\t<relative path>" lines, the last line of a path wins.
+    """
+
+    FILENAME = '.digests'
+
+    def __init__(self, dir_path):
+        """
+        :param dir_path: str : The export directory. The manifest is read on first access.
+        """
+        self.__dir_path = dir_path
+        self.__path = os.path.join(dir_path, self.FILENAME)
+        self.__lock = threading.Lock()
+        self.__digests = None
+
+    def __load(self):
+        if None is self.__digests:
+            self.__digests = dict()
+            if os.path.exists(self.__path):
+                with open(self.__path, encoding='utf-8') as f:
+                    for line in f:
+                        digest, _, path = line.rstrip('\n').partition('\t')
+                        if '' != path:
+                            self.__digests[path] = digest
+        return self.__digests
+
+    def get(self, path):
+        """
+        :param path: str : Path of an exported file.
+        :return: str : Digest of the report exported to path, None if unknown.
+        """
+        with self.__lock:
+            return self.__load().get(os.path.relpath(path, self.__dir_path))
+
+    def set(self, path, digest):
+        """
+        Record the digest of the report exported to path.
+        :param path: str : Path of an exported file.
+        :param digest: str : Digest of the report.
+        """
+        path = os.path.relpath(path, self.__dir_path)
+        with self.__lock:
+            if self.__load().get(path) == digest:
+                return
+            os.makedirs(self.__dir_path, exist_ok=True)
+            with open(self.__path, 'a', encoding='utf-8') as f:
+                f.write('{}\t{}\n'.format(digest, path))
+            self.__digests[path] = digest
+
+
+class ContentStore:
+    """
+    A content-addressed store : each unique exported file is stored once, under its report digest, and exported
+    paths are hard links to it. Files are copied instead when hard links are not supported.
+    """
+
+    DIRNAME = '.objects'
+
+    def __init__(self, path):
+        """
+        :param path: str : Directory of the store. It should be on the same file system as the exported files.
+        """
+        self.__path = path
+
+    def object_path(self, digest, suffix):
+        """
+        :param digest: str : Digest of a report.
+        :param suffix: str : Suffix of the exported file.
+        :return: str : Path of the stored file.
+        """
+        return os.path.join(self.__path, digest[:2], '{}.{}'.format(digest, suffix))
+
+    def put(self, digest, suffix, content):
+        """
+        Store a file unless it is already stored.
+        :param digest: str : Digest of a report.
+        :param suffix: str : Suffix of the exported file.
+        :param content: bytes : Content of the file.
+        :return: str : Path of the stored file.
+        """
+        object_path = self.object_path(digest, suffix)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(object_path), prefix='.')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            set_default_mode(tmp_path)
+            os.replace(tmp_path, object_path)
+        return object_path
+
+    @staticmethod
+    def link(object_path, path):
+        """
+        Atomically replace path with a hard link to a stored file.
+        :param object_path: str : Path of the stored file.
+        :param path: str : Path of the exported file.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path) and os.path.samefile(object_path, path):
+            return
+        tmp_path = os.path.join(os.path.dirname(path), '.{}.{}'.format(os.path.basename(path), threading.get_ident()))
+        try:
+            os.link(object_path, tmp_path)
+        except OSError:
+            shutil.copyfile(object_path, tmp_path)
+        os.replace(tmp_path, path)
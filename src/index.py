@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from datetime import datetime
+
+
+class DownloadIndex:
+    """
+    A persistent index of exported reports, keyed by target, sampling date and export format.
+    The index may be shared by several processes: write transactions are short, and wait for each other.
+    """
+
+    FILENAME = '.orobnat_index.sqlite'
+    TIMEOUT = 60.
+
+    def __init__(self, path):
+        """
+        :param path: str : Path of the SQLite database. It is created if it does not exist.
+        """
+        self.__lock = threading.Lock()
+        # sqlite3 is imported on first use, --help and listings do not need it.
+        import sqlite3
+        self.__connection = sqlite3.connect(path, timeout=self.TIMEOUT, isolation_level='IMMEDIATE',
+                                            check_same_thread=False)
+        with self.__connection:
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS reports ('
+                                      'region TEXT, departement TEXT, commune TEXT, reseau TEXT, '
+                                      'date TEXT, format TEXT, '
+                                      'PRIMARY KEY (region, departement, commune, reseau, date, format))')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS complete ('
+                                      'region TEXT, departement TEXT, commune TEXT, reseau TEXT, format TEXT, '
+                                      'PRIMARY KEY (region, departement, commune, reseau, format))')
+
+    def add(self, target, date, formats):
+        """
+        Record an exported report.
+        :param target: orobnat.Target : The target of the report.
+        :param date: datetime : Sampling date of the report.
+        :param formats: iterable : Export formats of the report.
+        """
+        with self.__lock, self.__connection:
+            self.__connection.executemany('INSERT OR IGNORE INTO reports VALUES (?, ?, ?, ?, ?, ?)',
+                                          [(*target, date.isoformat(), a_format) for a_format in formats])
+
+    def set_complete(self, target, formats):
+        """
+        Record that every report of a target has been exported once, so that later runs may stop at the first
+        known report.
+        :param target: orobnat.Target : The target.
+        :param formats: iterable : Export formats.
+        """
+        with self.__lock, self.__connection:
+            self.__connection.executemany('INSERT OR IGNORE INTO complete VALUES (?, ?, ?, ?, ?)',
+                                          [(*target, a_format) for a_format in formats])
+
+    def known(self, target, formats):
+        """
+        :param target: orobnat.Target : The target.
+        :param formats: iterable : Export formats.
+        :return: set : Sampling dates of the reports exported in all given formats, for a target which has been
+                       completely exported in these formats. Empty otherwise.
+        """
+        formats = sorted(set(formats))
+        if len(formats) < 1:
+            return set()
+        placeholders = ', '.join(['?'] * len(formats))
+        with self.__lock:
+            rows = self.__connection.execute(
+                'SELECT date FROM reports '
+                'WHERE region = ? AND departement = ? AND commune = ? AND reseau = ? '
+                'AND format IN ({0}) '
+                'AND format IN (SELECT format FROM complete '
+                'WHERE region = ? AND departement = ? AND commune = ? AND reseau = ?) '
+                'GROUP BY date HAVING COUNT(DISTINCT format) = ?'.format(placeholders),
+                (*target, *formats, *target, len(formats))).fetchall()
+        return {datetime.fromisoformat(row[0]) for row in rows}
+
+    def merge(self, path):
+        """
+        Add the exported reports recorded in another index, e.g. the index of another shard.
+        :param path: str : Path of the other index.
+        """
+        with self.__lock:
+            self.__connection.execute('ATTACH DATABASE ? AS other', (path,))
+            try:
+                with self.__connection:
+                    self.__connection.execute('INSERT OR IGNORE INTO reports SELECT * FROM other.reports')
+                    self.__connection.execute('INSERT OR IGNORE INTO complete SELECT * FROM other.complete')
+            finally:
+                self.__connection.execute('DETACH DATABASE other')
+
+    def close(self):
+        """
+        Close the database.
+        """
+        self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
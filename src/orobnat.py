@@ -1,13 +1,49 @@
 # -*- coding: utf-8 -*-
 
-from requests import Session as BaseSession
-from bs4 import BeautifulSoup
-import pdfkit
+from requests import Session as BaseSession, ConnectionError as RequestsConnectionError, Timeout
+from requests.adapters import HTTPAdapter
+import csv
+import zipfile
+import glob
+import shutil
+import warnings
 import re
 from datetime import datetime
 import os
 from abc import ABC, abstractmethod
 from collections.abc import Mapping, Iterator
+from collections import deque, namedtuple, OrderedDict
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import partial
+from urllib.parse import urlsplit
+import threading
+from cache import CacheMissError
+from stats import stats
+import time
+import random
+import tempfile
+import hashlib
+import importlib.util
+from contextlib import contextmanager
+from dedup import DigestManifest, set_default_mode
+
+# lxml is not imported until reports are parsed.
+PARSER = 'lxml' if None is not importlib.util.find_spec('lxml') else 'html.parser'
+
+
+def parse_html(markup, parser='html.parser', blocks=False, **kwargs):
+    """
+    Parse HTML content. BeautifulSoup is slow to import, so it is imported on first use.
+    :param markup: str or bytes : HTML content.
+    :param parser: str : Name of the parser.
+    :param blocks: bool : Parse only the "block-content" divs, which are the only useful part of a report page.
+    :param kwargs: Other arguments of bs4.BeautifulSoup.
+    :return: bs4.BeautifulSoup : The parsed document.
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+    return BeautifulSoup(markup, parser, parse_only=SoupStrainer('div', attrs='block-content') if blocks else None,
+                         **kwargs)
 
 
 class Session(BaseSession):
@@ -18,24 +54,180 @@ class Session(BaseSession):
     URL_REGIONS = 'https://sante.gouv.fr/sante-et-environnement/eaux/eau'
     URL_BASE = 'https://orobnat.sante.gouv.fr/orobnat/afficherPage.do'
     URL_RECHERCHE = 'https://orobnat.sante.gouv.fr/orobnat/rechercherResultatQualite.do'
+    DEFAULT_TIMEOUT = 30
+    DEFAULT_RETRIES = 3
+    DEFAULT_BACKOFF = 1.
+    MAX_BACKOFF = 60.
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # lists kept in memory, and their time to live in seconds : long-running sessions fetch them again from the
+    # persistent cache, or from the server once the cache expires.
+    MEMO_SIZE = 256
+    MEMO_TTL = 3600.
+    REPORT_HEADER = '<html><head><META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8"><style>' \
+                    '.styled-table {' \
+                    'border-collapse: collapse;' \
+                    'margin: 25px 0;' \
+                    'font-size: 0.9em;' \
+                    'font-family: sans-serif;' \
+                    'min-width: 400px;' \
+                    'box-shadow: 0 0 20px rgba(0, 0, 0, 0.15);}' \
+                    '.styled-table thead tr {' \
+                    'background-color: #009879;' \
+                    'color: #ffffff;' \
+                    'text-align: left;}' \
+                    '.styled-table th,.styled-table td {' \
+                    'padding: 12px 15px;}' \
+                    '.styled-table tbody tr {' \
+                    'border-bottom: 1px solid #dddddd;}' \
+                    '.styled-table tbody tr:nth-of-type(even) {' \
+                    'background-color: #f3f3f3;}' \
+                    '.styled-table tbody tr:last-of-type {' \
+                    'border-bottom: 2px solid #009879;}</style></head><body>'
+    REPORT_FOOTER = '</body></html>'
 
-    def __init__(self, args):
+    def __init__(self, args, cache=None):
         """
         :param args: A dict which may contains any useful information to be used across the session.
                      This dict may be updated whenever.
+        :param cache: cache.ResponseCache : Persistent cache for the "regions", "departements", "communes" and
+                      "reseaux" lists. None to disable it.
         """
         super(Session, self).__init__()
         self.__args = args
-        res = self.get('{}?methode=menu&usd=AEP&idRegion=27'.format(self.URL_BASE))
-        res.close()
-        self.__regions = dict()
-        res = self.get(self.URL_REGIONS)
-        try:
-            soup = BeautifulSoup(res.text, 'html.parser')
-            for elem in soup.find('blockquote', attrs=['spip']).find_all('a', attrs=['spip_out']):
-                self.__regions[re.sub(r'.+?idRegion=(\d+)$', r'\1', elem['href'])] = elem.get_text()
-        finally:
-            res.close()
+        self.__cache = cache
+        # timeout of each request, in seconds.
+        self.timeout = self.DEFAULT_TIMEOUT
+        # number of retries of a request failing on a network error or a RETRY_STATUSES response.
+        self.retries = self.DEFAULT_RETRIES
+        # base delay of the exponential backoff between retries, in seconds.
+        self.backoff = self.DEFAULT_BACKOFF
+        # ratelimit.HostRateLimiter pacing requests, None to send them as soon as possible.
+        self.limiter = None
+        self.__lock = threading.Lock()
+        self.__started = False
+        self.__memo_lock = threading.Lock()
+        # {request: (time, items)}, least recently used first.
+        self.__memo = OrderedDict()
+
+    def start(self, force=False):
+        """
+        Open the session on orobnat.sante.gouv.fr, if not done yet. This is done before the first request which needs
+        it.
+        :param force: bool : Open the session again, when it may have expired on the server.
+        """
+        with self.__lock:
+            if force or (not self.__started):
+                res = self.get('{}?methode=menu&usd=AEP&idRegion=27'.format(self.URL_BASE))
+                res.close()
+                self.__started = True
+
+    def __fetch(self, method, url, data, parse):
+        """
+        Send a request and parse the list of items it returns. Items are cached in memory and in the persistent cache.
+        :param parse: callable : Parse the HTML content of the response into a dict of items {id: name}.
+        :return: dict : The items.
+        """
+        key = (method, url, None if None is data else tuple(sorted(data.items())))
+        with self.__memo_lock:
+            if key in self.__memo:
+                timestamp, items = self.__memo[key]
+                if time.monotonic() - timestamp <= self.MEMO_TTL:
+                    self.__memo.move_to_end(key)
+                    return items.copy()
+                del self.__memo[key]
+        cache_key = None
+        items = None
+        if None is not self.__cache:
+            cache_key = self.__cache.key(method, url, data)
+            items = self.__cache.get(cache_key)
+            if (None is items) and self.__cache.offline:
+                raise CacheMissError('{} {} {}'.format(method, url, data or ''))
+        if None is items:
+            if urlsplit(url).netloc == urlsplit(self.URL_BASE).netloc:
+                self.start()
+            res = self.request(method, url, data=data)
+            try:
+                res.raise_for_status()
+                items = parse(res.text)
+            finally:
+                res.close()
+            if None is not cache_key:
+                self.__cache.set(cache_key, items)
+        with self.__memo_lock:
+            self.__memo[key] = (time.monotonic(), items)
+            self.__memo.move_to_end(key)
+            while len(self.__memo) > self.MEMO_SIZE:
+                self.__memo.popitem(last=False)
+        return items.copy()
+
+    @staticmethod
+    def _parse_options(text, name):
+        """
+        :param text: str : HTML content of a page.
+        :param name: str : Name of a select element of the page.
+        :return: dict : The options of the select element {value: text}.
+        """
+        return {elem['value']: elem.get_text() for elem in parse_html(text).find('select', {'name': name})
+                .find_all('option')}
+
+    def request(self, method, url, *args, **kwargs):
+        """
+        Send a request, paced by the rate limiter and retried with exponential backoff and jitter on network errors
+        and on RETRY_STATUSES responses. Its duration and size are recorded in the global statistics.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            bucket = None if None is self.limiter else self.limiter.bucket(url)
+            if None is not bucket:
+                bucket.acquire()
+            retry_after = None
+            start = time.perf_counter()
+            try:
+                with stats.timer('http'):
+                    res = super(Session, self).request(method, url, *args, **kwargs)
+            except (RequestsConnectionError, Timeout):
+                stats.incr('http.errors')
+                if None is not bucket:
+                    bucket.failure()
+                if attempt >= self.retries:
+                    raise
+            except Exception:
+                stats.incr('http.errors')
+                raise
+            else:
+                stats.incr('http.requests')
+                stats.incr('http.bytes', len(res.content))
+                if res.status_code >= 400:
+                    stats.incr('http.errors')
+                if (res.status_code not in self.RETRY_STATUSES) or (attempt >= self.retries):
+                    if None is not bucket:
+                        if res.status_code in self.RETRY_STATUSES:
+                            bucket.failure()
+                        else:
+                            bucket.success(time.perf_counter() - start)
+                    return res
+                if None is not bucket:
+                    bucket.failure()
+                retry_after = res.headers.get('Retry-After')
+                res.close()
+            stats.incr('http.retries')
+            delay = random.uniform(0, min(self.MAX_BACKOFF, self.backoff * 2 ** attempt))
+            if (None is not retry_after) and retry_after.isdigit():
+                delay = max(delay, min(self.MAX_BACKOFF, float(retry_after)))
+            time.sleep(delay)
+            attempt += 1
+
+    def resize_pool(self, size):
+        """
+        Resize the connection pool so that up to size requests may be sent concurrently.
+        :param size: int : Maximum number of pooled connections per host.
+        """
+        adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+        for prefix in ['https://', 'http://']:
+            # recording and replaying adapters (see replay.py) are kept.
+            mounted = self.get_adapter(prefix)
+            self.mount(prefix, mounted.resized(size) if hasattr(mounted, 'resized') else adapter)
 
     @property
     def payload_base(self):
@@ -56,163 +248,372 @@ class Session(BaseSession):
         """
         :return: A dict of available "regions" {id: name}
         """
-        return self.__regions.copy()
+        def parse(text):
+            return {re.sub(r'.+?idRegion=(\d+)$', r'\1', elem['href']): elem.get_text()
+                    for elem in parse_html(text).find('blockquote', attrs=['spip']).find_all('a', attrs=['spip_out'])}
+
+        return self.__fetch('GET', self.URL_REGIONS, None, parse)
 
     @property
     def departements(self):
         """
         :return: A dict of available "departements" {id: name}
         """
-        result = dict()
-        res = self.get('{}?methode=menu&usd=AEP&idRegion={}'.format(self.URL_BASE, self.__args['region']))
-        try:
-            soup = BeautifulSoup(res.text, 'html.parser')
-            for elem in soup.find('select', {'name': 'departement'}).find_all('option'):
-                result[elem['value']] = elem.get_text()
-        finally:
-            res.close()
-        return result
+        return self.get_departements(self.__args['region'])
 
     @property
     def communes(self):
         """
         :return: A dict of available "communes" {id: name}
         """
-        result = dict()
-        res = self.post(self.URL_RECHERCHE, {**self.payload_base,
-                                             **{'methode': 'changerDepartement',
-                                                'idRegion': self.__args['region'],
-                                                'departement': self.__args['departement']}})
-        try:
-            soup = BeautifulSoup(res.text, 'html.parser')
-            for elem in soup.find('select', {'name': 'communeDepartement'}).find_all('option'):
-                result[elem['value']] = elem.get_text()
-        finally:
-            res.close()
-        return result
+        return self.get_communes(self.__args['region'], self.__args['departement'])
 
     @property
     def reseaux(self):
         """
         :return: A dict of available "reseaux" {id: name}
         """
-        result = dict()
-        res = self.post(self.URL_RECHERCHE, {**self.payload_base,
-                                             **{'methode': 'changerReseau',
-                                                'idRegion': self.__args['region'],
-                                                'departement': self.__args['departement'],
-                                                'communeDepartement': self.__args['commune']}})
-        try:
-            soup = BeautifulSoup(res.text, 'html.parser')
-            for elem in soup.find('select', {'name': 'reseau'}).find_all('option'):
-                result[elem['value']] = elem.get_text()
-        finally:
-            res.close()
-        return result
+        return self.get_reseaux(self.__args['region'], self.__args['departement'], self.__args['commune'])
+
+    def get_departements(self, region):
+        """
+        :param region: str : "region" id.
+        :return: A dict of available "departements" {id: name} for the given "region".
+        """
+        return self.__fetch('GET', '{}?methode=menu&usd=AEP&idRegion={}'.format(self.URL_BASE, region), None,
+                            lambda text: self._parse_options(text, 'departement'))
+
+    def get_communes(self, region, departement):
+        """
+        :param region: str : "region" id.
+        :param departement: str : "departement" id.
+        :return: A dict of available "communes" {id: name} for the given "departement".
+        """
+        return self.__fetch('POST', self.URL_RECHERCHE, {**self.payload_base,
+                                                         **{'methode': 'changerDepartement',
+                                                            'idRegion': region,
+                                                            'departement': departement}},
+                            lambda text: self._parse_options(text, 'communeDepartement'))
+
+    def get_reseaux(self, region, departement, commune):
+        """
+        :param region: str : "region" id.
+        :param departement: str : "departement" id.
+        :param commune: str : "commune" id.
+        :return: A dict of available "reseaux" {id: name} for the given "commune".
+        """
+        return self.__fetch('POST', self.URL_RECHERCHE, {**self.payload_base,
+                                                         **{'methode': 'changerReseau',
+                                                            'idRegion': region,
+                                                            'departement': departement,
+                                                            'communeDepartement': commune}},
+                            lambda text: self._parse_options(text, 'reseau'))
+
+    def iter_targets(self, region, departement=None, commune=None, reseau=None):
+        """
+        Walk the hierarchy below the given ids, fetching each level only once.
+        :param region: str : "region" id.
+        :param departement: str : "departement" id. All "departements" of the "region" if None.
+        :param commune: str : "commune" id. All "communes" of the "departement" if None.
+        :param reseau: str : "reseau" id. All "reseaux" of the "commune" if None.
+        :return: generator : Target instances.
+        """
+        departements = [departement] if None is not departement else self.get_departements(region).keys()
+        for a_departement in filter(None, departements):
+            communes = [commune] if None is not commune else self.get_communes(region, a_departement).keys()
+            for a_commune in filter(None, communes):
+                reseaux = [reseau] if None is not reseau else self.get_reseaux(region, a_departement,
+                                                                                a_commune).keys()
+                for a_reseau in filter(None, reseaux):
+                    yield Target(region, a_departement, a_commune, a_reseau)
 
     def dl_report(self, data):
         """
         Download a report.
         :param data: dict : Payload for the POST requests, derived from payload_base.
         :return: str : HTML content of the report.
+        :raise requests.HTTPError: If the server still answers with an error once the retries are exhausted.
         """
+        self.start()
         res = self.post(self.URL_RECHERCHE, data)
         try:
-            soup = BeautifulSoup(res.text, 'html.parser')
+            # an error page holds no report, and would be taken for the end of the list.
+            res.raise_for_status()
+            text = res.text
         finally:
             res.close()
-        blocks = [div for div in soup.find_all('div', attrs='block-content')]
-        for block in blocks.copy():
-            if len(block.find_all('h3', attrs=['infos', 'common', 'params'])) < 1:
-                blocks.remove(block)
-        html = '<html><head><META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8"><style>' \
-               '.styled-table {' \
-               'border-collapse: collapse;' \
-               'margin: 25px 0;' \
-               'font-size: 0.9em;' \
-               'font-family: sans-serif;' \
-               'min-width: 400px;' \
-               'box-shadow: 0 0 20px rgba(0, 0, 0, 0.15);}' \
-               '.styled-table thead tr {' \
-               'background-color: #009879;' \
-               'color: #ffffff;' \
-               'text-align: left;}' \
-               '.styled-table th,.styled-table td {' \
-               'padding: 12px 15px;}' \
-               '.styled-table tbody tr {' \
-               'border-bottom: 1px solid #dddddd;}' \
-               '.styled-table tbody tr:nth-of-type(even) {' \
-               'background-color: #f3f3f3;}' \
-               '.styled-table tbody tr:last-of-type {' \
-               'border-bottom: 2px solid #009879;}</style></head><body>'
-        for block in blocks:
-            block.find('table')['class'] = 'styled-table'
-            html = '{}{}'.format(html, block)
-        return Report('{}{}'.format(html, '</body></html>'))
+        with stats.timer('parse'):
+            soup = parse_html(text, PARSER, blocks=True)
+            blocks = [block for block in soup.find_all('div', attrs='block-content')
+                      if None is not block.find('h3', attrs=['infos', 'common', 'params'])]
+            for block in blocks:
+                block.find('table')['class'] = 'styled-table'
+            return Report(''.join([self.REPORT_HEADER, *[str(block) for block in blocks], self.REPORT_FOOTER]),
+                          blocks)
+
+
+class Target(namedtuple('Target', ['region', 'departement', 'commune', 'reseau'])):
+    """
+    A "reseau" identified by its "region", "departement", "commune" and "reseau" ids.
+    """
+    __slots__ = ()
+
+    @property
+    def payload(self):
+        """
+        :return: dict : Payload for the POST requests downloading the reports of this target, from the first one.
+        """
+        return {'methode': 'rechercher',
+                'idRegion': self.region,
+                'usd': 'AEP',
+                'posPLV': 0,
+                'departement': self.departement,
+                'communeDepartement': self.commune,
+                'reseau': self.reseau}
 
 
 class InvalidReportException(Exception):
     pass
 
 
+class ExportException(Exception):
+    pass
+
+
+class Measure(namedtuple('Measure', ['name', 'value', 'qualifier', 'unit', 'text', 'limit', 'reference',
+                                     'conform'])):
+    """
+    A measured parameter of a report.
+    name: str : Name of the parameter.
+    value: float : Measured value, None if the result is not numeric.
+    qualifier: str : Comparison operator preceding the value, like '<' for a value below the quantification limit.
+    unit: str : Unit of the value.
+    text: str : Result as written in the report.
+    limit: str : Quality limit as written in the report.
+    reference: str : Quality reference as written in the report.
+    conform: bool : True if the value complies with the quality limit, None if it cannot be checked.
+    """
+    __slots__ = ()
+
+    NUMBER = r'(-?\d+(?:[.,]\d+)?(?:[eE][-+]?\d+)?)'
+    VALUE = re.compile(r'^\s*(<=|>=|<|>|≤|≥)?\s*' + NUMBER + r'\s*(.*?)\s*$')
+    BOUND = re.compile(r'(<=|>=|<|>|≤|≥)\s*' + NUMBER)
+    OPERATORS = {'≤': '<=', '≥': '>='}
+
+    @classmethod
+    def parse(cls, name, text, limit='', reference=''):
+        """
+        :param name: str : Name of the parameter.
+        :param text: str : Result as written in the report.
+        :param limit: str : Quality limit as written in the report.
+        :param reference: str : Quality reference as written in the report.
+        :return: Measure
+        """
+        match = cls.VALUE.match(text)
+        if None is match:
+            return cls(name, None, '', '', text, limit, reference, None)
+        qualifier, value, unit = match.group(1) or '', float(match.group(2).replace(',', '.')), match.group(3)
+        conform = None
+        bounds = cls.BOUND.findall(limit)
+        if bounds:
+            checks = [cls.__complies(cls.OPERATORS.get(qualifier, qualifier), value,
+                                     cls.OPERATORS.get(operator, operator), float(bound.replace(',', '.')))
+                      for operator, bound in bounds]
+            conform = False if False in checks else None if None in checks else True
+        return cls(name, value, qualifier, unit, text, limit, reference, conform)
+
+    @staticmethod
+    def __complies(qualifier, value, operator, bound):
+        """
+        Check a result against one bound of a quality limit. A qualified result such as '<1' only gives a range of
+        actual values.
+        :param qualifier: str : Comparison operator preceding the value, '' for an exact value.
+        :param value: float : Measured value.
+        :param operator: str : Comparison operator of the bound.
+        :param bound: float : Value of the bound.
+        :return: bool : True if all actual values comply with the bound, False if none does, None otherwise.
+        """
+        low, low_open = (value, '>' == qualifier) if qualifier in ('', '>', '>=') else (float('-inf'), True)
+        high, high_open = (value, '<' == qualifier) if qualifier in ('', '<', '<=') else (float('inf'), True)
+        strict = operator in ('<', '>')
+        if operator in ('<', '<='):
+            if high < bound or (high == bound and (high_open or not strict)):
+                return True
+            if low > bound or (low == bound and (low_open or strict)):
+                return False
+        else:
+            if low > bound or (low == bound and (low_open or not strict)):
+                return True
+            if high < bound or (high == bound and (high_open or strict)):
+                return False
+        return None
+
+
 class Report(Mapping):
     """
     An analysis report. Report properties are accessible though mapping interface.
+    The HTML content is stored once, as UTF-8 bytes. Unless the parsed blocks are given, properties are parsed on
+    first access, so that reports loaded in bulk cost neither parsing nor memory for properties never read.
     """
-    def __init__(self, html):
+
+    KEYS = ('html', 'charset', 'date du prélèvement', 'commune de prélèvement', 'installation',
+            'service public de distribution', 'responsable de distribution', 'maître d\'ouvrage', 'conformité',
+            'paramètres')
+    INFOS = re.compile(rb'<h3[^>]*class=["\']?[^"\'>]*\binfos\b')
+    CHARSET = re.compile(rb'charset=([^"\'>;\s]+)', re.IGNORECASE)
+    WHITESPACE = re.compile(rb'\s+')
+
+    __slots__ = ('__content', '__fields', '__digest')
+
+    def __init__(self, html, blocks=None):
         """
-        :param html: HTML content of the report.
+        :param html: str or bytes : HTML content of the report. Bytes must be UTF-8 encoded.
+        :param blocks: list : The "block-content" divs of the report, if already parsed.
         """
-        self.__mapping = dict()
-        self.__mapping['html'] = html
-        soup = BeautifulSoup(self.__mapping['html'], 'html.parser')
-        self.__mapping['charset'] = re.sub(r'.*?charset=(.+)', r'\1', soup.find('meta')['content'])
-        blocks = [div for div in soup.find_all('div', attrs='block-content')]
-        for block in blocks.copy():
-            if None is block.find('h3', attrs=['infos']):
-                blocks.remove(block)
-        if len(blocks) < 1:
+        self.__content = html.encode('utf-8') if isinstance(html, str) else bytes(html)
+        self.__fields = None
+        self.__digest = None
+        if None is not blocks:
+            self.__fields = self.__parse(blocks)
+        elif None is self.INFOS.search(self.__content):
             raise InvalidReportException(html)
 
-        data = [re.sub(r'<td>(.*?)</td>', r'\1', td.get_text()) for td in blocks[0].find_all('td')]
+    def __parse(self, blocks):
+        """
+        :param blocks: list : The "block-content" divs of the report.
+        :return: tuple : The parsed properties, in KEYS order from 'date du prélèvement' on.
+        """
+        infos = [block for block in blocks if None is not block.find('h3', attrs=['infos'])]
+        if len(infos) < 1:
+            raise InvalidReportException(self['html'])
+
+        data = [td.get_text() for td in infos[0].find_all('td')]
         try:
-            self.__mapping['date du prélèvement'] = datetime.strptime(data[0].strip(), '%d/%m/%Y %Hh%M')
+            date = datetime.strptime(data[0].strip(), '%d/%m/%Y %Hh%M')
         except ValueError:
             try:
-                self.__mapping['date du prélèvement'] = datetime.strptime(data[0].strip(), '%d/%m/%Y %H:%M')
+                date = datetime.strptime(data[0].strip(), '%d/%m/%Y %H:%M')
             except ValueError:
-                self.__mapping['date du prélèvement'] = datetime.strptime(re.sub(r'(\d+/\d+/\d+).*', r'\1',
-                                                                                 data[0].strip()), '%d/%m/%Y')
-        self.__mapping['commune de prélèvement'] = data[1]
-        self.__mapping['installation'] = data[2]
-        self.__mapping['service public de distribution'] = data[3]
-        self.__mapping['responsable de distribution'] = data[4]
-        self.__mapping['maître d\'ouvrage'] = data[5]
+                date = datetime.strptime(re.sub(r'(\d+/\d+/\d+).*', r'\1', data[0].strip()), '%d/%m/%Y')
+        conformity = dict()
+        parameters = list()
+        for block in blocks:
+            if None is not block.find('h3', attrs=['common']):
+                for row in block.find_all('tr'):
+                    th, td = row.find('th'), row.find('td')
+                    if (None is not th) and (None is not td):
+                        conformity[th.get_text().strip()] = td.get_text().strip()
+            elif None is not block.find('h3', attrs=['params']):
+                for row in block.find_all('tr'):
+                    cells = [td.get_text().strip() for td in row.find_all('td')]
+                    if len(cells) >= 2:
+                        parameters.append(Measure.parse(*cells[:4]))
+        return (date, *data[1:6], conformity, parameters)
 
     def __getitem__(self, key):
-        return self.__mapping[key]
+        if 'html' == key:
+            return self.__content.decode('utf-8')
+        if 'charset' == key:
+            charset = self.CHARSET.search(self.__content)
+            return None if None is charset else charset.group(1).decode('ascii', 'replace')
+        try:
+            index = self.KEYS.index(key, 2)
+        except ValueError:
+            raise KeyError(key) from None
+        if None is self.__fields:
+            with stats.timer('parse'):
+                soup = parse_html(self.__content, PARSER, blocks=True, from_encoding='utf-8')
+                self.__fields = self.__parse(soup.find_all('div', attrs='block-content'))
+                # the tree holds reference cycles : free it now rather than at the next garbage collection
+                soup.decompose()
+        return self.__fields[index - 2]
 
     def __len__(self):
-        return len(self.__mapping)
+        return len(self.KEYS)
 
     def __iter__(self):
-        return iter(self.__mapping)
+        return iter(self.KEYS)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    @property
+    def content(self):
+        """
+        :return: bytes : HTML content of the report, UTF-8 encoded.
+        """
+        return self.__content
+
+    @property
+    def digest(self):
+        """
+        :return: str : SHA-256 digest of the HTML content with normalized white spaces. Reports with the same content
+                       have the same digest.
+        """
+        if None is self.__digest:
+            self.__digest = hashlib.sha256(self.WHITESPACE.sub(b' ', self.__content).strip()).hexdigest()
+        return self.__digest
+
+
+def seek_position(session, payload, date, strict=False):
+    """
+    Find the position of the first report sampled at or before a date, from payload's "posPLV" position on.
+    Reports are listed newest first, so the position is found by exponential probing followed by a binary search,
+    with O(log n) downloads.
+    :param session: An orobnat.Session instance.
+    :param payload: dict : Payload for the POST requests, derived from payload_base.
+    :param date: datetime : The date.
+    :param strict: bool : Find the first report sampled strictly before the date.
+    :return: int : The "posPLV" position, which is past the last report if there is no such report.
+    """
+    def found(position):
+        try:
+            sampled = session.dl_report({**payload, 'posPLV': position})['date du prélèvement']
+        except InvalidReportException:
+            return True
+        return sampled < date if strict else sampled <= date
+
+    low = payload['posPLV']
+    if found(low):
+        return low
+    # found(low) is False, look for a position where found() is True.
+    step = 1
+    high = low + step
+    while not found(high):
+        low = high
+        step *= 2
+        high = low + step
+    while high - low > 1:
+        middle = (low + high) // 2
+        if found(middle):
+            high = middle
+        else:
+            low = middle
+    return high
 
 
 class ReportIterator(Iterator):
     """
     Iterate over all reports for a given "region", "departement", "commune" and "reseau".
     """
-    def __init__(self, session, payload, since=None):
+    def __init__(self, session, payload, since=None, known=None, until=None):
         """
         :param session: An orobnat.Session instance.
         :param payload: dict : Payload for the POST requests, derived from payload_base.
+        :param since: datetime : Stop at the first report older than this date.
+        :param known: container : Sampling dates of already downloaded reports. Stop at the first one met.
+        :param until: datetime : Skip reports newer than this date, using seek_position().
         """
         self.__session = session
         self.__payload = payload
         self.__since = since
+        self.__known = known
+        self.__until = until
 
     def __next__(self):
+        if None is not self.__until:
+            self.__payload['posPLV'] = seek_position(self.__session, self.__payload, self.__until)
+            self.__until = None
         try:
             result = self.__session.dl_report(self.__payload)
             self.__payload['posPLV'] += 1
@@ -221,18 +622,137 @@ class ReportIterator(Iterator):
         if None is not self.__since:
             if result['date du prélèvement'] < self.__since:
                 raise StopIteration
+        if None is not self.__known:
+            if result['date du prélèvement'] in self.__known:
+                raise StopIteration
         return result
 
+    def close(self):
+        """
+        Release resources held by the iterator.
+        """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ParallelReportIterator(Iterator):
+    """
+    Iterate over all reports for a given "region", "departement", "commune" and "reseau", downloading a window of
+    reports concurrently. Reports are still yielded in order.
+    """
+    def __init__(self, session, payload, since=None, known=None, until=None, jobs=4):
+        """
+        :param session: An orobnat.Session instance.
+        :param payload: dict : Payload for the POST requests, derived from payload_base.
+        :param since: datetime : Stop at the first report older than this date.
+        :param known: container : Sampling dates of already downloaded reports. Stop at the first one met.
+        :param until: datetime : Skip reports newer than this date, using seek_position().
+        :param jobs: int : Maximum number of concurrent requests.
+        """
+        self.__session = session
+        self.__payload = payload
+        self.__since = since
+        self.__known = known
+        self.__until = until
+        self.__jobs = jobs
+        self.__position = payload['posPLV']
+        self.__pending = deque()
+        self.__executor = ThreadPoolExecutor(max_workers=jobs)
+        self.__stopped = False
+
+    def __submit(self):
+        data = self.__payload.copy()
+        data['posPLV'] = self.__position
+        self.__pending.append(self.__executor.submit(self.__session.dl_report, data))
+        self.__position += 1
+
+    def __next__(self):
+        if self.__stopped:
+            raise StopIteration
+        if None is not self.__until:
+            self.__payload['posPLV'] = seek_position(self.__session, self.__payload, self.__until)
+            self.__position = self.__payload['posPLV']
+            self.__until = None
+        while len(self.__pending) < self.__jobs:
+            self.__submit()
+        try:
+            result = self.__pending.popleft().result()
+            self.__payload['posPLV'] += 1
+        except InvalidReportException:
+            self.close()
+            raise StopIteration
+        except Exception:
+            self.close()
+            raise
+        if None is not self.__since:
+            if result['date du prélèvement'] < self.__since:
+                self.close()
+                raise StopIteration
+        if None is not self.__known:
+            if result['date du prélèvement'] in self.__known:
+                self.close()
+                raise StopIteration
+        return result
+
+    def close(self):
+        """
+        Stop iterating, cancel pending downloads and release worker threads.
+        """
+        self.__stopped = True
+        while self.__pending:
+            self.__pending.popleft().cancel()
+        self.__executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Provide a temporary path next to path, renamed to path once the block succeeds and removed if it fails, so that a
+    crash never leaves a half-written file at path.
+    :param path: str : Path of the file to write.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix=os.path.splitext(path)[1])
+    os.close(fd)
+    try:
+        yield tmp_path
+        set_default_mode(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
 
 class ExportStrategy(ABC):
     """
     Base strategy to export reports.
+    The digest of each exported report is recorded, so that a report whose content did not change is not exported
+    again.
     """
-    def __init__(self, export_dir_path):
+    def __init__(self, export_dir_path, store=None):
         """
         :param export_dir_path: The directory path where to export reports
+        :param store: dedup.ContentStore : Store each unique exported file once, and hard link exported paths to it.
+                      None to write every exported file.
         """
         self._export_dir_path = export_dir_path
+        self._store = store
+        self._digests = DigestManifest(export_dir_path)
+        # called with the report (or None) and the exception when an export completing in the background fails.
+        # Such failures are raised by close() if it is None.
+        self.on_error = None
 
     @property
     @abstractmethod
@@ -242,6 +762,57 @@ class ExportStrategy(ABC):
         """
         return ''
 
+    def path(self, report):
+        """
+        :param report: Report : An exported report.
+        :return: str : Path of the exported file.
+        """
+        return os.path.join(self._export_dir_path,
+                            report['date du prélèvement'].strftime('%Y'),
+                            '{}.{}'.format(report['date du prélèvement'].strftime('%Y-%m-%d_%H%M%S'), self.suffix))
+
+    def exists(self, report):
+        """
+        :param report: Report : A report.
+        :return: bool : True if the report has already been exported.
+        """
+        return os.path.exists(self.path(report))
+
+    def digest_path(self, report):
+        """
+        :param report: Report : A report.
+        :return: str : Path of the exported file whose digest is recorded.
+        """
+        return self.path(report)
+
+    def unchanged(self, report):
+        """
+        :param report: Report : A report.
+        :return: bool : True if the report has already been exported with the same content.
+        """
+        path = self.digest_path(report)
+        return (report.digest == self._digests.get(path)) and os.path.exists(path)
+
+    def _write_html(self, report, path):
+        """
+        Write the HTML content of a report, through the content store if any, and record its digest.
+        :param report: Report : The report.
+        :param path: str : Path of the HTML file.
+        """
+        if None is not self._store:
+            self._store.link(self._store.put(report.digest, 'html', report.content), path)
+        else:
+            with atomic_path(path) as tmp_path, open(tmp_path, 'wb') as d:
+                d.write(report.content)
+        self._digests.set(path, report.digest)
+
+    @property
+    def backlog(self):
+        """
+        :return: int : Maximum number of reports whose export may still be in progress after export() returned.
+        """
+        return 0
+
     @abstractmethod
     def export(self, report):
         """
@@ -251,6 +822,12 @@ class ExportStrategy(ABC):
         """
         pass
 
+    def close(self):
+        """
+        Finish pending exports.
+        """
+        pass
+
 
 class HTMLStrategy(ExportStrategy):
     """
@@ -258,63 +835,642 @@ class HTMLStrategy(ExportStrategy):
     """
     PREFIX = 'HTML'
 
-    def __init__(self, export_dir_path):
-        super(HTMLStrategy, self).__init__(os.path.join(export_dir_path, self.PREFIX))
+    def __init__(self, export_dir_path, store=None):
+        super(HTMLStrategy, self).__init__(os.path.join(export_dir_path, self.PREFIX), store)
 
     @property
     def suffix(self):
         return 'html'
 
     def export(self, report):
-        export_dir_path = os.path.join(self._export_dir_path, report['date du prélèvement'].strftime('%Y'))
-        os.makedirs(export_dir_path, exist_ok=True)
-        with open(os.path.join(export_dir_path,
-                               '{}.{}'.format(report['date du prélèvement'].strftime('%Y-%m-%d_%H%M%S'),
-                                              self.suffix)), 'w') as d:
-            d.write(report['html'])
+        self._write_html(report, self.path(report))
+
+
+class PDFRenderer:
+    """
+    A long-lived wkhtmltopdf process, started with --read-args-from-stdin : each line written to its standard input
+    holds the arguments of one rendering, so that a process is not started for each report.
+    wkhtmltopdf renders one document at a time, so each thread rendering PDF files owns its own renderer.
+    """
+
+    # path of the wkhtmltopdf binary, found by pdfkit if None.
+    BINARY = None
+    OPTIONS = ['--encoding', 'UTF-8']
+    # wkhtmltopdf reads lines of up to about 20000 bytes and 1000 arguments, longer renderings, like those of a year
+    # of reports, run in their own process.
+    MAX_LINE = 16384
+    MAX_ARGUMENTS = 900
+
+    __local = threading.local()
+    __renderers = list()
+    __renderers_lock = threading.Lock()
+
+    def __init__(self, binary=None):
+        """
+        :param binary: str : Path of the wkhtmltopdf binary. Default to BINARY when the process starts.
+        """
+        self.__binary = binary
+        self.__process = None
+
+    @classmethod
+    def current(cls):
+        """
+        :return: PDFRenderer : The renderer of the current thread. Its process is stopped when the interpreter exits.
+        """
+        renderer = getattr(cls.__local, 'renderer', None)
+        if None is renderer:
+            renderer = cls.__local.renderer = cls()
+            with PDFRenderer.__renderers_lock:
+                if len(PDFRenderer.__renderers) < 1:
+                    import atexit
+                    atexit.register(PDFRenderer.close_all)
+                PDFRenderer.__renderers.append(renderer)
+        return renderer
+
+    @classmethod
+    def close_all(cls):
+        """
+        Stop the processes of all renderers returned by current().
+        """
+        with PDFRenderer.__renderers_lock:
+            renderers = PDFRenderer.__renderers.copy()
+        # a renderer is kept by its thread, and started again if it is used after being closed.
+        for renderer in renderers:
+            renderer.close()
+
+    @staticmethod
+    def __quote(argument):
+        # wkhtmltopdf splits each line on blanks outside double quotes, and unescapes backslashes.
+        if '\n' in argument:
+            raise ValueError('Invalid wkhtmltopdf argument : {!r}'.format(argument))
+        return '"{}"'.format(argument.replace('\\', '\\\\').replace('"', '\\"'))
+
+    def __binary_path(self):
+        binary = self.__binary or self.BINARY
+        if None is binary:
+            import pdfkit
+            binary = pdfkit.configuration().wkhtmltopdf
+        return binary.decode('utf-8') if isinstance(binary, bytes) else binary
+
+    def __start(self):
+        import subprocess
+        self.__process = subprocess.Popen([self.__binary_path(), '--read-args-from-stdin'], stdin=subprocess.PIPE,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def render(self, inputs, output_path):
+        """
+        Render HTML files to a PDF file. The process is started on first use, and started again if it exited.
+        :param inputs: list : Paths of HTML files, rendered one after another.
+        :param output_path: str : Path of the PDF file.
+        :raise ExportException: If the rendering failed.
+        """
+        arguments = [*self.OPTIONS, *inputs, output_path]
+        line = ' '.join([self.__quote(argument) for argument in arguments])
+        if (len(line.encode('utf-8')) > self.MAX_LINE) or (len(arguments) > self.MAX_ARGUMENTS):
+            import subprocess
+            result = subprocess.run([self.__binary_path(), *arguments], stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE)
+            if 0 != result.returncode:
+                raise ExportException('wkhtmltopdf exited with code {} : {}'.format(
+                    result.returncode, ' '.join(result.stderr.decode('utf-8', 'replace').strip().splitlines()[-1:])))
+            return
+        if (None is self.__process) or (None is not self.__process.poll()):
+            self.__start()
+        messages = list()
+        try:
+            self.__process.stdin.write(line.encode('utf-8') + b'\n')
+            self.__process.stdin.flush()
+            while True:
+                # progress bars are redrawn with carriage returns, "Done" ends each rendering.
+                output = self.__process.stderr.readline()
+                if not output:
+                    raise ExportException('wkhtmltopdf exited with code {} : {}'.format(
+                        self.__process.wait(), ' '.join(messages)))
+                message = output.split(b'\r')[-1].strip().decode('utf-8', 'replace')
+                if 'Done' == message:
+                    break
+                if message and (not message.startswith(('[', 'Loading', 'Counting', 'Resolving', 'Printing'))):
+                    messages.append(message)
+        except OSError as e:
+            self.close()
+            raise ExportException('wkhtmltopdf failed : {}'.format(e)) from e
+        except ExportException:
+            self.close()
+            raise
+        if (not os.path.exists(output_path)) or (os.path.getsize(output_path) < 1):
+            raise ExportException('wkhtmltopdf produced no output : {}'.format(' '.join(messages)))
+
+    def close(self):
+        """
+        Stop the process, once its pending rendering is done.
+        """
+        process, self.__process = self.__process, None
+        if None is not process:
+            try:
+                process.stdin.close()
+                process.wait(timeout=10)
+            except Exception:  # noqa
+                process.kill()
+                process.wait()
+            process.stderr.close()
+
+
+def render_pdf(source, export_path):
+    """
+    Render HTML to PDF with the wkhtmltopdf renderer of the current thread.
+    :param source: str or list : HTML content, or paths of HTML files rendered one after another in a single PDF.
+    :param export_path: str : Path of the PDF file.
+    :return: float : Rendering time in seconds.
+    """
+    start = time.perf_counter()
+    with atomic_path(export_path) as tmp_path:
+        if isinstance(source, str):
+            html_path = '{}.html'.format(tmp_path)
+            try:
+                with open(html_path, 'w', encoding='utf-8') as f:
+                    f.write(source)
+                PDFRenderer.current().render([html_path], tmp_path)
+            finally:
+                os.remove(html_path)
+        else:
+            PDFRenderer.current().render(source, tmp_path)
+    return time.perf_counter() - start
 
 
 class PDFStrategy(ExportStrategy):
     """
     Strategy for PDF export.
+    Reports are rendered by a thread pool shared by all PDF strategies, so that rendering overlaps with downloads.
+    Each thread of the pool feeds its own long-lived wkhtmltopdf process, see PDFRenderer, and waits for it without
+    holding the GIL.
     """
     PREFIX = 'PDF'
+    WORKERS = os.cpu_count() or 1
 
-    def __init__(self, export_dir_path):
-        super(PDFStrategy, self).__init__(os.path.join(export_dir_path, self.PREFIX))
+    __executor = None
+    __executor_lock = threading.Lock()
+
+    def __init__(self, export_dir_path, store=None):
+        super(PDFStrategy, self).__init__(os.path.join(export_dir_path, self.PREFIX), store)
+        self.__lock = threading.Lock()
+        self.__pending = deque()
+        # renderings in progress in the content store, by stored file path.
+        self.__rendering = dict()
+        self.__errors = list()
+
+    @classmethod
+    def _executor(cls):
+        """
+        :return: ThreadPoolExecutor : The thread pool which renders PDF files.
+        """
+        with PDFStrategy.__executor_lock:
+            if None is PDFStrategy.__executor:
+                PDFStrategy.__executor = ThreadPoolExecutor(max_workers=cls.WORKERS, thread_name_prefix='pdf')
+            return PDFStrategy.__executor
 
     @property
     def suffix(self):
         return 'pdf'
 
+    @property
+    def backlog(self):
+        return 2 * self.WORKERS + 1
+
+    def _render(self, source, export_path, digest=None, report=None):
+        """
+        Render a PDF file on the thread pool. Block while too many renderings are pending.
+        A failed rendering is passed to on_error with its own report once it is waited for.
+        :param source: str or list : HTML content, or paths of HTML files.
+        :param export_path: str : Path of the PDF file.
+        :param digest: str : Digest of the rendered report, recorded once the rendering succeeds. With a content store,
+                       a report is rendered once in the store and export_path is linked to it.
+        :param report: Report : The rendered report, None if several reports are rendered.
+        """
+        os.makedirs(os.path.dirname(export_path), exist_ok=True)
+        with self.__lock:
+            if (None is digest) or (None is self._store):
+                future, object_path = self._executor().submit(render_pdf, source, export_path), None
+            else:
+                object_path = self._store.object_path(digest, self.suffix)
+                future = self.__rendering.get(object_path)
+                if None is future:
+                    if os.path.exists(object_path):
+                        future = Future()
+                        future.set_result(0.)
+                    else:
+                        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                        future = self._executor().submit(render_pdf, source, object_path)
+                        self.__rendering[object_path] = future
+            self.__pending.append((future, export_path, digest, object_path, report))
+        while self.__wait(2 * self.WORKERS):
+            pass
+
+    def __wait(self, limit):
+        """
+        Wait for the oldest pending rendering if more than limit renderings are pending.
+        :return: bool : True if a rendering has been waited for.
+        """
+        with self.__lock:
+            if len(self.__pending) <= limit:
+                return False
+            future, export_path, digest, object_path, report = self.__pending.popleft()
+        try:
+            elapsed = future.result()
+            if None is not object_path:
+                self._store.link(object_path, export_path)
+        except Exception as e:
+            error = ExportException('Unable to export {} : {}'.format(export_path, e))
+            error.__cause__ = e
+            if None is not self.on_error:
+                self.on_error(report, error)
+            else:
+                self.__errors.append(error)
+            return True
+        finally:
+            if None is not object_path:
+                with self.__lock:
+                    if self.__rendering.get(object_path) is future:
+                        del self.__rendering[object_path]
+        if elapsed > 0:
+            stats.add_time('render.{}'.format(self.PREFIX), elapsed)
+        else:
+            stats.incr('dedup.{}'.format(self.PREFIX))
+        if None is not digest:
+            self._digests.set(export_path, digest)
+        return True
+
     def export(self, report):
-        export_dir_path = os.path.join(self._export_dir_path, report['date du prélèvement'].strftime('%Y'))
-        os.makedirs(export_dir_path, exist_ok=True)
-        pdfkit.from_string(report['html'],
-                           os.path.join(export_dir_path,
-                                        '{}.{}'.format(report['date du prélèvement'].strftime('%Y-%m-%d_%H%M%S'),
-                                                       self.suffix)),
-                           options={'encoding': 'UTF-8'})
+        self._render(report['html'], self.path(report), report.digest, report)
+
+    def close(self):
+        while self.__wait(0):
+            pass
+        errors, self.__errors = self.__errors, list()
+        if errors:
+            raise errors[0]
+
+
+class PDFYearStrategy(PDFStrategy):
+    """
+    Strategy for PDF export, merging all reports of a year in a single PDF file.
+    The HTML content of each report is kept aside so that a year may be rendered again when new reports are exported.
+    """
+    PREFIX = 'PDF-ANNUEL'
+    SOURCES = '.sources'
+
+    def __init__(self, export_dir_path, store=None):
+        super(PDFYearStrategy, self).__init__(export_dir_path, store)
+        self.__years = set()
+
+    def path(self, report):
+        return os.path.join(self._export_dir_path, '{}.{}'.format(report['date du prélèvement'].strftime('%Y'),
+                                                                   self.suffix))
+
+    def source_path(self, report):
+        """
+        :param report: Report : An exported report.
+        :return: str : Path of the HTML content of the report.
+        """
+        return os.path.join(self._export_dir_path, self.SOURCES, report['date du prélèvement'].strftime('%Y'),
+                            '{}.html'.format(report['date du prélèvement'].strftime('%Y-%m-%d_%H%M%S')))
+
+    def exists(self, report):
+        return os.path.exists(self.source_path(report)) and os.path.exists(self.path(report))
+
+    def digest_path(self, report):
+        return self.source_path(report)
+
+    def unchanged(self, report):
+        return super(PDFYearStrategy, self).unchanged(report) and os.path.exists(self.path(report))
+
+    def export(self, report):
+        self._write_html(report, self.source_path(report))
+        self.__years.add(report['date du prélèvement'].strftime('%Y'))
+
+    def close(self):
+        for year in sorted(self.__years):
+            sources_path = os.path.join(self._export_dir_path, self.SOURCES, year)
+            self._render([os.path.join(sources_path, name) for name in sorted(os.listdir(sources_path))
+                          if not name.startswith('.')],
+                         os.path.join(self._export_dir_path, '{}.{}'.format(year, self.suffix)))
+        self.__years.clear()
+        super(PDFYearStrategy, self).close()
+
+
+class CSVStrategy(ExportStrategy):
+    """
+    Strategy for CSV export of measured parameters, one row per parameter, one file per year.
+    """
+    PREFIX = 'CSV'
+    COLUMNS = ['date du prélèvement', 'commune de prélèvement', 'installation', 'service public de distribution',
+               'responsable de distribution', 'maître d\'ouvrage', 'paramètre', 'valeur', 'qualificatif', 'unité',
+               'résultat', 'limite de qualité', 'référence de qualité', 'conforme']
+
+    def __init__(self, export_dir_path, store=None):
+        super(CSVStrategy, self).__init__(os.path.join(export_dir_path, self.PREFIX), store)
+        self.__lock = threading.Lock()
+        self.__dates = dict()
+
+    @property
+    def suffix(self):
+        return 'csv'
+
+    def path(self, report):
+        return os.path.join(self._export_dir_path, '{}.{}'.format(report['date du prélèvement'].strftime('%Y'),
+                                                                   self.suffix))
+
+    def __exported_dates(self, export_path):
+        """
+        :return: set : Sampling dates already exported in a file, read once.
+        """
+        if export_path not in self.__dates:
+            self.__dates[export_path] = set()
+            if os.path.exists(export_path):
+                with open(export_path, newline='', encoding='utf-8') as f:
+                    self.__dates[export_path] = {row[self.COLUMNS[0]] for row in csv.DictReader(f)}
+        return self.__dates[export_path]
+
+    def exists(self, report):
+        with self.__lock:
+            return report['date du prélèvement'].isoformat() in self.__exported_dates(self.path(report))
+
+    def export(self, report):
+        export_path = self.path(report)
+        date = report['date du prélèvement'].isoformat()
+        infos = [date] + [report[key] for key in self.COLUMNS[1:6]]
+        with self.__lock:
+            if date in self.__exported_dates(export_path):
+                return
+            os.makedirs(os.path.dirname(export_path), exist_ok=True)
+            new_file = not os.path.exists(export_path)
+            with open(export_path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(self.COLUMNS)
+                writer.writerows([infos + [measure.name, measure.value, measure.qualifier, measure.unit, measure.text,
+                                           measure.limit, measure.reference, measure.conform]
+                                  for measure in report['paramètres']])
+            self.__exported_dates(export_path).add(date)
+
+
+class ZIPStrategy(ExportStrategy):
+    """
+    Strategy for HTML export in one compressed ZIP archive per year. Reports may be read back one by one, by sampling
+    date, without extracting the archive.
+    An archive is copied aside when the first report of a run is appended to it, and replaced by the copy once the
+    strategy is closed, so that an interrupted run never corrupts it.
+    """
+    PREFIX = 'ZIP'
+    ENTRY_FORMAT = '%Y-%m-%d_%H%M%S'
+
+    def __init__(self, export_dir_path, store=None):
+        super(ZIPStrategy, self).__init__(os.path.join(export_dir_path, self.PREFIX), store)
+        self.__lock = threading.Lock()
+        # names of the entries of each archive, read once.
+        self.__names = dict()
+        # archives being appended to : {archive path: (copy path, ZipFile)}
+        self.__archives = dict()
+        # archives holding superseded entries, compacted when closed.
+        self.__replaced = set()
+
+    @property
+    def suffix(self):
+        return 'zip'
+
+    def path(self, report):
+        return self.__archive_path(report['date du prélèvement'])
+
+    def __archive_path(self, date):
+        return os.path.join(self._export_dir_path, '{}.{}'.format(date.strftime('%Y'), self.suffix))
+
+    def entry_name(self, date):
+        """
+        :param date: datetime : Sampling date of a report.
+        :return: str : Name of the archive entry of the report.
+        """
+        return '{}.html'.format(date.strftime(self.ENTRY_FORMAT))
+
+    def __entries(self, archive_path):
+        if archive_path not in self.__names:
+            self.__names[archive_path] = set()
+            if os.path.exists(archive_path):
+                with zipfile.ZipFile(archive_path) as archive:
+                    self.__names[archive_path] = set(archive.namelist())
+        return self.__names[archive_path]
+
+    def exists(self, report):
+        with self.__lock:
+            return self.entry_name(report['date du prélèvement']) in self.__entries(self.path(report))
+
+    def digest_path(self, report):
+        return os.path.join(self.path(report), self.entry_name(report['date du prélèvement']))
+
+    def unchanged(self, report):
+        return (report.digest == self._digests.get(self.digest_path(report))) and self.exists(report)
+
+    def __archive(self, archive_path):
+        """
+        :return: zipfile.ZipFile : The copy of an archive which reports of the run are appended to.
+        """
+        if archive_path not in self.__archives:
+            os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(archive_path), prefix='.', suffix='.zip')
+            os.close(fd)
+            if os.path.exists(archive_path):
+                shutil.copyfile(archive_path, tmp_path)
+            self.__archives[archive_path] = (tmp_path, zipfile.ZipFile(
+                tmp_path, 'a' if os.path.exists(archive_path) else 'w', compression=zipfile.ZIP_DEFLATED))
+        return self.__archives[archive_path][1]
+
+    def export(self, report):
+        date = report['date du prélèvement']
+        archive_path = self.path(report)
+        entry = zipfile.ZipInfo(self.entry_name(date), date_time=date.timetuple()[:6])
+        entry.compress_type = zipfile.ZIP_DEFLATED
+        with self.__lock:
+            if entry.filename in self.__entries(archive_path):
+                self.__replaced.add(archive_path)
+            with warnings.catch_warnings():
+                # a report whose content changed is appended again, superseded entries are removed when closed.
+                warnings.simplefilter('ignore', UserWarning)
+                self.__archive(archive_path).writestr(entry, report.content)
+            self.__entries(archive_path).add(entry.filename)
+        self._digests.set(self.digest_path(report), report.digest)
+
+    @staticmethod
+    def __compact(archive_path):
+        """
+        Rewrite an archive with the last entry of each name only.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(archive_path), prefix='.', suffix='.zip')
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(archive_path) as source, \
+                    zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as target:
+                for entry in {entry.filename: entry for entry in source.infolist()}.values():
+                    target.writestr(entry, source.read(entry))
+            os.replace(tmp_path, archive_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def dates(self):
+        """
+        :return: list : Sampling dates of all archived reports, oldest first.
+        """
+        with self.__lock:
+            names = [name for archive_path in glob.glob(os.path.join(self._export_dir_path, '*.' + self.suffix))
+                     for name in self.__entries(archive_path)]
+        return sorted(datetime.strptime(os.path.splitext(name)[0], self.ENTRY_FORMAT) for name in names)
+
+    def read(self, date):
+        """
+        Read an archived report, decompressing its entry only.
+        :param date: datetime : Sampling date of the report.
+        :return: Report : The report, None if it is not archived.
+        """
+        try:
+            with zipfile.ZipFile(self.__archive_path(date)) as archive:
+                return Report(archive.read(self.entry_name(date)))
+        except (FileNotFoundError, KeyError):
+            return None
+
+    def close(self):
+        with self.__lock:
+            error = None
+            for archive_path, (tmp_path, archive) in self.__archives.items():
+                try:
+                    archive.close()
+                    if archive_path in self.__replaced:
+                        self.__compact(tmp_path)
+                    set_default_mode(tmp_path)
+                    os.replace(tmp_path, archive_path)
+                except (OSError, zipfile.BadZipFile) as e:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    self.__names.pop(archive_path, None)
+                    error = error or ExportException('Unable to export {} : {}'.format(archive_path, e))
+            self.__archives.clear()
+            self.__replaced.clear()
+        if None is not error:
+            raise error
 
 
 class ReportExporter:
     """
     Export a report with several strategies.
     """
-    def __init__(self, export_dir_path, strategies=None):
+    def __init__(self, export_dir_path, strategies=None, skip_existing=False, workers=None, on_error=None,
+                 store=None):
         """
         :param export_dir_path: The directory path where to export reports.
         :param strategies: iterable : Strategies for each export format.
+        :param skip_existing: bool : Do not export again a report whose output already exists. Reports whose content
+                              did not change since their last export are never exported again.
+        :param workers: int or dict : Number of worker threads for all strategies, or a dict {strategy: number}.
+                        Reports are then exported in the background, through one bounded queue per strategy.
+                        None to export reports synchronously.
+        :param on_error: callable : Called with the strategy, the report (or None) and the exception when an export
+                         fails. Failed exports never stop the others.
+        :param store: dedup.ContentStore : Store shared by all strategies, to store each unique exported file once.
         """
         self.__strategies = set()
+        self.__skip_existing = skip_existing
+        self.__on_error = on_error
+        self.__failures = list()
+        self.__queues = dict()
+        self.__threads = dict()
         if None is not strategies:
             for strategy in set(strategies):
-                self.__strategies.add(strategy(export_dir_path))
+                instance = strategy(export_dir_path, store)
+                instance.on_error = partial(self.__fail, instance)
+                self.__strategies.add(instance)
+        if None is not workers:
+            for strategy in self.__strategies:
+                count = workers if isinstance(workers, int) else workers.get(type(strategy), 1)
+                self.__queues[strategy] = Queue(maxsize=2 * count)
+                self.__threads[strategy] = [threading.Thread(target=self.__work,
+                                                             args=(strategy, self.__queues[strategy]),
+                                                             daemon=True) for _ in range(count)]
+                for thread in self.__threads[strategy]:
+                    thread.start()
+
+    @property
+    def backlog(self):
+        """
+        :return: int : Maximum number of reports whose export may still be in progress after export() returned.
+        """
+        return max([strategy.backlog + (self.__queues[strategy].maxsize + len(self.__threads[strategy])
+                                        if strategy in self.__queues else 0)
+                    for strategy in self.__strategies] or [0])
+
+    @property
+    def failures(self):
+        """
+        :return: list : (strategy, report, exception) for each failed export, report being None if the failure
+                        concerns several reports.
+        """
+        return self.__failures.copy()
+
+    def __fail(self, strategy, report, exception):
+        self.__failures.append((strategy, report, exception))
+        if None is not self.__on_error:
+            self.__on_error(strategy, report, exception)
+
+    def __work(self, strategy, queue):
+        while True:
+            report = queue.get()
+            if None is report:
+                break
+            try:
+                self.__export(strategy, report)
+            except Exception as e:
+                self.__fail(strategy, report, e)
+
+    @staticmethod
+    def __export(strategy, report):
+        with stats.timer('export.{}'.format(strategy.PREFIX)):
+            strategy.export(report)
 
     def export(self, report):
         """
         Export a report in all requested formats.
+        In background mode, block while the queue of a strategy is full.
         :param report: Report : The report to export.
         """
         for strategy in self.__strategies:
-            strategy.export(report)
+            if self.__skip_existing and strategy.exists(report):
+                continue
+            if strategy.unchanged(report):
+                stats.incr('export.unchanged')
+                continue
+            if strategy in self.__queues:
+                self.__queues[strategy].put(report)
+            else:
+                try:
+                    self.__export(strategy, report)
+                except Exception as e:
+                    self.__fail(strategy, report, e)
+
+    def close(self):
+        """
+        Finish pending exports of all strategies. Failures are reported to on_error and listed in failures.
+        """
+        for strategy, threads in self.__threads.items():
+            for _ in threads:
+                self.__queues[strategy].put(None)
+        for threads in self.__threads.values():
+            for thread in threads:
+                thread.join()
+        self.__threads.clear()
+        for strategy in self.__strategies:
+            try:
+                strategy.close()
+            except Exception as e:
+                self.__fail(strategy, None, e)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from orobnat import Session, Target, InvalidReportException, seek_position
+from ratelimit import HostRateLimiter
+
+
+class AsyncSession:
+    """
+    An asyncio front-end to orobnat.Session.
+    Blocking requests run on a dedicated thread pool, under a global concurrency limit, so that many "reseaux" may be
+    crawled at once from a single event loop. Requests are paced per host by the rate limiter of the session, which
+    also paces their retries.
+    """
+
+    DEFAULT_CONCURRENCY = 8
+
+    def __init__(self, session, concurrency=DEFAULT_CONCURRENCY, rate=None):
+        """
+        :param session: An orobnat.Session instance. It is still usable synchronously, e.g. from other threads.
+        :param concurrency: int : Maximum number of requests in flight.
+        :param rate: float : Maximum number of requests per second and per host. None to keep the rate limiter of the
+                     session.
+        """
+        self.__session = session
+        self.__session.resize_pool(concurrency)
+        if None is not rate:
+            self.__session.limiter = HostRateLimiter(rate)
+        self.__semaphore = asyncio.Semaphore(concurrency)
+        self.__executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='async')
+
+    @classmethod
+    def create(cls, args, cache=None, concurrency=DEFAULT_CONCURRENCY, rate=None):
+        """
+        Build an orobnat.Session and wrap it. The session makes no request until a list or a report is needed.
+        :param args: A dict which may contains any useful information to be used across the session.
+        :param cache: cache.ResponseCache : Persistent cache of the lists, None to disable it.
+        :param concurrency: int : Maximum number of requests in flight.
+        :param rate: float : Maximum number of requests per second and per host. None means unlimited.
+        :return: AsyncSession
+        """
+        return cls(Session(args, cache=cache), concurrency, rate)
+
+    @property
+    def session(self):
+        """
+        :return: The underlying orobnat.Session instance.
+        """
+        return self.__session
+
+    async def __call(self, func, *args):
+        async with self.__semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self.__executor, partial(func, *args))
+
+    async def regions(self):
+        """
+        :return: A dict of available "regions" {id: name}
+        """
+        return await self.__call(getattr, self.__session, 'regions')
+
+    async def departements(self, region):
+        """
+        :param region: str : "region" id.
+        :return: A dict of available "departements" {id: name} for the given "region".
+        """
+        return await self.__call(self.__session.get_departements, region)
+
+    async def communes(self, region, departement):
+        """
+        :param region: str : "region" id.
+        :param departement: str : "departement" id.
+        :return: A dict of available "communes" {id: name} for the given "departement".
+        """
+        return await self.__call(self.__session.get_communes, region, departement)
+
+    async def reseaux(self, region, departement, commune):
+        """
+        :param region: str : "region" id.
+        :param departement: str : "departement" id.
+        :param commune: str : "commune" id.
+        :return: A dict of available "reseaux" {id: name} for the given "commune".
+        """
+        return await self.__call(self.__session.get_reseaux, region, departement, commune)
+
+    async def targets(self, region, departement=None, commune=None, reseau=None):
+        """
+        Walk the hierarchy below the given ids, like orobnat.Session.iter_targets(). The lists of each level are
+        fetched concurrently.
+        :param region: str : "region" id.
+        :param departement: str : "departement" id. All "departements" of the "region" if None.
+        :param commune: str : "commune" id. All "communes" of the "departement" if None.
+        :param reseau: str : "reseau" id. All "reseaux" of the "commune" if None.
+        :return: list : Target instances, in the order of the lists.
+        """
+        departements = [departement] if None is not departement else list(await self.departements(region))
+        departements = list(filter(None, departements))
+        if None is not commune:
+            communes = [(a_departement, [commune]) for a_departement in departements]
+        else:
+            lists = await asyncio.gather(*[self.communes(region, a_departement) for a_departement in departements])
+            communes = list(zip(departements, lists))
+        pairs = [(a_departement, a_commune) for a_departement, items in communes for a_commune in filter(None, items)]
+        if None is not reseau:
+            reseaux = [[reseau]] * len(pairs)
+        else:
+            reseaux = await asyncio.gather(*[self.reseaux(region, *pair) for pair in pairs])
+        return [Target(region, *pair, a_reseau)
+                for pair, items in zip(pairs, reseaux) for a_reseau in filter(None, items)]
+
+    async def dl_report(self, data):
+        """
+        Download a report.
+        :param data: dict : Payload for the POST requests, derived from payload_base.
+        :return: Report : The downloaded report.
+        """
+        return await self.__call(self.__session.dl_report, data)
+
+    async def seek_position(self, payload, date, strict=False):
+        """
+        Find the position of the first report sampled at or before a date, see orobnat.seek_position(). The search
+        holds a single slot of the concurrency limit.
+        :param payload: dict : Payload for the POST requests, derived from payload_base.
+        :param date: datetime : The date.
+        :param strict: bool : Find the first report sampled strictly before the date.
+        :return: int : The "posPLV" position.
+        """
+        return await self.__call(seek_position, self.__session, payload, date, strict)
+
+    async def close(self):
+        """
+        Wait for running requests and close the underlying session.
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self.__executor.shutdown)
+        self.__session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class AsyncReportIterator(AsyncIterator):
+    """
+    Asynchronously iterate over all reports for a given "region", "departement", "commune" and "reseau".
+    Reports of one "reseau" are downloaded one after the other, iterate over several "reseaux" at once to crawl them
+    concurrently.
+    """
+    def __init__(self, session, payload, since=None, known=None, until=None):
+        """
+        :param session: An AsyncSession instance.
+        :param payload: dict : Payload for the POST requests, derived from payload_base.
+        :param since: datetime : Stop at the first report older than this date.
+        :param known: container : Sampling dates of already downloaded reports. Stop at the first one met.
+        :param until: datetime : Skip reports newer than this date, using seek_position().
+        """
+        self.__session = session
+        self.__payload = payload
+        self.__since = since
+        self.__known = known
+        self.__until = until
+
+    async def __anext__(self):
+        if None is not self.__until:
+            self.__payload['posPLV'] = await self.__session.seek_position(self.__payload.copy(), self.__until)
+            self.__until = None
+        try:
+            result = await self.__session.dl_report(self.__payload.copy())
+            self.__payload['posPLV'] += 1
+        except InvalidReportException:
+            raise StopAsyncIteration
+        if None is not self.__since:
+            if result['date du prélèvement'] < self.__since:
+                raise StopAsyncIteration
+        if None is not self.__known:
+            if result['date du prélèvement'] in self.__known:
+                raise StopAsyncIteration
+        return result
@@ -1,46 +1,550 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import heapq
+import itertools
+import os
+import random
+import shutil
+import signal
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
 from logger import logger
-from orobnat import ReportExporter, HTMLStrategy, PDFStrategy, Session, ReportIterator
+from orobnat import ReportExporter, HTMLStrategy, PDFStrategy, PDFYearStrategy, CSVStrategy, ZIPStrategy, \
+    Session, ReportIterator, ParallelReportIterator, Target, ExportException
+from index import DownloadIndex
+from catalog import ReportCatalog
+from orobnat_query import parse_date
+from checkpoint import Checkpoint
+from dedup import ContentStore
+from shard import Shard, WorkQueue
+from cache import ResponseCache
+from stats import stats, Profiler
+from ratelimit import HostRateLimiter
+from replay import RecordingAdapter, ReplayAdapter
 from argparse import ArgumentParser, RawTextHelpFormatter, ArgumentError, SUPPRESS
 from datetime import datetime
 
-EXPORT_FORMATS = {'PDF': PDFStrategy, 'HTML': HTMLStrategy}
+# randomization of the watch intervals, so that runs of targets sharing an interval drift apart.
+WATCH_JITTER = .1
+# the session on orobnat.sante.gouv.fr is opened again after this idle time, in seconds.
+WATCH_IDLE = 600.
+DEFAULT_WATCH_INTERVAL = 86400
+
+EXPORT_FORMATS = {'PDF': PDFStrategy, 'HTML': HTMLStrategy, 'PDF-ANNUEL': PDFYearStrategy, 'CSV': CSVStrategy,
+                  'ZIP': ZIPStrategy}
 DEFAULT_EXPORT_FORMAT = list(EXPORT_FORMATS.keys())[0]
 
 
+def parse_export_jobs(values):
+    """
+    Parse the number of export workers for each export format.
+    :param values: list : Items formatted as 'N' for all formats or 'FORMAT=N' for a given format.
+    :return: dict : {strategy: number}
+    """
+    result = dict()
+    for value in values:
+        a_format, _, count = value.rpartition('=')
+        if (not count.isdigit()) or (int(count) < 1):
+            raise ValueError('Nombre de tâches invalide : {}'.format(value))
+        if '' == a_format:
+            result.update({strategy: int(count) for strategy in EXPORT_FORMATS.values()})
+        elif a_format in EXPORT_FORMATS:
+            result[EXPORT_FORMATS[a_format]] = int(count)
+        else:
+            raise ValueError('Format d\'export invalide : {}'.format(a_format))
+    return result
+
+
+def dl_target(session, target, export_dir_path, index=None, checkpoint=None, report_catalog=None, **kwargs):
+    """
+    Download all reports of a target.
+    :param session: An orobnat.Session instance.
+    :param target: orobnat.Target : The target.
+    :param export_dir_path: str : The directory path where to export reports.
+    :param index: index.DownloadIndex : Index of exported reports, None to disable it.
+    :param checkpoint: checkpoint.Checkpoint : Progress of the run, None to disable it.
+    :param report_catalog: catalog.ReportCatalog : Database of report contents, None to disable it.
+    :param kwargs: Misc params retrieved from command line.
+    :return: int : Number of exported reports.
+    :raise ExportException: If some exports failed, once all reports are downloaded. The target is then neither
+                            indexed as complete nor recorded as done in the checkpoint.
+    """
+    payload = target.payload
+    if None is not checkpoint:
+        if checkpoint.done(target):
+            return 0
+        payload['posPLV'] = checkpoint.position(target)
+    start_position = payload['posPLV']
+    # "posPLV" positions of the downloaded reports, and of the reports whose export failed. A failure concerning
+    # several reports counts as a failure at the start position.
+    positions = dict()
+    failed = list()
+
+    def on_error(strategy, report, exception):
+        logger.error('Export failed for {}{} ({}) : {}'.format(
+            target, '' if None is report else ', report {}'.format(report['date du prélèvement']), strategy.PREFIX,
+            exception))
+        logger.debug(''.join(traceback.format_exception(exception)))
+        failed.append(start_position if None is report else positions.get(report['date du prélèvement'],
+                                                                          start_position))
+
+    store = None
+    if kwargs['dedup']:
+        store = ContentStore(os.path.join(kwargs['CHEMIN'], ContentStore.DIRNAME))
+    exporter = ReportExporter(export_dir_path, [EXPORT_FORMATS[a_format] for a_format in kwargs['format']],
+                              skip_existing=kwargs['incremental'] or kwargs['resume'], workers=kwargs['export_jobs'],
+                              on_error=on_error, store=store)
+    known = None
+    if (None is not index) and kwargs['incremental']:
+        known = index.known(target, kwargs['format'])
+    if kwargs['jobs'] > 1:
+        reports = ParallelReportIterator(session, payload, since=kwargs['since'], known=known, until=kwargs['until'],
+                                         jobs=kwargs['jobs'])
+    else:
+        reports = ReportIterator(session, payload, since=kwargs['since'], known=known, until=kwargs['until'])
+    dates = list()
+    with exporter, reports:
+        for report in reports:
+            logger.info('Export report : {}'.format(report['date du prélèvement']))
+            positions.setdefault(report['date du prélèvement'], payload['posPLV'] - 1)
+            exporter.export(report)
+            stats.incr('reports')
+            dates.append(report['date du prélèvement'])
+            if None is not report_catalog:
+                report_catalog.add(target, report)
+            if None is not checkpoint:
+                # reports still in the export backlog are not done yet, nor are reports whose export failed.
+                checkpoint.update(target, min([max(start_position, payload['posPLV'] - exporter.backlog)] + failed))
+    if None is not report_catalog:
+        report_catalog.commit()
+    if len(exporter.failures) > 0:
+        if None is not checkpoint:
+            # exports failing while the exporter is closed are only known now.
+            checkpoint.update(target, min(failed))
+        raise ExportException('{} exports failed for {}'.format(len(exporter.failures), target))
+    # exports may complete asynchronously, index them once the exporter is closed.
+    if None is not index:
+        for date in dates:
+            index.add(target, date, kwargs['format'])
+        if (None is kwargs['since']) and (None is kwargs['until']):
+            index.set_complete(target, kwargs['format'])
+    if None is not checkpoint:
+        checkpoint.set_done(target)
+    return len(dates)
+
+
+def open_index(**kwargs):
+    """
+    :param kwargs: Misc params retrieved from command line.
+    :return: index.DownloadIndex : The index of exported reports in the export directory, None for dry runs.
+    """
+    if kwargs['dry_run']:
+        return None
+    os.makedirs(kwargs['CHEMIN'], exist_ok=True)
+    return DownloadIndex(os.path.join(kwargs['CHEMIN'], DownloadIndex.FILENAME))
+
+
+def open_catalog(**kwargs):
+    """
+    :param kwargs: Misc params retrieved from command line.
+    :return: catalog.ReportCatalog : The database of report contents in the export directory, None if it is not
+             requested and for dry runs.
+    """
+    if kwargs['dry_run'] or (not kwargs['catalog']):
+        return None
+    os.makedirs(kwargs['CHEMIN'], exist_ok=True)
+    return ReportCatalog(os.path.join(kwargs['CHEMIN'], ReportCatalog.FILENAME))
+
+
+def open_checkpoint(**kwargs):
+    """
+    :param kwargs: Misc params retrieved from command line.
+    :return: checkpoint.Checkpoint : The progress of the run, saved in the export directory. None for dry runs and
+             with a work queue, which records the progress of all processes.
+    """
+    if kwargs['dry_run'] or (None is not kwargs['queue']):
+        return None
+    os.makedirs(kwargs['CHEMIN'], exist_ok=True)
+    filename = Checkpoint.FILENAME
+    if None is not kwargs['shard']:
+        # shards sharing an export directory each save their own progress.
+        root, ext = os.path.splitext(filename)
+        filename = '{}.{}{}'.format(root, kwargs['shard'].suffix, ext)
+    return Checkpoint(os.path.join(kwargs['CHEMIN'], filename), resume=kwargs['resume'])
+
+
 def dl_reports(session, **kwargs):
     """
     Download all reports for given "region", "departement", "commune" and "reseau".
     :param session: An orobnat.Session instance.
     :param kwargs: Misc params retrieved from command line.
     """
-    exporter = ReportExporter(kwargs['CHEMIN'], [EXPORT_FORMATS[a_format] for a_format in kwargs['format']])
-    req_data = {'methode': 'rechercher',
-                'idRegion': kwargs['region'],
-                'usd': 'AEP',
-                'posPLV': 0,
-                'departement': kwargs['departement'],
-                'communeDepartement': kwargs['commune'],
-                'reseau': kwargs['reseau']}
+    target = Target(kwargs['region'], kwargs['departement'], kwargs['commune'], kwargs['reseau'])
+    index = open_index(**kwargs)
+    checkpoint = open_checkpoint(**kwargs)
+    catalog = open_catalog(**kwargs)
+    try:
+        if kwargs['jobs'] > 1:
+            session.resize_pool(kwargs['jobs'])
+        dl_target(session, target, kwargs['CHEMIN'], index, checkpoint, catalog, **kwargs)
+        if None is not checkpoint:
+            checkpoint.clear()
+    except BaseException:
+        if None is not checkpoint:
+            checkpoint.save()
+        raise
+    finally:
+        if None is not index:
+            index.close()
+        if None is not catalog:
+            catalog.close()
+
+
+def read_schedule(path, interval=None):
+    """
+    Read a manifest file. Each line holds a "region" id optionally followed by "departement", "commune" and "reseau"
+    ids, separated by blanks. Missing trailing ids select every item of that level. Text after '#' is ignored.
+    A line may end with '@N' to watch its targets every N seconds.
+    :param path: str : Path of the manifest file.
+    :param interval: int : Watch interval of the lines which do not set it, in seconds.
+    :return: list : (tuple of ids, interval) for each line.
+    """
+    schedule = list()
+    with open(path) as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            line_interval = interval
+            if fields and fields[-1].startswith('@'):
+                if (not fields[-1][1:].isdigit()) or (int(fields[-1][1:]) < 1):
+                    raise ValueError('Invalid manifest line : {}'.format(line.strip()))
+                line_interval = int(fields.pop()[1:])
+            if len(fields) > 4:
+                raise ValueError('Invalid manifest line : {}'.format(line.strip()))
+            if fields:
+                schedule.append((tuple(fields), line_interval))
+    return schedule
+
+
+def read_manifest(path):
+    """
+    Read a manifest file, see read_schedule().
+    :param path: str : Path of the manifest file.
+    :return: list : Tuples of ids.
+    """
+    return [selection for selection, _ in read_schedule(path)]
+
+
+def dl_bulk(session, **kwargs):
+    """
+    Download all reports for every "reseau" below the selected "departement" or "commune", or listed in a manifest.
+    Reports of each target are exported in CHEMIN/<region>/<departement>/<commune>/<reseau>.
+    With a shard, only the targets of the shard are downloaded. With a work queue, targets are added to the queue,
+    and leased one at a time until every target of the queue is done, so that several processes share the work.
+    :param session: An orobnat.Session instance.
+    :param kwargs: Misc params retrieved from command line.
+    """
+    if None is not kwargs['manifest']:
+        selections = read_manifest(kwargs['manifest'])
+    elif kwargs['all_communes']:
+        selections = [(kwargs['region'], kwargs['departement'])]
+    else:
+        selections = [(kwargs['region'], kwargs['departement'], kwargs['commune'])]
+
+    def iter_targets():
+        for selection in selections:
+            for target in session.iter_targets(*selection):
+                if (None is kwargs['shard']) or (target in kwargs['shard']):
+                    yield target
+
+    def dl_one(target):
+        return dl_target(session, target, os.path.join(kwargs['CHEMIN'], *target), index, checkpoint, catalog,
+                         **{**kwargs, 'jobs': 1})
+
+    def dl_leased():
+        # lease targets until the queue is drained, a failed target is given back to the queue.
+        results = list()
+        target = queue.lease()
+        while None is not target:
+            try:
+                results.append((target, dl_one(target)))
+                queue.set_done(target)
+            except Exception:  # noqa
+                results.append((target, None))
+                logger.error('Download failed for {} :\n{}'.format(target, traceback.format_exc()))
+                queue.release(target)
+            target = queue.lease()
+        return results
+
+    start = time.monotonic()
+    index = open_index(**kwargs)
+    checkpoint = open_checkpoint(**kwargs)
+    catalog = open_catalog(**kwargs)
+    queue = None if None is kwargs['queue'] else WorkQueue(kwargs['queue'])
+    session.resize_pool(kwargs['jobs'])
+    futures = dict()
+    try:
+        with ThreadPoolExecutor(max_workers=kwargs['jobs']) as executor:
+            if None is not queue:
+                # the lists are walked before the queue is locked for writing, which blocks the other processes.
+                queue.add(list(iter_targets()))
+                workers = [executor.submit(dl_leased) for _ in range(kwargs['jobs'])]
+            else:
+                for target in iter_targets():
+                    if target not in futures:
+                        futures[target] = executor.submit(dl_one, target)
+        failed = 0
+        count = 0
+        if None is not queue:
+            for worker in workers:
+                for target, result in worker.result():
+                    # a target which failed may have been leased again, and succeeded.
+                    futures[target] = futures.get(target) if None is result else result
+                    count += 0 if None is result else result
+            failed = len([result for result in futures.values() if None is result])
+            logger.info('Queue : {}'.format(', '.join(['{} {}'.format(number, state)
+                                                        for state, number in sorted(queue.counts().items())])))
+        else:
+            for target, future in futures.items():
+                try:
+                    count += future.result()
+                except Exception:  # noqa
+                    failed += 1
+                    logger.error('Download failed for {} :\n{}'.format(target, traceback.format_exc()))
+        if None is not checkpoint:
+            # the progress of the failed targets is kept for --resume.
+            if failed < 1:
+                checkpoint.clear()
+            else:
+                checkpoint.save()
+    except BaseException:
+        if None is not checkpoint:
+            checkpoint.save()
+        raise
+    finally:
+        if None is not index:
+            index.close()
+        if None is not catalog:
+            catalog.close()
+        if None is not queue:
+            queue.close()
+    logger.info('Summary : {} targets, {} failed, {} reports exported in {:.1f}s'.format(
+        len(futures), failed, count, time.monotonic() - start))
+
+
+def watch(session, **kwargs):
+    """
+    Download new reports of the targets listed in a manifest, each on its own schedule, until SIGTERM or SIGINT is
+    received. The session and its connection pool are kept for the whole run.
+    Runs of each target are spread over its interval and randomized, so that the server never sees a burst. Each run
+    stops at the first report already exported, like with --incremental. With a shard, only the targets of the shard
+    are watched.
+    Reports of each target are exported in CHEMIN/<region>/<departement>/<commune>/<reseau>.
+    :param session: An orobnat.Session instance.
+    :param kwargs: Misc params retrieved from command line.
+    """
+    stopping = list()
+
+    def on_signal(signum, frame):
+        logger.info('Signal {} received, stopping once running downloads are done.'.format(signum))
+        stopping.append(signum)
+
+    def dl_one(target):
+        return dl_target(session, target, os.path.join(kwargs['CHEMIN'], *target), index, None, catalog,
+                         **{**kwargs, 'jobs': 1, 'incremental': True})
 
-    for report in ReportIterator(session, req_data, since=kwargs['since']):
-        logger.info('Export report : {}'.format(report['date du prélèvement']))
-        exporter.export(report)
+    def next_run(interval):
+        return time.monotonic() + interval * random.uniform(1 - WATCH_JITTER, 1 + WATCH_JITTER)
+
+    handlers = {signum: signal.signal(signum, on_signal) for signum in (signal.SIGTERM, signal.SIGINT)}
+    index = open_index(**kwargs)
+    catalog = open_catalog(**kwargs)
+    session.resize_pool(kwargs['jobs'])
+    try:
+        intervals = dict()
+        for selection, interval in read_schedule(kwargs['watch'], kwargs['interval']):
+            for target in session.iter_targets(*selection):
+                if (None is kwargs['shard']) or (target in kwargs['shard']):
+                    intervals[target] = min(interval, intervals.get(target, interval))
+                if stopping:
+                    return
+        # (time of the next run, sequence number, target), first runs are spread over the interval of each target.
+        sequence = itertools.count()
+        schedule = [(time.monotonic() + random.uniform(0, interval), next(sequence), target)
+                    for target, interval in intervals.items()]
+        heapq.heapify(schedule)
+        logger.info('Watching {} targets'.format(len(intervals)))
+        running = dict()
+        last_run = time.monotonic()
+        with ThreadPoolExecutor(max_workers=kwargs['jobs']) as executor:
+            while (not stopping) or running:
+                while (not stopping) and schedule and (schedule[0][0] <= time.monotonic()) \
+                        and (len(running) < kwargs['jobs']):
+                    target = heapq.heappop(schedule)[2]
+                    if time.monotonic() - last_run > WATCH_IDLE:
+                        session.start(force=True)
+                    last_run = time.monotonic()
+                    running[executor.submit(dl_one, target)] = target
+                timeout = 1.
+                if schedule and (len(running) < kwargs['jobs']):
+                    timeout = min(timeout, max(0., schedule[0][0] - time.monotonic()))
+                if running:
+                    done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    done = set()
+                    time.sleep(timeout)
+                for future in done:
+                    target = running.pop(future)
+                    stats.incr('watch.runs')
+                    try:
+                        logger.info('Watch : {} new reports for {}'.format(future.result(), target))
+                    except Exception:  # noqa
+                        stats.incr('watch.failures')
+                        logger.error('Download failed for {} :\n{}'.format(target, traceback.format_exc()))
+                    heapq.heappush(schedule, (next_run(intervals[target]), next(sequence), target))
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        if None is not index:
+            index.close()
+        if None is not catalog:
+            catalog.close()
+    logger.info('Watch stopped')
+
+
+def merge_exports(session, **kwargs):
+    """
+    Merge other export directories into CHEMIN, e.g. those of other shards: exported files are copied, and the
+    download index and the catalog are merged. Shards export disjoint targets to distinct directories, and stored
+    objects are named after their content, so that files never conflict. If a file exists in both directories, the
+    most recent one is kept. Files hard linked to a stored object of --dedup are linked to the merged object.
+    :param session: An orobnat.Session instance. Unused.
+    :param kwargs: Misc params retrieved from command line.
+    """
+    # databases of the export directory are merged instead of copied, progress files are specific to a process.
+    skipped = (DownloadIndex.FILENAME, ReportCatalog.FILENAME, os.path.splitext(Checkpoint.FILENAME)[0])
+    start = time.monotonic()
+    count = 0
+    index = open_index(**kwargs)
+    catalog = None if kwargs['dry_run'] else ReportCatalog(os.path.join(kwargs['CHEMIN'], ReportCatalog.FILENAME))
+    try:
+        for source_path in kwargs['merge']:
+            # stored objects are merged first, keyed by inode, so that the files linked to them are found.
+            objects = dict()
+            for dir_path, dir_names, file_names in itertools.chain(
+                    os.walk(os.path.join(source_path, ContentStore.DIRNAME)), os.walk(source_path)):
+                relative_path = os.path.relpath(dir_path, source_path)
+                if '.' == relative_path:
+                    dir_names[:] = [name for name in dir_names if ContentStore.DIRNAME != name]
+                for name in file_names:
+                    if ('.' == relative_path) and name.startswith(skipped):
+                        continue
+                    path = os.path.join(dir_path, name)
+                    export_path = os.path.normpath(os.path.join(kwargs['CHEMIN'], relative_path, name))
+                    stat = os.stat(path)
+                    object_path = None
+                    if ContentStore.DIRNAME == relative_path.split(os.sep)[0]:
+                        objects[(stat.st_dev, stat.st_ino)] = export_path
+                    elif stat.st_nlink > 1:
+                        object_path = objects.get((stat.st_dev, stat.st_ino))
+                    if os.path.exists(export_path) and (os.path.getmtime(export_path) >= stat.st_mtime):
+                        continue
+                    logger.debug('{} {} to {}'.format('Copy' if None is object_path else 'Link', path, export_path))
+                    count += 1
+                    if not kwargs['dry_run']:
+                        os.makedirs(os.path.dirname(export_path), exist_ok=True)
+                        if None is object_path:
+                            shutil.copy2(path, export_path)
+                        else:
+                            ContentStore.link(object_path, export_path)
+            if (None is not index) and os.path.exists(os.path.join(source_path, DownloadIndex.FILENAME)):
+                index.merge(os.path.join(source_path, DownloadIndex.FILENAME))
+            if (None is not catalog) and os.path.exists(os.path.join(source_path, ReportCatalog.FILENAME)):
+                catalog.merge(os.path.join(source_path, ReportCatalog.FILENAME))
+    finally:
+        if None is not index:
+            index.close()
+        if None is not catalog:
+            catalog.close()
+    logger.info('Summary : {} directories, {} files merged in {:.1f}s'.format(
+        len(kwargs['merge']), count, time.monotonic() - start))
+
+
+def plan(command, **kwargs):
+    """
+    Describe the downloads of a command, for dry runs. The selection is neither checked nor expanded into targets, so
+    that no request is sent.
+    :param command: function : dl_reports, dl_bulk or watch.
+    :param kwargs: Misc params retrieved from command line.
+    :return: str : The description.
+    """
+    ids = ' '.join([kwargs[key] for key in ['region', 'departement', 'commune', 'reseau'] if None is not kwargs[key]])
+    if command == watch:
+        targets = 'the targets listed in {}, every {}s by default'.format(kwargs['watch'], kwargs['interval'])
+    elif None is not kwargs['manifest']:
+        targets = 'the targets listed in {}'.format(kwargs['manifest'])
+    elif command == dl_bulk:
+        targets = 'every reseau below {}'.format(ids)
+    else:
+        targets = 'reseau {}'.format(ids)
+    lines = ['Download the reports of {}'.format(targets),
+             'Export to {} as {}'.format(kwargs['CHEMIN'], ', '.join(kwargs['format']) or 'no format')]
+    if (None is not kwargs['since']) or (None is not kwargs['until']):
+        lines.append('Sampled from {} to {}'.format(kwargs['since'] or 'the first report', kwargs['until'] or 'now'))
+    if None is not kwargs['shard']:
+        lines.append('Only the targets of shard {}'.format(kwargs['shard']))
+    if None is not kwargs['queue']:
+        lines.append('Share the targets with the work queue {}'.format(kwargs['queue']))
+    return '\n'.join(lines)
+
+
+def check_selection(session, arguments, **kwargs):
+    """
+    Check that the selected "region", "departement", "commune" and "reseau" exist. The lists of items needed are
+    fetched concurrently, in a single step, and cached by the session.
+    :param session: An orobnat.Session instance.
+    :param arguments: list : The --region, --departement, --commune and --reseau arguments of the parser.
+    :param kwargs: Misc params retrieved from command line.
+    :raise ArgumentError: If a selected item does not exist.
+    """
+    ids = [kwargs[argument.dest] for argument in arguments]
+    calls = [lambda: session.regions,
+             partial(session.get_departements, *ids[:1]),
+             partial(session.get_communes, *ids[:2]),
+             partial(session.get_reseaux, *ids[:3])]
+    messages = ['La région {} n\'existe pas.',
+                'Le département {} ne se trouve pas dans la région {}.',
+                'La commune {} ne se trouve pas dans le département {}.',
+                'Le réseau {} n\'est pas disponible dans la commune {}.']
+    # a level is checked only if it and all its parents are selected.
+    levels = [level for level in range(len(ids)) if None not in ids[:level + 1]]
+    if len(levels) < 1:
+        return
+    with ThreadPoolExecutor(max_workers=len(levels)) as executor:
+        futures = [executor.submit(calls[level]) for level in levels]
+    parent = None
+    for level, future in zip(levels, futures):
+        # lists below an invalid item are never read, their request may have failed.
+        items = future.result()
+        if ids[level] not in items:
+            raise ArgumentError(arguments[level], messages[level].format(ids[level], parent))
+        parent = items[ids[level]]
 
 
 def print_items(session, **kwargs):
     """
-    Print all items from a given "region", "departement" or "commune".
+    Print all "regions", or all items from a given "region", "departement" or "commune".
     :param session: An orobnat.Session instance.
     :param kwargs: Misc params retrieved from command line.
     """
-    messages = {'liste_departements': 'Départements disponibles pour cette région :\n',
+    messages = {'liste_regions': 'Régions disponibles :\n',
+                'liste_departements': 'Départements disponibles pour cette région :\n',
                 'liste_communes': 'Communes disponibles pour ce département :\n',
                 'liste_reseaux': 'Reseaux disponibles pour cette commune :\n'}
-    items = {'liste_departements': 'departements',
+    items = {'liste_regions': 'regions',
+             'liste_departements': 'departements',
              'liste_communes': 'communes',
              'liste_reseaux': 'reseaux'}
     key = {kwargs[key]: key for key in messages}[True]
@@ -49,104 +553,260 @@ def print_items(session, **kwargs):
                                    for key, value in getattr(session, items[key]).items()])))
 
 
+def write_stats(path):
+    """
+    Write the global statistics to a file.
+    :param path: str : Path of the file. Prometheus text format if it ends with '.prom', JSON otherwise.
+    """
+    with open(path, 'w') as f:
+        f.write(stats.to_prometheus() if path.endswith('.prom') else stats.to_json())
+
+
 def main():
-    s_args = dict()
-    session = Session(s_args)
-    try:
-        parser = ArgumentParser(description='Cet outil permet de télécharger les résultats d\'analyse d\'eau potable '
-                                            'depuis le site https://orobnat.sante.gouv.fr',
-                                formatter_class=RawTextHelpFormatter,
-                                add_help=False)
-        parser.add_argument('-h', '--help', action='help', default=SUPPRESS,
-                            help='Afficher ce message d\'aide.')
-        parser.add_argument('--debug', help='Afficher les informations de débogage.', action='store_true')
-        parser.add_argument('--dry-run', help='Afficher les actions à réaliser mais ne rien faire.',
-                            action='store_true')
-        parser.add_argument('--format', help='Sélectionner le format d\'export.\nDéfault : {}'.format(
-            DEFAULT_EXPORT_FORMAT), nargs='*', choices=EXPORT_FORMATS.keys(),
-                            default=[DEFAULT_EXPORT_FORMAT])
-        since = parser.add_argument('--since', help='Download reports since provided date. '
-                                                    'Date format must be a valid ISO 8601 format.', metavar='DATE')
-        regions = session.regions
-        region = parser.add_argument('--region',
-                                     help='Sélectionner une région : \n{}'.format('\n'.join(['{}: {}'.format(key, value)
-                                                                                             for key, value in
-                                                                                             regions.items()])),
-                                     choices=regions.keys(), metavar='ID')
-        # --liste-departements, --liste-communes, --liste-reseaux are mutually exclusive.
-        group = parser.add_mutually_exclusive_group()
-        departements = group.add_argument('--liste-departements',
-                                          help='Afficher la liste des départements disponibles pour la région '
-                                               'sélectionnée.',
-                                          action='store_true')
-        departement = parser.add_argument('--departement', help='Sélectionner un département.', metavar='ID')
-        communes = group.add_argument('--liste-communes',
-                                      help='Afficher la liste des communes disponibles pour le département '
-                                           'sélectionné.',
+    parser = ArgumentParser(description='Cet outil permet de télécharger les résultats d\'analyse d\'eau potable '
+                                        'depuis le site https://orobnat.sante.gouv.fr',
+                            formatter_class=RawTextHelpFormatter,
+                            add_help=False)
+    parser.add_argument('-h', '--help', action='help', default=SUPPRESS,
+                        help='Afficher ce message d\'aide.')
+    parser.add_argument('--debug', help='Afficher les informations de débogage.', action='store_true')
+    parser.add_argument('--dry-run', help='Afficher les actions à réaliser mais ne rien faire. Aucune requête '
+                                          'n\'est envoyée : la sélection\nn\'est pas vérifiée.',
+                        action='store_true')
+    parser.add_argument('--format', help='Sélectionner le format d\'export.\nDéfault : {}'.format(
+        DEFAULT_EXPORT_FORMAT), nargs='*', choices=EXPORT_FORMATS.keys(),
+                        default=[DEFAULT_EXPORT_FORMAT])
+    since = parser.add_argument('--since', help='Download reports since provided date. '
+                                                'Date format must be a valid ISO 8601 format.', metavar='DATE')
+    parser.add_argument('--until', help='Download reports until provided date, included. '
+                                        'Date format must be a valid ISO 8601 format.', metavar='DATE')
+    parser.add_argument('--jobs', help='Nombre de rapports téléchargés en parallèle.\nDéfaut : 1', type=int,
+                        default=1, metavar='N')
+    parser.add_argument('--timeout', help='Délai d\'attente maximal d\'une requête, en secondes.\nDéfaut : {}'.format(
+        Session.DEFAULT_TIMEOUT), type=float, default=Session.DEFAULT_TIMEOUT, metavar='SECONDES')
+    parser.add_argument('--retries', help='Nombre de nouvelles tentatives pour une requête en échec.\nDéfaut : {}'
+                        .format(Session.DEFAULT_RETRIES), type=int, default=Session.DEFAULT_RETRIES, metavar='N')
+    parser.add_argument('--rate', help='Nombre maximal de requêtes par seconde. Le débit est réduit automatiquement '
+                                       'lorsque le serveur\nralentit ou renvoie des erreurs.',
+                        type=float, metavar='N')
+    parser.add_argument('--export-jobs', help='Exporter les rapports en parallèle du téléchargement, avec N '
+                                              'tâches par format,\nou N tâches pour le format FORMAT.',
+                        nargs='+', metavar='[FORMAT=]N')
+    parser.add_argument('--resume', help='Reprendre le téléchargement là où l\'exécution précédente s\'est arrêtée.',
+                        action='store_true')
+    parser.add_argument('--incremental', help='Arrêter le téléchargement au premier rapport déjà exporté et ne pas '
+                                              'exporter à nouveau les rapports existants.',
+                        action='store_true')
+    parser.add_argument('--dedup', help='Stocker une seule fois les rapports identiques dans CHEMIN/{}, et les '
+                                        'lier par liens physiques\ndans les répertoires d\'export.'.format(
+                                            ContentStore.DIRNAME),
+                        action='store_true')
+    parser.add_argument('--catalog', help='Enregistrer le contenu des rapports téléchargés dans la base CHEMIN/{},\n'
+                                          'interrogeable avec orobnat_query.py.'.format(ReportCatalog.FILENAME),
+                        action='store_true')
+    parser.add_argument('--stats', help='Afficher les statistiques de performance en fin d\'exécution.',
+                        action='store_true')
+    parser.add_argument('--stats-file', help='Enregistrer les statistiques de performance au format JSON, ou au '
+                                             'format texte Prometheus\nsi le nom du fichier se termine par .prom.',
+                        metavar='FICHIER')
+    parser.add_argument('--profile', help='Profiler l\'exécution de tous les threads avec cProfile et enregistrer le '
+                                          'résultat.',
+                        metavar='FICHIER')
+    parser.add_argument('--refresh-cache', help='Ignorer le cache des listes de régions, départements, communes et '
+                                                'réseaux,\net le mettre à jour.',
+                        action='store_true')
+    parser.add_argument('--offline', help='Utiliser uniquement le cache pour les listes de régions, départements, '
+                                          'communes et réseaux.',
+                        action='store_true')
+    transport = parser.add_mutually_exclusive_group()
+    transport.add_argument('--record', help='Enregistrer les réponses du serveur dans un répertoire.',
+                           metavar='REPERTOIRE')
+    transport.add_argument('--replay', help='Rejouer les réponses enregistrées avec --record, sans accéder au '
+                                            'réseau.',
+                           metavar='REPERTOIRE')
+    region = parser.add_argument('--region', help='Sélectionner une région, voir --liste-regions.', metavar='ID')
+    # --liste-regions, --liste-departements, --liste-communes, --liste-reseaux are mutually exclusive.
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--liste-regions', help='Afficher la liste des régions disponibles.', action='store_true')
+    departements = group.add_argument('--liste-departements',
+                                      help='Afficher la liste des départements disponibles pour la région '
+                                           'sélectionnée.',
+                                      action='store_true')
+    departement = parser.add_argument('--departement', help='Sélectionner un département.', metavar='ID')
+    communes = group.add_argument('--liste-communes',
+                                  help='Afficher la liste des communes disponibles pour le département '
+                                       'sélectionné.',
+                                  action='store_true')
+    commune = parser.add_argument('--commune', help='Sélectionner une commune.', metavar='ID')
+    reseaux = group.add_argument('--liste-reseaux',
+                                 help='Afficher la liste des réseaux disponibles pour la commune '
+                                      'sélectionnée.',
+                                 action='store_true')
+    reseau = group.add_argument('--reseau', help='Sélectionner un réseau.', metavar='ID')
+    all_communes = group.add_argument('--all-communes',
+                                      help='Télécharger les rapports de tous les réseaux de toutes les communes du '
+                                           'département sélectionné.',
                                       action='store_true')
-        commune = parser.add_argument('--commune', help='Sélectionner une commune.', metavar='ID')
-        reseaux = group.add_argument('--liste-reseaux',
-                                     help='Afficher la liste des réseaux disponibles pour la commune '
+    all_reseaux = group.add_argument('--all-reseaux',
+                                     help='Télécharger les rapports de tous les réseaux de la commune '
                                           'sélectionnée.',
                                      action='store_true')
-        reseau = group.add_argument('--reseau', help='Sélectionner un réseau.', metavar='ID')
-        chemin = parser.add_argument('CHEMIN', help='Chemin du répertoire d\'export.', nargs='?')
-        args = parser.parse_args()
-        if args.debug:
-            logger.setLevel('DEBUG')
-        logger.debug('Parsed args : {}'.format(args))
-        if args.dry_run:
-            args.format.clear()
-        if None is not args.since:
-            try:
-                args.since = datetime.fromisoformat(args.since)
-            except ValueError as ve:
-                raise parser.error(ve)
-        d_args = vars(args)
-        # update session with command-line arguments
-        s_args.update(d_args)
-        command = dl_reports
+    group.add_argument('--manifest',
+                       help='Télécharger les rapports des cibles listées dans un fichier. Chaque ligne contient '
+                            'les identifiants\nd\'une région, et optionnellement d\'un département, d\'une commune '
+                            'et d\'un réseau.',
+                       metavar='FICHIER')
+    group.add_argument('--watch',
+                       help='Surveiller en continu les cibles listées dans un fichier au format de --manifest, et '
+                            'télécharger\nleurs nouveaux rapports. Une ligne peut se terminer par @N pour '
+                            'surveiller ses cibles toutes\nles N secondes. Arrêt par SIGTERM ou SIGINT.',
+                       metavar='FICHIER')
+    merge = group.add_argument('--merge', help='Fusionner dans CHEMIN les fichiers, l\'index et le catalogue '
+                                               'd\'autres répertoires d\'export,\npar exemple ceux des autres '
+                                               'parts téléchargées avec --shard.\nPeut être répété.',
+                               action='append', metavar='REPERTOIRE')
+    parser.add_argument('--interval', help='Intervalle de surveillance par défaut, en secondes.\nDéfaut : {}'.format(
+        DEFAULT_WATCH_INTERVAL), type=int, default=DEFAULT_WATCH_INTERVAL, metavar='SECONDES')
+    # --shard and --queue split the targets of --all-communes, --all-reseaux, --manifest between processes.
+    distribution = parser.add_mutually_exclusive_group()
+    shard = distribution.add_argument('--shard', help='Télécharger uniquement la part i parmi N des cibles, réparties '
+                                                      'selon leurs identifiants,\navec --all-communes, --all-reseaux, '
+                                                      '--manifest ou --watch. 1 <= i <= N.',
+                                      metavar='i/N')
+    queue = distribution.add_argument('--queue', help='Partager les cibles de --all-communes, --all-reseaux ou '
+                                                      '--manifest entre plusieurs processus\navec une file de '
+                                                      'travail SQLite.',
+                                      metavar='FICHIER')
+    chemin = parser.add_argument('CHEMIN', help='Chemin du répertoire d\'export.', nargs='?')
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel('DEBUG')
+    logger.debug('Parsed args : {}'.format(args))
+    if None is not args.since:
+        try:
+            args.since = datetime.fromisoformat(args.since)
+        except ValueError as ve:
+            raise parser.error(ve)
+    if None is not args.until:
+        try:
+            args.until = parse_date(args.until, end=True)
+        except ValueError as ve:
+            raise parser.error(ve)
+        if (None is not args.since) and (args.since > args.until):
+            raise parser.error('La date de début doit précéder la date de fin.')
+    if args.jobs < 1:
+        raise parser.error('Le nombre de téléchargements parallèles doit être supérieur ou égal à 1.')
+    if args.retries < 0:
+        raise parser.error('Le nombre de nouvelles tentatives doit être positif.')
+    if args.interval < 1:
+        raise parser.error('L\'intervalle de surveillance doit être supérieur ou égal à 1.')
+    if None is not args.shard:
         try:
-            if args.liste_departements:
-                if None is args.region:
-                    raise ArgumentError(departements,
-                                        'Veuillez sélectionner une région pour afficher la liste des départements.')
-                command = print_items
-            if args.departement is not None:
-                if args.departement not in session.departements.keys():
-                    raise ArgumentError(departement, 'Le département {} ne se trouve pas dans la région {}.'.format(
-                        args.departement, regions[args.region]))
-            if args.liste_communes:
-                if (None is args.region) or (None is args.departement):
-                    raise ArgumentError(communes,
-                                        'Veuillez sélectionner une région et un département pour afficher la liste '
-                                        'des communes.')
-                command = print_items
-            if args.commune is not None:
-                if args.commune not in session.communes.keys():
-                    raise ArgumentError(commune, 'La commune {} ne se trouve pas dans le département {}.'.format(
-                        args.commune, session.departements[args.departement]))
-            if args.liste_reseaux:
-                if (None is args.region) or (None is args.departement) or (None is args.commune):
-                    raise ArgumentError(reseaux,
-                                        'Veuillez sélectionner une région, un département et une commune pour afficher '
-                                        'la liste des réseaux.')
-                command = print_items
-            if args.reseau is not None:
-                if args.reseau not in session.reseaux.keys():
-                    raise ArgumentError(commune, 'Le réseau {} n\'est pas disponible dans la commune {}.'.format(
-                        args.reseau, session.communes[args.commune]))
-            if command == dl_reports:
-                mandatory_args = [region, departement, commune, reseau, chemin]
-                for arg in mandatory_args:
-                    if None is d_args[arg.dest]:
-                        raise ArgumentError(arg,
-                                            'Le paramètre \'{}\' est nécessaire pour téléchager les rapports '
-                                            'd\'analyse.'.format(arg.dest))
+            args.shard = Shard.parse(args.shard)
+        except ValueError as ve:
+            raise parser.error(ve)
+    if (None is not args.rate) and (args.rate <= 0):
+        raise parser.error('Le nombre maximal de requêtes par seconde doit être strictement positif.')
+    if None is not args.export_jobs:
+        try:
+            args.export_jobs = parse_export_jobs(args.export_jobs)
+        except ValueError as ve:
+            raise parser.error(ve)
+    d_args = vars(args)
+    command = dl_reports
+    try:
+        if args.liste_regions:
+            command = print_items
+        if args.liste_departements:
+            if None is args.region:
+                raise ArgumentError(departements,
+                                    'Veuillez sélectionner une région pour afficher la liste des départements.')
+            command = print_items
+        if args.liste_communes:
+            if (None is args.region) or (None is args.departement):
+                raise ArgumentError(communes,
+                                    'Veuillez sélectionner une région et un département pour afficher la liste '
+                                    'des communes.')
+            command = print_items
+        if args.liste_reseaux:
+            if (None is args.region) or (None is args.departement) or (None is args.commune):
+                raise ArgumentError(reseaux,
+                                    'Veuillez sélectionner une région, un département et une commune pour afficher '
+                                    'la liste des réseaux.')
+            command = print_items
+        if args.all_communes:
+            if (None is args.region) or (None is args.departement):
+                raise ArgumentError(all_communes,
+                                    'Veuillez sélectionner une région et un département pour télécharger les '
+                                    'rapports de toutes les communes.')
+            command = dl_bulk
+        if args.all_reseaux:
+            if (None is args.region) or (None is args.departement) or (None is args.commune):
+                raise ArgumentError(all_reseaux,
+                                    'Veuillez sélectionner une région, un département et une commune pour '
+                                    'télécharger les rapports de tous les réseaux.')
+            command = dl_bulk
+        if None is not args.manifest:
+            command = dl_bulk
+        if None is not args.watch:
+            command = watch
+        if None is not args.merge:
+            command = merge_exports
+        if (None is not args.shard) and (command not in [dl_bulk, watch]):
+            raise ArgumentError(shard, 'Le paramètre \'--shard\' nécessite --all-communes, --all-reseaux, '
+                                       '--manifest ou --watch.')
+        if (None is not args.queue) and (command != dl_bulk):
+            raise ArgumentError(queue, 'Le paramètre \'--queue\' nécessite --all-communes, --all-reseaux ou '
+                                       '--manifest.')
+        if (command in [dl_bulk, watch, merge_exports]) and (None is args.CHEMIN):
+            raise ArgumentError(chemin, 'Le paramètre \'CHEMIN\' est nécessaire pour téléchager les rapports '
+                                        'd\'analyse.')
+        if command == dl_reports:
+            mandatory_args = [region, departement, commune, reseau, chemin]
+            for arg in mandatory_args:
+                if None is d_args[arg.dest]:
+                    raise ArgumentError(arg,
+                                        'Le paramètre \'{}\' est nécessaire pour téléchager les rapports '
+                                        'd\'analyse.'.format(arg.dest))
+    except ArgumentError as ae:
+        raise parser.error(ae.message)
+    if args.dry_run and (command in [dl_reports, dl_bulk, watch]):
+        # dry runs send no request : the selection is not checked and no report is downloaded.
+        logger.info('Dry run :\n{}'.format(plan(command, **d_args)))
+        return
+    cache = None
+    if None is args.replay:
+        # the cache is refreshed while recording, so that every response is recorded.
+        cache = ResponseCache(refresh=args.refresh_cache or (None is not args.record), offline=args.offline)
+    # the session makes no request until a list or a report is needed.
+    session = Session(d_args, cache=cache)
+    try:
+        if None is not args.record:
+            session.mount('https://', RecordingAdapter(args.record))
+        elif None is not args.replay:
+            session.mount('https://', ReplayAdapter(args.replay))
+        session.timeout = args.timeout
+        session.retries = args.retries
+        if None is not args.rate:
+            session.limiter = HostRateLimiter(args.rate, adaptive=True, latency_target=args.timeout / 4)
+        try:
+            check_selection(session, [region, departement, commune, reseau], **d_args)
         except ArgumentError as ae:
             raise parser.error(ae.message)
-        logger.debug('Command : {}, Arguments: {}'.format(command.__name__, s_args))
-        command(session, **s_args)
+        logger.debug('Command : {}, Arguments: {}'.format(command.__name__, d_args))
+        profile = None if None is args.profile else Profiler()
+        try:
+            if None is not profile:
+                profile.enable()
+            command(session, **d_args)
+        finally:
+            if None is not profile:
+                profile.disable()
+                profile.dump_stats(args.profile)
+            if args.stats:
+                logger.info('Statistics :\n{}'.format(stats.summary()))
+            if None is not args.stats_file:
+                write_stats(args.stats_file)
     finally:
         session.close()
 
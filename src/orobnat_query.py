@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import csv
+import os
+import sys
+import time
+import traceback
+import zipfile
+from argparse import ArgumentParser, RawTextHelpFormatter, SUPPRESS
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from logger import logger
+from catalog import ReportCatalog
+from orobnat import Report, InvalidReportException, HTMLStrategy, PDFYearStrategy, ZIPStrategy
+
+# export directories holding the HTML content of reports.
+SOURCE_DIRS = [HTMLStrategy.PREFIX, PDFYearStrategy.PREFIX, ZIPStrategy.PREFIX]
+# commit the database every COMMIT_INTERVAL indexed files.
+COMMIT_INTERVAL = 1000
+GROUPS = {'region': 'r.region', 'departement': 'r.departement', 'commune': 'r.commune', 'reseau': 'r.reseau',
+          'installation': 'r.installation', 'parametre': 'm.parametre', 'annee': 'substr(r.date, 1, 4)'}
+
+
+def scan(export_dir_path):
+    """
+    Find the files holding the HTML content of reports in an export directory.
+    The target of the reports is read from the CHEMIN/<region>/<departement>/<commune>/<reseau> layout, and is unknown
+    for files exported to CHEMIN directly.
+    :param export_dir_path: str : The export directory.
+    :return: generator : (path, target) of each file, target being a tuple of ids, empty if unknown.
+    """
+    for dir_path, dir_names, file_names in os.walk(export_dir_path):
+        dir_names[:] = sorted(name for name in dir_names
+                              if (not name.startswith('.')) or (PDFYearStrategy.SOURCES == name))
+        parts = os.path.relpath(dir_path, export_dir_path).split(os.sep)
+        for position, part in enumerate(parts):
+            if part in SOURCE_DIRS:
+                target = tuple(parts[:position]) if 4 == position else ('',) * 4
+                for name in sorted(file_names):
+                    if (not name.startswith('.')) and name.endswith(('.html', '.zip')):
+                        yield os.path.join(dir_path, name), target
+                break
+
+
+def read_source(path):
+    """
+    Read the reports of a file. Run in worker processes.
+    :param path: str : Path of an HTML file or of a ZIP archive.
+    :return: list : Rows of each report, see ReportCatalog.rows().
+    """
+    rows = list()
+    try:
+        if path.endswith('.zip'):
+            with zipfile.ZipFile(path) as archive:
+                contents = [archive.read(name) for name in archive.namelist()]
+        else:
+            with open(path, 'rb') as f:
+                contents = [f.read()]
+        for content in contents:
+            try:
+                rows.append(ReportCatalog.rows(Report(content)))
+            except (InvalidReportException, IndexError, ValueError):
+                logger.warning('Invalid report in {}'.format(path))
+    except (OSError, zipfile.BadZipFile) as e:
+        logger.warning('Unable to read {} : {}'.format(path, e))
+    return rows
+
+
+def build(catalog, export_dir_path, jobs=1):
+    """
+    Add the reports exported in a directory to the catalog. Files which did not change since they were last indexed
+    are skipped.
+    :param catalog: catalog.ReportCatalog : The catalog.
+    :param export_dir_path: str : The export directory.
+    :param jobs: int : Number of processes parsing reports.
+    :return: tuple : Numbers of indexed files, and of reports added or updated.
+    """
+    sources = list()
+    for path, target in scan(export_dir_path):
+        stat = os.stat(path)
+        if not catalog.indexed(os.path.relpath(path, export_dir_path), stat.st_mtime, stat.st_size):
+            sources.append((path, target, stat))
+    count = 0
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
+        results = map(read_source, [path for path, _, _ in sources]) if None is executor else \
+            executor.map(read_source, [path for path, _, _ in sources], chunksize=16)
+        for position, ((path, target, stat), rows) in enumerate(zip(sources, results)):
+            for values, measures in rows:
+                catalog.add_rows(target, values, measures)
+            catalog.set_indexed(os.path.relpath(path, export_dir_path), stat.st_mtime, stat.st_size)
+            if 0 == (position + 1) % COMMIT_INTERVAL:
+                count += catalog.commit()
+                logger.info('{} / {} files indexed'.format(position + 1, len(sources)))
+    finally:
+        count += catalog.commit()
+        if None is not executor:
+            executor.shutdown()
+    return len(sources), count
+
+
+def build_query(**kwargs):
+    """
+    Build the SQL query of the "query" command.
+    :param kwargs: Misc params retrieved from command line.
+    :return: tuple : (SQL query, parameters).
+    """
+    conditions = list()
+    parameters = list()
+    for key in ['region', 'departement', 'commune', 'reseau']:
+        if None is not kwargs[key]:
+            conditions.append('r.{} = ?'.format(key))
+            parameters.append(kwargs[key])
+    if None is not kwargs['installation']:
+        conditions.append('r.installation LIKE ?')
+        parameters.append('%{}%'.format(kwargs['installation']))
+    if None is not kwargs['since']:
+        conditions.append('r.date >= ?')
+        parameters.append(kwargs['since'].isoformat())
+    if None is not kwargs['until']:
+        conditions.append('r.date <= ?')
+        parameters.append(kwargs['until'].isoformat())
+    measures = (None is not kwargs['parametre']) or ('parametre' in kwargs['group_by'])
+    if None is not kwargs['parametre']:
+        # a prefix range, unlike LIKE, is looked up in the measures_parametre index.
+        conditions.append('m.parametre >= ? AND m.parametre < ?')
+        parameters.extend([kwargs['parametre'], kwargs['parametre'] + '\U0010ffff'])
+    if kwargs['non_conforme']:
+        conditions.append('m.conforme = 0' if measures else 'r.conforme = 0')
+    if kwargs['group_by']:
+        groups = [GROUPS[group] for group in kwargs['group_by']]
+        columns = ['{} AS {}'.format(GROUPS[group], group) for group in kwargs['group_by']] + \
+                  ['COUNT(DISTINCT r.id) AS rapports']
+        if measures:
+            columns.extend(['MIN(m.valeur) AS minimum', 'AVG(m.valeur) AS moyenne', 'MAX(m.valeur) AS maximum'])
+        tail = ' GROUP BY {0} ORDER BY {0}'.format(', '.join(groups))
+    else:
+        columns = ['r.date', 'r.region', 'r.departement', 'r.commune', 'r.reseau', 'r.commune_prelevement',
+                   'r.installation', 'r.conforme']
+        if measures:
+            columns.extend(['m.parametre', 'm.resultat', 'm.conforme AS parametre_conforme'])
+        tail = ' ORDER BY r.date'
+    sql = 'SELECT {} FROM reports r{}{}{}'.format(', '.join(columns),
+                                                   ' JOIN measures m ON m.report = r.id' if measures else '',
+                                                   ' WHERE {}'.format(' AND '.join(conditions)) if conditions else '',
+                                                   tail)
+    if None is not kwargs['limit']:
+        sql += ' LIMIT {:d}'.format(kwargs['limit'])
+    return sql, parameters
+
+
+def parse_date(value, end=False):
+    """
+    :param value: str : A date in a valid ISO 8601 format.
+    :param end: bool : Give the end of the day if value holds no time.
+    :return: datetime
+    """
+    date = datetime.fromisoformat(value)
+    if end and (len(value) <= 10):
+        date = date.replace(hour=23, minute=59, second=59)
+    return date
+
+
+def main():
+    parser = ArgumentParser(description='Cet outil indexe les rapports exportés par orobnat_dl.py dans une base '
+                                        'SQLite, et l\'interroge.',
+                            formatter_class=RawTextHelpFormatter,
+                            add_help=False)
+    parser.add_argument('-h', '--help', action='help', default=SUPPRESS, help='Afficher ce message d\'aide.')
+    parser.add_argument('--debug', help='Afficher les informations de débogage.', action='store_true')
+    parser.add_argument('--database', help='Chemin de la base de données.\nDéfaut : CHEMIN/{}'.format(
+        ReportCatalog.FILENAME), metavar='FICHIER')
+    commands = parser.add_subparsers(dest='command', metavar='COMMANDE', required=True)
+    index_parser = commands.add_parser('index', help='Indexer les rapports exportés, ou mettre à jour l\'index.',
+                                       formatter_class=RawTextHelpFormatter)
+    index_parser.add_argument('--jobs', help='Nombre de processus analysant les rapports.\nDéfaut : {}'.format(
+        os.cpu_count() or 1), type=int, default=os.cpu_count() or 1, metavar='N')
+    index_parser.add_argument('CHEMIN', help='Chemin du répertoire d\'export.')
+    query_parser = commands.add_parser('query', help='Interroger l\'index.', formatter_class=RawTextHelpFormatter)
+    for key, name in [('region', 'une région'), ('departement', 'un département'), ('commune', 'une commune'),
+                      ('reseau', 'un réseau')]:
+        query_parser.add_argument('--{}'.format(key), help='Sélectionner {}.'.format(name), metavar='ID')
+    query_parser.add_argument('--installation', help='Sélectionner les installations dont le nom contient TEXTE.',
+                              metavar='TEXTE')
+    query_parser.add_argument('--parametre', help='Sélectionner les paramètres dont le nom commence par TEXTE, en '
+                                                  'respectant la casse.',
+                              metavar='TEXTE')
+    query_parser.add_argument('--since', help='Sélectionner les rapports prélevés depuis DATE (ISO 8601).',
+                              metavar='DATE')
+    query_parser.add_argument('--until', help='Sélectionner les rapports prélevés jusqu\'à DATE (ISO 8601).',
+                              metavar='DATE')
+    query_parser.add_argument('--non-conforme', help='Sélectionner les prélèvements non conformes, ou les paramètres '
+                                                     'non conformes avec --parametre.',
+                              action='store_true')
+    query_parser.add_argument('--group-by', help='Regrouper les rapports, et compter les rapports de chaque groupe.',
+                              nargs='+', choices=GROUPS.keys(), default=[])
+    query_parser.add_argument('--limit', help='Nombre maximal de lignes.', type=int, metavar='N')
+    query_parser.add_argument('--sql', help='Exécuter une requête SQL sur les tables reports et measures.',
+                              metavar='REQUETE')
+    query_parser.add_argument('--csv', help='Afficher le résultat au format CSV.', action='store_true')
+    query_parser.add_argument('CHEMIN', help='Chemin du répertoire d\'export.', nargs='?', default='.')
+    args = parser.parse_args()
+    if args.debug:
+        logger.setLevel('DEBUG')
+    logger.debug('Parsed args : {}'.format(args))
+    if ('index' == args.command) and (args.jobs < 1):
+        raise parser.error('Le nombre de processus doit être supérieur ou égal à 1.')
+    if 'query' == args.command:
+        try:
+            args.since = None if None is args.since else parse_date(args.since)
+            args.until = None if None is args.until else parse_date(args.until, end=True)
+        except ValueError as ve:
+            raise parser.error(ve)
+    database = args.database or os.path.join(args.CHEMIN, ReportCatalog.FILENAME)
+    if ('query' == args.command) and (not os.path.exists(database)):
+        raise parser.error('La base de données {} n\'existe pas.'.format(database))
+    with ReportCatalog(database) as catalog:
+        start = time.monotonic()
+        if 'index' == args.command:
+            files, reports = build(catalog, args.CHEMIN, args.jobs)
+            logger.info('Summary : {} files, {} new or changed reports indexed in {:.1f}s'.format(
+                files, reports, time.monotonic() - start))
+        else:
+            sql, parameters = (args.sql, []) if None is not args.sql else build_query(**vars(args))
+            logger.debug('Query : {} {}'.format(sql, parameters))
+            columns, rows = catalog.query(sql, parameters)
+            if args.csv:
+                writer = csv.writer(sys.stdout)
+                writer.writerow(columns)
+                writer.writerows(rows)
+            else:
+                print('\t'.join(columns))
+                for row in rows:
+                    print('\t'.join(['' if None is value else str(value) for value in row]))
+            logger.debug('{} rows in {:.3f}s'.format(len(rows), time.monotonic() - start))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception:  # noqa
+        logger.error(traceback.format_exc())
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: float : Number of tokens added per second.
+        :param capacity: float : Maximum number of tokens stored in the bucket. Default to max(1, rate).
+        """
+        self.__lock = threading.Lock()
+        self._rate = float(rate)
+        self._capacity = float(capacity if None is not capacity else max(1., self._rate))
+        self.__tokens = self._capacity
+        self.__timestamp = time.monotonic()
+
+    @property
+    def rate(self):
+        """
+        :return: float : Number of tokens added per second.
+        """
+        return self._rate
+
+    def _set_rate(self, rate):
+        """
+        Change the number of tokens added per second, from now on.
+        :param rate: float : Number of tokens added per second.
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self._capacity, self.__tokens + (now - self.__timestamp) * self._rate)
+            self.__timestamp = now
+            self._rate = float(rate)
+
+    def success(self, latency):
+        """
+        Report a successful request.
+        :param latency: float : Duration of the request in seconds.
+        """
+        pass
+
+    def failure(self):
+        """
+        Report a failed request: a network error, a timeout, or a response asking to slow down.
+        """
+        pass
+
+    def reserve(self):
+        """
+        Take a token from the bucket, possibly in advance.
+        :return: float : Delay in seconds to wait before the token may be used.
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self._capacity, self.__tokens + (now - self.__timestamp) * self._rate)
+            self.__timestamp = now
+            self.__tokens -= 1
+            if self.__tokens >= 0:
+                return 0.
+            return -self.__tokens / self._rate
+
+    def acquire(self):
+        """
+        Block until a token is available.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """
+    A token bucket whose rate follows an additive increase / multiplicative decrease scheme: it is halved when
+    requests fail or get slower than a target latency, and it grows back slowly, up to its initial rate, while they
+    succeed.
+    """
+
+    DECREASE = 0.5
+    INCREASE = 0.05
+    COOLDOWN = 1.
+
+    def __init__(self, rate, capacity=None, min_rate=None, latency_target=None):
+        """
+        :param rate: float : Initial and maximum number of tokens added per second.
+        :param capacity: float : Maximum number of tokens stored in the bucket. Default to max(1, rate).
+        :param min_rate: float : Minimum number of tokens added per second. Default to rate / 20.
+        :param latency_target: float : Requests slower than this duration, in seconds, slow the rate down.
+                               None to only react to failures.
+        """
+        super(AdaptiveTokenBucket, self).__init__(rate, capacity)
+        self.__max_rate = float(rate)
+        self.__min_rate = float(min_rate if None is not min_rate else rate / 20.)
+        self.__latency_target = latency_target
+        self.__decreased = 0.
+
+    def __decrease(self):
+        now = time.monotonic()
+        # several requests in flight usually fail together, slow down once for all of them.
+        if now - self.__decreased >= self.COOLDOWN:
+            self.__decreased = now
+            self._set_rate(max(self.__min_rate, self.rate * self.DECREASE))
+
+    def success(self, latency):
+        if (None is not self.__latency_target) and (latency > self.__latency_target):
+            self.__decrease()
+        elif self.rate < self.__max_rate:
+            self._set_rate(min(self.__max_rate, self.rate + self.__max_rate * self.INCREASE))
+
+    def failure(self):
+        self.__decrease()
+
+
+class HostRateLimiter:
+    """
+    Keep one token bucket per host.
+    """
+
+    def __init__(self, rate, capacity=None, adaptive=False, **kwargs):
+        """
+        :param rate: float : Maximum number of requests per second for each host.
+        :param capacity: float : Maximum burst size for each host.
+        :param adaptive: bool : Use AdaptiveTokenBucket instances, built with the remaining keyword arguments.
+        """
+        self.__lock = threading.Lock()
+        self.__rate = rate
+        self.__capacity = capacity
+        self.__adaptive = adaptive
+        self.__kwargs = kwargs
+        self.__buckets = dict()
+
+    def bucket(self, url):
+        """
+        :param url: str : URL of the request.
+        :return: TokenBucket : The bucket for the host of the given URL.
+        """
+        host = urlsplit(url).netloc
+        with self.__lock:
+            if host not in self.__buckets:
+                if self.__adaptive:
+                    self.__buckets[host] = AdaptiveTokenBucket(self.__rate, self.__capacity, **self.__kwargs)
+                else:
+                    self.__buckets[host] = TokenBucket(self.__rate, self.__capacity)
+            return self.__buckets[host]
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from io import BytesIO
+from requests import Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from cache import CacheMissError
+
+
+class Fixtures:
+    """
+    A directory of recorded HTTP responses, keyed by method, URL and body of the request.
+    Each response is stored as <key>.json, holding the request and the response status and headers, and <key>.body,
+    holding the raw response body.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: str : Directory of the fixtures. It is created if it does not exist.
+        """
+        self.__path = path
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(request):
+        """
+        :param request: requests.PreparedRequest : A request.
+        :return: str : Key of the request.
+        """
+        body = request.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        return hashlib.sha256(b'\n'.join([request.method.upper().encode('utf-8'), request.url.encode('utf-8'),
+                                          body])).hexdigest()
+
+    def save(self, request, status, headers, content):
+        """
+        Record a response.
+        :param request: requests.PreparedRequest : The request.
+        :param status: int : HTTP status code of the response.
+        :param headers: dict : Headers of the response.
+        :param content: bytes : Body of the response.
+        """
+        key = self.key(request)
+        body = request.body or ''
+        for suffix, data in [('.body', content),
+                             ('.json', json.dumps({'method': request.method, 'url': request.url,
+                                                   'body': body if isinstance(body, str) else body.decode('utf-8'),
+                                                   'status': status, 'headers': dict(headers)},
+                                                  indent=1, sort_keys=True).encode('utf-8'))]:
+            fd, tmp_path = tempfile.mkstemp(dir=self.__path, prefix='.')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self.__path, key + suffix))
+
+    def load(self, request):
+        """
+        :param request: requests.PreparedRequest : A request.
+        :return: tuple : (status, headers, content) of the recorded response.
+        :raise CacheMissError: If no response has been recorded for the request.
+        """
+        key = self.key(request)
+        try:
+            with open(os.path.join(self.__path, key + '.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(os.path.join(self.__path, key + '.body'), 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            raise CacheMissError('No recorded response for {} {} {}'.format(request.method, request.url,
+                                                                            request.body or '')) from None
+        return meta['status'], meta['headers'], content
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    A transport adapter which sends requests over the network and records their responses as fixtures.
+    """
+
+    def __init__(self, path, **kwargs):
+        """
+        :param path: str : Directory of the fixtures.
+        :param kwargs: Arguments of requests.adapters.HTTPAdapter.
+        """
+        super(RecordingAdapter, self).__init__(**kwargs)
+        self.__path = path
+        self.__fixtures = Fixtures(path)
+
+    def resized(self, size):
+        """
+        :param size: int : Maximum number of pooled connections per host.
+        :return: RecordingAdapter : An adapter recording to the same fixtures, with a resized connection pool.
+        """
+        return RecordingAdapter(self.__path, pool_connections=size, pool_maxsize=size)
+
+    def send(self, request, **kwargs):
+        response = super(RecordingAdapter, self).send(request, **kwargs)
+        self.__fixtures.save(request, response.status_code, response.headers, response.content)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    A transport adapter which serves recorded responses, and never sends requests over the network.
+    """
+
+    def __init__(self, path, latency=0.):
+        """
+        :param path: str : Directory of the fixtures.
+        :param latency: float : Simulated latency of each response, in seconds.
+        """
+        super(ReplayAdapter, self).__init__()
+        self.__fixtures = Fixtures(path)
+        self.__latency = latency
+
+    def resized(self, size):
+        """
+        :return: ReplayAdapter : This adapter, which holds no connection.
+        """
+        return self
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        status, headers, content = self.__fixtures.load(request)
+        if self.__latency > 0:
+            time.sleep(self.__latency)
+        response = Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = BytesIO(content)
+        response._content = content
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
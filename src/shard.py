@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+from orobnat import Target
+
+
+class Shard(namedtuple('Shard', ['index', 'count'])):
+    """
+    A part of the target space, for crawling it with several processes or machines. Targets are assigned to shards
+    by a hash of their ids, so that every process computes the same disjoint parts without any coordination.
+    """
+
+    @classmethod
+    def parse(cls, value):
+        """
+        :param value: str : Shard formatted as 'i/N', 1 <= i <= N.
+        :return: Shard
+        :raise ValueError: If value is not a valid shard.
+        """
+        index, _, count = value.partition('/')
+        if (not index.isdigit()) or (not count.isdigit()) or (not 1 <= int(index) <= int(count)):
+            raise ValueError('Shard invalide : {}'.format(value))
+        return cls(int(index), int(count))
+
+    @property
+    def suffix(self):
+        """
+        :return: str : Suffix of the files specific to this shard.
+        """
+        return '{}-{}'.format(*self)
+
+    def __contains__(self, target):
+        """
+        :param target: orobnat.Target : A target.
+        :return: bool : True if the target belongs to this shard.
+        """
+        digest = hashlib.sha256('/'.join(target).encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') % self.count == self.index - 1
+
+    def __str__(self):
+        return '{}/{}'.format(*self)
+
+
+class WorkQueue:
+    """
+    A queue of targets shared by several processes, backed by a SQLite lease table.
+    A process leases a target for LEASE seconds; a target whose lease expired, because its process crashed or was
+    killed, is leased again by another process. Failed targets are retried up to ATTEMPTS times.
+    The database must be on a local file system, or on a network file system with working locks.
+    """
+
+    LEASE = 3600.
+    ATTEMPTS = 3
+    TIMEOUT = 60.
+
+    def __init__(self, path, lease=LEASE):
+        """
+        :param path: str : Path of the SQLite database. It is created if it does not exist.
+        :param lease: float : Duration of a lease, in seconds. It must exceed the download time of any target.
+        """
+        self.__lock = threading.Lock()
+        self.__lease = lease
+        self.__owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+        import sqlite3
+        self.__connection = sqlite3.connect(path, timeout=self.TIMEOUT, isolation_level='IMMEDIATE',
+                                            check_same_thread=False)
+        with self.__connection:
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS targets ('
+                                      'region TEXT, departement TEXT, commune TEXT, reseau TEXT, '
+                                      'state TEXT DEFAULT \'pending\', owner TEXT, expires REAL, '
+                                      'attempts INTEGER DEFAULT 0, '
+                                      'PRIMARY KEY (region, departement, commune, reseau))')
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS targets_state ON targets (state, expires)')
+
+    def add(self, targets):
+        """
+        Add targets to the queue. Targets already queued, leased or done are left unchanged, so that every process
+        may add the whole target space.
+        :param targets: iterable : orobnat.Target instances.
+        """
+        with self.__lock, self.__connection:
+            self.__connection.executemany('INSERT OR IGNORE INTO targets (region, departement, commune, reseau) '
+                                          'VALUES (?, ?, ?, ?)', targets)
+
+    def lease(self):
+        """
+        Lease the next pending target, or a target whose lease expired.
+        :return: orobnat.Target : The leased target, None if no target is left.
+        """
+        with self.__lock, self.__connection:
+            # the target is selected and leased in a single write transaction, so that processes never lease the
+            # same target.
+            self.__connection.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            row = self.__connection.execute('SELECT rowid, region, departement, commune, reseau FROM targets '
+                                            'WHERE state = \'pending\' OR (state = \'leased\' AND expires < ?) '
+                                            'ORDER BY rowid LIMIT 1', (now,)).fetchone()
+            if None is row:
+                return None
+            self.__connection.execute('UPDATE targets SET state = \'leased\', owner = ?, expires = ? WHERE rowid = ?',
+                                      (self.__owner, now + self.__lease, row[0]))
+        return Target(*row[1:])
+
+    def set_done(self, target):
+        """
+        Record that all reports of a leased target have been exported.
+        :param target: orobnat.Target : The target.
+        """
+        with self.__lock, self.__connection:
+            self.__connection.execute('UPDATE targets SET state = \'done\', expires = NULL '
+                                      'WHERE region = ? AND departement = ? AND commune = ? AND reseau = ?', target)
+
+    def release(self, target):
+        """
+        Give a leased target back after a failure. It is leased again, unless it failed ATTEMPTS times.
+        :param target: orobnat.Target : The target.
+        """
+        with self.__lock, self.__connection:
+            self.__connection.execute('UPDATE targets SET attempts = attempts + 1, expires = NULL, '
+                                      'state = CASE WHEN attempts + 1 >= ? THEN \'failed\' ELSE \'pending\' END '
+                                      'WHERE region = ? AND departement = ? AND commune = ? AND reseau = ?',
+                                      (self.ATTEMPTS, *target))
+
+    def counts(self):
+        """
+        :return: dict : Number of targets in each state : 'pending', 'leased', 'done' or 'failed'.
+        """
+        with self.__lock:
+            return dict(self.__connection.execute('SELECT state, COUNT(*) FROM targets GROUP BY state').fetchall())
+
+    def close(self):
+        """
+        Close the database.
+        """
+        self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
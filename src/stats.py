@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import json
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Stats:
+    """
+    Thread-safe counters and timers, cheap enough to be always enabled.
+    Counters are named like 'http.bytes', timers are named after the phase they measure, like 'http' or 'parse'.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all counters and timers.
+        """
+        with self.__lock:
+            self.__start = time.monotonic()
+            self.__counters = defaultdict(int)
+            self.__timers = defaultdict(lambda: [0, 0.])
+
+    def incr(self, name, value=1):
+        """
+        Increment a counter.
+        :param name: str : Name of the counter.
+        :param value: int : Increment.
+        """
+        with self.__lock:
+            self.__counters[name] += value
+
+    def add_time(self, name, seconds):
+        """
+        Record a measure of a timer.
+        :param name: str : Name of the timer.
+        :param seconds: float : Measured time.
+        """
+        with self.__lock:
+            timer = self.__timers[name]
+            timer[0] += 1
+            timer[1] += seconds
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Measure the time spent in a block of code.
+        :param name: str : Name of the timer.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """
+        :return: dict : Elapsed time, counters and timers {name: {'count', 'seconds'}}.
+        """
+        with self.__lock:
+            return {'elapsed': time.monotonic() - self.__start,
+                    'counters': dict(self.__counters),
+                    'timers': {name: {'count': count, 'seconds': seconds}
+                               for name, (count, seconds) in self.__timers.items()}}
+
+    def summary(self):
+        """
+        :return: str : A human readable summary.
+        """
+        snapshot = self.snapshot()
+        elapsed = snapshot['elapsed'] or 1e-9
+        lines = ['Elapsed : {:.2f}s'.format(snapshot['elapsed'])]
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('{:<24} {:>12} ({:.2f}/s)'.format(name, value, value / elapsed))
+        for name, timer in sorted(snapshot['timers'].items()):
+            lines.append('{:<24} {:>12} calls {:>10.3f}s total {:>10.2f}ms mean'.format(
+                name, timer['count'], timer['seconds'], timer['seconds'] / timer['count'] * 1000))
+        return '\n'.join(lines)
+
+    def to_json(self):
+        """
+        :return: str : All measures as JSON.
+        """
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix='orobnat'):
+        """
+        :param prefix: str : Prefix of the metric names.
+        :return: str : All measures in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = ['# TYPE {}_elapsed_seconds gauge'.format(prefix),
+                 '{}_elapsed_seconds {}'.format(prefix, snapshot['elapsed'])]
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = '{}_{}_total'.format(prefix, re.sub(r'\W', '_', name))
+            lines.extend(['# TYPE {} counter'.format(metric), '{} {}'.format(metric, value)])
+        if snapshot['timers']:
+            lines.append('# TYPE {}_phase_seconds_total counter'.format(prefix))
+            lines.extend(['{}_phase_seconds_total{{phase="{}"}} {}'.format(prefix, name, timer['seconds'])
+                          for name, timer in sorted(snapshot['timers'].items())])
+            lines.append('# TYPE {}_phase_calls_total counter'.format(prefix))
+            lines.extend(['{}_phase_calls_total{{phase="{}"}} {}'.format(prefix, name, timer['count'])
+                          for name, timer in sorted(snapshot['timers'].items())])
+        return '\n'.join(lines) + '\n'
+
+
+class Profiler:
+    """
+    A cProfile profiler of every thread started while it is enabled, like the download and export workers.
+    Before Python 3.12, cProfile only profiles the thread that enables it : a profiler is then enabled in each new
+    thread, and the results of all threads are merged when they are saved.
+    """
+
+    def __init__(self):
+        import cProfile
+        self.__lock = threading.Lock()
+        self.__profiles = [cProfile.Profile()]
+
+    def __start(self, frame, event, arg):
+        # called by the first event of each new thread : the profiler of the thread replaces this hook.
+        import cProfile
+        profile = cProfile.Profile()
+        with self.__lock:
+            self.__profiles.append(profile)
+        profile.enable()
+
+    def enable(self):
+        """
+        Start profiling the current thread and the threads started from now on.
+        """
+        if sys.version_info < (3, 12):
+            threading.setprofile(self.__start)
+        self.__profiles[0].enable()
+
+    def disable(self):
+        """
+        Stop profiling. The threads still running are profiled until the results are saved.
+        """
+        threading.setprofile(None)
+        self.__profiles[0].disable()
+
+    def dump_stats(self, path):
+        """
+        Save the merged results of all threads in the pstats format.
+        :param path: str : Path of the file.
+        """
+        import pstats
+        with self.__lock:
+            pstats.Stats(*self.__profiles).dump_stats(path)
+
+
+# the global statistics
+stats = Stats()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+import pytest
+from requests import HTTPError
+from orobnat import Target
+from orobnat_async import AsyncSession, AsyncReportIterator
+
+REPORTS = 5
+FIRST = datetime(2024, 1, 1, 8, 30)
+REPORT = '<html><body><div class="block-content"><h3 class="infos">Informations générales</h3><table>' \
+         '<tr><th>Date du prélèvement</th><td>{:%d/%m/%Y %Hh%M}</td></tr>' \
+         '<tr><th>Commune</th><td>DIJON</td></tr><tr><th>Installation</th><td>USINE</td></tr>' \
+         '<tr><th>Service</th><td>SERVICE</td></tr><tr><th>Responsable</th><td>RESPONSABLE</td></tr>' \
+         '<tr><th>Maître d\'ouvrage</th><td>MAITRE</td></tr></table></div></body></html>'
+
+
+def select(name, values):
+    return '<html><body><select name="{}"><option value="">Choisir</option>{}</select></body></html>'.format(
+        name, ''.join(['<option value="{0}">{0}</option>'.format(value) for value in values]))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serve canned orobnat pages : 2 "departements" of 2 "communes" of 1 "reseau", each with REPORTS reports sampled
+    every 30 days from FIRST on, newest first. The reports of "reseau" 'ERR' fail with a 503 error.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body):
+        content = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=UTF-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path.startswith('/regions'):
+            self.reply(200, '<blockquote class="spip"><a class="spip_out" href="x?idRegion=27">BFC</a></blockquote>')
+        else:
+            self.reply(200, select('departement', ['021', '025']))
+
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(time.monotonic())
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            data = {key: values[0] for key, values in parse_qs(
+                self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'), keep_blank_values=True).items()}
+            if 'changerDepartement' == data['methode']:
+                self.reply(200, select('communeDepartement', [data['departement'] + suffix for suffix in ['1', '2']]))
+            elif 'changerReseau' == data['methode']:
+                self.reply(200, select('reseau', [data['communeDepartement'] + 'R']))
+            elif 'ERR' == data['reseau']:
+                self.reply(503, '<html><body>Service indisponible</body></html>')
+            else:
+                time.sleep(server.latency)
+                position = int(data['posPLV'])
+                self.reply(200, REPORT.format(FIRST - timedelta(days=30 * position)) if position < REPORTS
+                           else '<html><body></body></html>')
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+@pytest.fixture
+def server():
+    """
+    :return: ThreadingHTTPServer : A stub orobnat server, listening on a local port.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.lock = threading.Lock()
+    server.requests = list()
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.latency = 0.
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def open_session(server, **kwargs):
+    """
+    :return: AsyncSession : A session sending its requests to the stub server.
+    """
+    session = AsyncSession.create({}, **kwargs)
+    root = 'http://{}:{}'.format(*server.server_address)
+    session.session.URL_REGIONS = root + '/regions'
+    session.session.URL_BASE = root + '/orobnat/afficherPage.do'
+    session.session.URL_RECHERCHE = root + '/orobnat/rechercherResultatQualite.do'
+    session.session.retries = 0
+    return session
+
+
+async def collect(session, target, **kwargs):
+    return [report['date du prélèvement'] async for report in AsyncReportIterator(session, target.payload, **kwargs)]
+
+
+def test_targets(server):
+    async def run():
+        async with open_session(server) as session:
+            assert {'27': 'BFC'} == await session.regions()
+            return await session.targets('27')
+
+    assert [Target('27', departement, departement + suffix, departement + suffix + 'R')
+            for departement in ['021', '025'] for suffix in ['1', '2']] == asyncio.run(run())
+
+
+def test_crawl_under_concurrency_limit(server):
+    server.latency = .05
+
+    async def run():
+        async with open_session(server, concurrency=3) as session:
+            targets = await session.targets('27')
+            server.max_in_flight = 0
+            return await asyncio.gather(*[collect(session, target) for target in targets])
+
+    results = asyncio.run(run())
+    assert [[FIRST - timedelta(days=30 * position) for position in range(REPORTS)]] * 4 == results
+    assert 2 <= server.max_in_flight <= 3
+
+
+def test_rate_limit(server):
+    async def run():
+        async with open_session(server, concurrency=8, rate=10.) as session:
+            # the request opening the session and the first 9 reports use the initial burst of 10 requests, the
+            # last 9 reports are paced.
+            await asyncio.gather(*[collect(session, Target('27', '021', '0211', '0211R')) for _ in range(3)])
+
+    asyncio.run(run())
+    assert 3 * (REPORTS + 1) == len(server.requests)
+    assert server.requests[-1] - server.requests[0] >= .8
+
+
+def test_since_until(server):
+    async def run():
+        async with open_session(server) as session:
+            return await collect(session, Target('27', '021', '0211', '0211R'),
+                                 since=FIRST - timedelta(days=100), until=FIRST - timedelta(days=1))
+
+    assert [FIRST - timedelta(days=30), FIRST - timedelta(days=60), FIRST - timedelta(days=90)] == asyncio.run(run())
+
+
+def test_server_error(server):
+    async def run():
+        async with open_session(server) as session:
+            await collect(session, Target('27', '021', '0211', 'ERR'))
+
+    with pytest.raises(HTTPError):
+        asyncio.run(run())
+
+
+def test_sync_api(server):
+    async def run():
+        async with open_session(server) as session:
+            # the wrapped session is still usable synchronously, and shares the lists fetched asynchronously.
+            communes = await session.communes('27', '021')
+            requests = len(server.requests)
+            assert communes == session.session.get_communes('27', '021')
+            assert requests == len(server.requests)
+            return session.session.dl_report(Target('27', '025', '0251', '0251R').payload)['date du prélèvement']
+
+    assert FIRST == asyncio.run(run())
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from catalog import ReportCatalog
+
+TARGET = ('27', '021', '021231', '021001')
+
+
+def report(day, digest, nitrates=12.):
+    """
+    :return: tuple : (report values, measure values) of a report sampled on the given day of January 2024.
+    """
+    return (('2024-01-{:02d}T08:30:00'.format(day), 'DIJON', 'USINE', 'SERVICE', 'RESPONSABLE', 'MAITRE',
+             'Eau conforme', 1, digest),
+            [('Nitrates (en NO3)', nitrates, None, 'mg/L', '{} mg/L'.format(nitrates), '<=50 mg/L', '', 1),
+             ('Turbidité néphélométrique NFU', .1, '<', 'NFU', '<0,10 NFU', '', '<=2 NFU', 1)])
+
+
+def contents(catalog):
+    """
+    :return: list : Reports and their measures, without ids.
+    """
+    _, rows = catalog.query('SELECT r.region, r.departement, r.commune, r.reseau, r.date, r.digest, m.parametre, '
+                            'm.valeur FROM reports r JOIN measures m ON m.report = r.id ORDER BY r.date, m.parametre')
+    return rows
+
+
+def test_merge(tmp_path):
+    with ReportCatalog(str(tmp_path / 'other.sqlite')) as other:
+        for day, digest, nitrates in [(1, 'a', 12.), (2, 'b2', 20.), (3, 'c', 30.)]:
+            other.add_rows(TARGET, *report(day, digest, nitrates))
+        other.add_rows(('27', '021', '021231', '021002'), *report(1, 'd'))
+    with ReportCatalog(str(tmp_path / 'merged.sqlite')) as merged, \
+            ReportCatalog(str(tmp_path / 'expected.sqlite')) as expected:
+        for catalog in [merged, expected]:
+            catalog.add_rows(TARGET, *report(1, 'a'))
+            catalog.add_rows(TARGET, *report(2, 'b1', 15.))
+            catalog.add_rows(TARGET, *report(4, 'e'))
+            catalog.commit()
+        merged.merge(str(tmp_path / 'other.sqlite'))
+        for day, digest, nitrates in [(2, 'b2', 20.), (3, 'c', 30.)]:
+            expected.add_rows(TARGET, *report(day, digest, nitrates))
+        expected.add_rows(('27', '021', '021231', '021002'), *report(1, 'd'))
+        expected.commit()
+        assert 10 == len(contents(merged))
+        assert contents(expected) == contents(merged)
+        # merging again changes nothing.
+        merged.merge(str(tmp_path / 'other.sqlite'))
+        assert contents(expected) == contents(merged)
+
+
+def test_unknown_target(tmp_path):
+    unknown = ('',) * 4
+    with ReportCatalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+        # fed while downloading, then indexed from the export directory.
+        catalog.add_rows(TARGET, *report(1, 'a'))
+        catalog.commit()
+        catalog.add_rows(unknown, *report(1, 'a'))
+        catalog.add_rows(unknown, *report(2, 'b'))
+        assert 1 == catalog.commit()
+        # indexed, then fed while downloading.
+        catalog.add_rows(TARGET, *report(2, 'b'))
+        catalog.add_rows(TARGET, *report(3, 'c'))
+        assert 2 == catalog.commit()
+        assert [TARGET + ('2024-01-0{}T08:30:00'.format(day), digest) for day, digest in ['1a', '2b', '3c']] == \
+            sorted({row[:6] for row in contents(catalog)})
+        assert 6 == len(contents(catalog))
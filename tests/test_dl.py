@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import os
+import stat
+from datetime import datetime, timedelta
+import pytest
+import orobnat
+import orobnat_dl
+from checkpoint import Checkpoint
+from dedup import UMASK, ContentStore
+from orobnat import Report, Target, InvalidReportException, ExportException, atomic_path
+
+FIRST = datetime(2024, 1, 1, 8, 30)
+TARGET = Target('27', '021', '021231', '021000')
+REPORT = '<html><body><div class="block-content"><h3 class="infos">Informations générales</h3><table>' \
+         '<tr><th>Date du prélèvement</th><td>{:%d/%m/%Y %Hh%M}</td></tr></table></div></body></html>'
+
+
+class StubSession:
+    """
+    A session serving count reports sampled every 30 days from FIRST on, newest first.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.positions = list()
+
+    def dl_report(self, data):
+        self.positions.append(data['posPLV'])
+        if data['posPLV'] >= self.count:
+            raise InvalidReportException('<html><body></body></html>')
+        return Report(REPORT.format(FIRST - timedelta(days=30 * data['posPLV'])))
+
+
+def options(export_dir_path, **kwargs):
+    """
+    :return: dict : Command line options of a download to HTML files.
+    """
+    return {**dict(CHEMIN=export_dir_path, format=['HTML'], dedup=False, incremental=False, resume=False,
+                   export_jobs=None, since=None, until=None, jobs=1), **kwargs}
+
+
+@pytest.mark.parametrize('export_jobs', [None, 2])
+def test_checkpoint_stops_at_failed_export(tmp_path, monkeypatch, export_jobs):
+    failing = FIRST - timedelta(days=30 * 2)
+    export = orobnat.HTMLStrategy.export
+
+    def fail(strategy, report):
+        if failing == report['date du prélèvement']:
+            raise OSError('disk full')
+        export(strategy, report)
+
+    monkeypatch.setattr(orobnat.HTMLStrategy, 'export', fail)
+    checkpoint = Checkpoint(str(tmp_path / Checkpoint.FILENAME))
+    with pytest.raises(ExportException):
+        orobnat_dl.dl_target(StubSession(6), TARGET, str(tmp_path), checkpoint=checkpoint,
+                             **options(str(tmp_path), export_jobs=export_jobs))
+    checkpoint.save()
+    assert 2 == Checkpoint(str(tmp_path / Checkpoint.FILENAME), resume=True).position(TARGET)
+
+    failing = None
+    session = StubSession(6)
+    checkpoint = Checkpoint(str(tmp_path / Checkpoint.FILENAME), resume=True)
+    assert 4 == orobnat_dl.dl_target(session, TARGET, str(tmp_path), checkpoint=checkpoint,
+                                     **options(str(tmp_path), resume=True))
+    assert 2 == session.positions[0]
+    assert checkpoint.done(TARGET)
+    assert 6 == len(os.listdir(tmp_path / 'HTML' / '2023')) + len(os.listdir(tmp_path / 'HTML' / '2024'))
+
+
+def test_atomic_path_permissions(tmp_path):
+    path = str(tmp_path / 'report.html')
+    with atomic_path(path) as tmp:
+        with open(tmp, 'w') as f:
+            f.write('report')
+    assert 0o666 & ~UMASK == stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_store_permissions(tmp_path):
+    store = ContentStore(str(tmp_path / ContentStore.DIRNAME))
+    path = str(tmp_path / 'HTML' / 'report.html')
+    ContentStore.link(store.put('digest', 'html', b'report'), path)
+    assert 0o666 & ~UMASK == stat.S_IMODE(os.stat(path).st_mode)
+
+
+@pytest.mark.parametrize('runs', [1, 2])
+def test_archive_permissions(tmp_path, runs):
+    # the second run appends to the archive, and replaces a report whose content changed.
+    for run in range(runs):
+        strategy = orobnat.ZIPStrategy(str(tmp_path))
+        strategy.export(Report(REPORT.format(FIRST).replace('</table>', '</table>{}'.format(run))))
+        strategy.close()
+    assert 0o666 & ~UMASK == stat.S_IMODE(os.stat(tmp_path / 'ZIP' / '2024.zip').st_mode)
+
+
+def test_merge_keeps_hard_links(tmp_path):
+    shard = tmp_path / 'shard'
+    store = ContentStore(str(shard / ContentStore.DIRNAME))
+    object_path = store.put('digest', 'html', b'report')
+    paths = ['27/021/021231/021000/HTML/2024/2024-01-01_083000.html',
+             '27/021/021232/021001/HTML/2024/2024-01-01_083000.html']
+    for path in paths:
+        ContentStore.link(object_path, str(shard / path))
+    (shard / 'other.html').write_text('other')
+    orobnat_dl.merge_exports(None, CHEMIN=str(tmp_path / 'merged'), merge=[str(shard)], dry_run=False)
+    merged_object = tmp_path / 'merged' / os.path.relpath(object_path, str(shard))
+    for path in paths:
+        assert os.path.samefile(merged_object, tmp_path / 'merged' / path)
+    assert 3 == os.stat(merged_object).st_nlink
+    assert 'other' == (tmp_path / 'merged' / 'other.html').read_text()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+from orobnat import Report, Target, InvalidReportException, ParallelReportIterator, seek_position
+
+FIRST = datetime(2024, 1, 1, 8, 30)
+REPORT = '<html><body><div class="block-content"><h3 class="infos">Informations générales</h3><table>' \
+         '<tr><th>Date du prélèvement</th><td>{:%d/%m/%Y %Hh%M}</td></tr></table></div></body></html>'
+
+
+def sampled(position):
+    return FIRST - timedelta(days=30 * position)
+
+
+class ListSession:
+    """
+    A session serving count reports sampled every 30 days from FIRST on, newest first. Each download of a position
+    sleeps for the given delay, and fails with the given exception if any.
+    """
+
+    def __init__(self, count, delays=None, errors=None):
+        self.count = count
+        self.delays = delays or dict()
+        self.errors = errors or dict()
+        self.lock = threading.Lock()
+        self.positions = list()
+
+    def dl_report(self, data):
+        position = data['posPLV']
+        with self.lock:
+            self.positions.append(position)
+        time.sleep(self.delays.get(position, 0.))
+        if position in self.errors:
+            raise self.errors[position]
+        if position >= self.count:
+            raise InvalidReportException('<html><body></body></html>')
+        return Report(REPORT.format(sampled(position)))
+
+
+@pytest.mark.parametrize('date, strict, position', [
+    (FIRST + timedelta(days=1), False, 0),
+    (FIRST, False, 0),
+    (FIRST, True, 1),
+    (sampled(3) - timedelta(days=1), False, 4),
+    (sampled(4), False, 4),
+    (sampled(4), True, 5),
+    (sampled(9), False, 9),
+    (sampled(9), True, 10),
+    (sampled(9) - timedelta(days=1), False, 10),
+])
+def test_seek_position(date, strict, position):
+    assert position == seek_position(ListSession(10), Target('27', '021', '021231', '021000').payload, date, strict)
+
+
+def test_seek_position_empty_list():
+    session = ListSession(0)
+    assert 0 == seek_position(session, Target('27', '021', '021231', '021000').payload, FIRST)
+    assert [0] == session.positions
+
+
+def test_seek_position_from_position():
+    payload = Target('27', '021', '021231', '021000').payload
+    payload['posPLV'] = 5
+    assert 5 == seek_position(ListSession(10), payload, FIRST)
+    assert 7 == seek_position(ListSession(10), payload, sampled(6), strict=True)
+
+
+def test_seek_position_downloads():
+    session = ListSession(1000)
+    assert 700 == seek_position(session, Target('27', '021', '021231', '021000').payload, sampled(700))
+    assert len(session.positions) <= 20
+
+
+def test_parallel_iterator_order():
+    # later positions complete first.
+    session = ListSession(12, delays={position: .01 * (12 - position) for position in range(12)})
+    payload = Target('27', '021', '021231', '021000').payload
+    with ParallelReportIterator(session, payload, jobs=4) as reports:
+        assert [sampled(position) for position in range(12)] == [report['date du prélèvement'] for report in reports]
+    assert 12 == payload['posPLV']
+
+
+def test_parallel_iterator_until_since():
+    payload = Target('27', '021', '021231', '021000').payload
+    with ParallelReportIterator(ListSession(12), payload, since=sampled(8), until=sampled(3), jobs=3) as reports:
+        assert [sampled(position) for position in range(3, 9)] == [report['date du prélèvement'] for report in reports]
+
+
+def test_parallel_iterator_cancellation():
+    session = ListSession(100, delays={position: .02 for position in range(100)})
+    payload = Target('27', '021', '021231', '021000').payload
+    with ParallelReportIterator(session, payload, known={sampled(5)}, jobs=4) as reports:
+        assert 5 == len(list(reports))
+        # no download is submitted once the iteration stopped.
+        with pytest.raises(StopIteration):
+            next(reports)
+    assert 6 == payload['posPLV']
+    # the window of pending downloads is cancelled : at most jobs downloads were submitted past the stop.
+    assert max(session.positions) < 5 + 4
+
+
+def test_parallel_iterator_error():
+    session = ListSession(12, errors={3: OSError('connection reset')})
+    payload = Target('27', '021', '021231', '021000').payload
+    reports = ParallelReportIterator(session, payload, jobs=4)
+    assert sampled(2) == [next(reports) for _ in range(3)][-1]['date du prélèvement']
+    with pytest.raises(OSError):
+        next(reports)
+    with pytest.raises(StopIteration):
+        next(reports)
+    assert 3 == payload['posPLV']
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import os
+import stat
+import sys
+import pytest
+from orobnat import PDFRenderer, PDFStrategy, Report, ExportException
+
+# a stand-in for wkhtmltopdf : it reads the arguments of each rendering from stdin, writes the concatenated inputs
+# behind a PDF header, and exits on inputs holding 'FAIL', like wkhtmltopdf on a failed conversion. Each process
+# start and one-shot run is logged.
+FAKE = '''#!{python}
+import sys
+
+def split(line):
+    arguments, current, quoted, escaped, started = [], '', False, False, False
+    for char in line:
+        if escaped:
+            current, escaped = current + char, False
+        elif '\\\\' == char:
+            escaped = started = True
+        elif '"' == char:
+            quoted, started = not quoted, True
+        elif char.isspace() and not quoted:
+            if started:
+                arguments.append(current)
+            current, started = '', False
+        else:
+            current, started = current + char, True
+    return arguments + ([current] if started else [])
+
+def render(arguments):
+    *inputs, output = arguments[2:]
+    contents = [open(path, encoding='utf-8').read() for path in inputs]
+    if any('FAIL' in content for content in contents):
+        sys.stderr.write('Loading pages (1/6)\\n[====>     ] 50%\\rError: Failed loading page\\n')
+        sys.stderr.write('Exit with code 1 due to network error: ContentNotFoundError\\n')
+        sys.exit(1)
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write('%PDF-fake\\n' + ''.join(contents))
+    sys.stderr.write('Loading pages (1/6)\\n[==========] 100%\\rDone\\n')
+    sys.stderr.flush()
+
+with open({log!r}, 'a') as log:
+    log.write(' '.join(sys.argv[1:2]) + '\\n')
+if ['--read-args-from-stdin'] == sys.argv[1:]:
+    for line in sys.stdin:
+        render(split(line))
+else:
+    render(sys.argv[1:])
+'''
+
+
+@pytest.fixture
+def wkhtmltopdf(tmp_path, monkeypatch):
+    """
+    :return: str : Path of the log of the fake wkhtmltopdf, set as the binary of every renderer.
+    """
+    log_path = str(tmp_path / 'wkhtmltopdf.log')
+    binary = tmp_path / 'wkhtmltopdf'
+    binary.write_text(FAKE.format(python=sys.executable, log=log_path))
+    binary.chmod(binary.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(PDFRenderer, 'BINARY', str(binary))
+    yield log_path
+    PDFRenderer.close_all()
+
+
+def starts(log_path):
+    with open(log_path) as f:
+        return f.read().splitlines()
+
+
+def html(path, content):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return str(path)
+
+
+def test_renderer_is_long_lived(tmp_path, wkhtmltopdf):
+    renderer = PDFRenderer()
+    try:
+        directory = tmp_path / 'a "quoted" dir\\with spaces'
+        directory.mkdir()
+        for name in ['1', '2', '3']:
+            renderer.render([html(directory / '{}.html'.format(name), name)], str(directory / '{}.pdf'.format(name)))
+        renderer.render([str(directory / '1.html'), str(directory / '2.html')], str(directory / 'both.pdf'))
+    finally:
+        renderer.close()
+    assert '%PDF-fake\n2' == (directory / '2.pdf').read_text()
+    assert '%PDF-fake\n12' == (directory / 'both.pdf').read_text()
+    assert ['--read-args-from-stdin'] == starts(wkhtmltopdf)
+
+
+def test_renderer_restarts_after_failure(tmp_path, wkhtmltopdf):
+    renderer = PDFRenderer()
+    try:
+        with pytest.raises(ExportException, match='ContentNotFoundError'):
+            renderer.render([html(tmp_path / 'bad.html', 'FAIL')], str(tmp_path / 'bad.pdf'))
+        renderer.render([html(tmp_path / 'good.html', 'good')], str(tmp_path / 'good.pdf'))
+    finally:
+        renderer.close()
+    assert '%PDF-fake\ngood' == (tmp_path / 'good.pdf').read_text()
+    assert ['--read-args-from-stdin'] * 2 == starts(wkhtmltopdf)
+
+
+def test_renderer_long_line(tmp_path, wkhtmltopdf, monkeypatch):
+    monkeypatch.setattr(PDFRenderer, 'MAX_ARGUMENTS', 4)
+    renderer = PDFRenderer()
+    try:
+        renderer.render([html(tmp_path / '{}.html'.format(name), name) for name in ['1', '2', '3']],
+                        str(tmp_path / 'year.pdf'))
+    finally:
+        renderer.close()
+    assert '%PDF-fake\n123' == (tmp_path / 'year.pdf').read_text()
+    assert ['--encoding'] == starts(wkhtmltopdf)
+
+
+def test_pdf_strategy(tmp_path, wkhtmltopdf, monkeypatch):
+    monkeypatch.setattr(PDFStrategy, 'WORKERS', 2)
+    # a thread pool of 2 threads, instead of the one shared by the strategies of the process.
+    monkeypatch.setattr(PDFStrategy, '_PDFStrategy__executor', None)
+    errors = list()
+    strategy = PDFStrategy(str(tmp_path))
+    strategy.on_error = lambda report, error: errors.append((report['date du prélèvement'].day, error))
+    for day in range(1, 11):
+        strategy.export(Report('<html><body><div class="block-content"><h3 class="infos">Informations générales</h3>'
+                               '<table><tr><th>Date du prélèvement</th><td>{:02d}/01/2024 08h30</td></tr>'
+                               '</table></div>{}</body></html>'.format(day, 'FAIL' if 4 == day else '')))
+    strategy.close()
+    PDFStrategy._executor().shutdown()
+    assert [4] == [day for day, _ in errors]
+    assert 9 == len(os.listdir(tmp_path / 'PDF' / '2024'))
+    # one process per rendering thread, and one more after the failure.
+    assert len(starts(wkhtmltopdf)) <= 3
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import ratelimit
+from ratelimit import TokenBucket, AdaptiveTokenBucket, HostRateLimiter
+
+
+@pytest.fixture
+def no_cooldown(monkeypatch):
+    monkeypatch.setattr(AdaptiveTokenBucket, 'COOLDOWN', 0.)
+
+
+def test_token_bucket_reserve(monkeypatch):
+    monkeypatch.setattr(ratelimit.time, 'monotonic', lambda: 100.)
+    bucket = TokenBucket(2., capacity=2.)
+    assert [0., 0., .5, 1.] == [bucket.reserve() for _ in range(4)]
+
+
+def test_aimd_decrease_and_recovery(no_cooldown):
+    bucket = AdaptiveTokenBucket(10.)
+    bucket.failure()
+    bucket.failure()
+    assert 2.5 == pytest.approx(bucket.rate)
+    bucket.success(.1)
+    assert 3. == pytest.approx(bucket.rate)
+    for _ in range(100):
+        bucket.success(.1)
+    assert 10. == pytest.approx(bucket.rate)
+
+
+def test_aimd_min_rate(no_cooldown):
+    bucket = AdaptiveTokenBucket(10., min_rate=1.)
+    for _ in range(10):
+        bucket.failure()
+    assert 1. == pytest.approx(bucket.rate)
+
+
+def test_aimd_latency_target(no_cooldown):
+    bucket = AdaptiveTokenBucket(10., latency_target=1.)
+    bucket.success(2.)
+    assert 5. == pytest.approx(bucket.rate)
+    bucket.success(.5)
+    assert 5.5 == pytest.approx(bucket.rate)
+
+
+def test_aimd_cooldown():
+    # requests failing together slow the rate down once.
+    bucket = AdaptiveTokenBucket(10.)
+    for _ in range(5):
+        bucket.failure()
+    assert 5. == pytest.approx(bucket.rate)
+
+
+def test_host_rate_limiter():
+    limiter = HostRateLimiter(10., adaptive=True)
+    bucket = limiter.bucket('https://orobnat.sante.gouv.fr/orobnat/afficherPage.do')
+    assert bucket is limiter.bucket('https://orobnat.sante.gouv.fr/orobnat/rechercherResultatQualite.do')
+    assert bucket is not limiter.bucket('https://sante.gouv.fr/sante-et-environnement/eaux/eau')
+    assert isinstance(bucket, AdaptiveTokenBucket)
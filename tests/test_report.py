@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from orobnat import Measure
+
+
+@pytest.mark.parametrize('text, limit, conform', [
+    ('12 mg/L', '<=50 mg/L', True),
+    ('50 mg/L', '<=50 mg/L', True),
+    ('55 mg/L', '<=50 mg/L', False),
+    ('50 mg/L', '<50 mg/L', False),
+    ('<0,10 NFU', '<=2 NFU', True),
+    ('<2 NFU', '<=2 NFU', True),
+    ('<=2 NFU', '<2 NFU', None),
+    ('<60 mg/L', '<=50 mg/L', None),
+    ('>60 mg/L', '<=50 mg/L', False),
+    ('>50 mg/L', '<=50 mg/L', False),
+    ('>=50 mg/L', '<=50 mg/L', None),
+    ('≥50 mg/L', '<50 mg/L', False),
+    ('>10 mg/L', '>=5 mg/L', True),
+    ('<3 mg/L', '>=5 mg/L', False),
+    ('<10 mg/L', '>=5 mg/L', None),
+    ('7,5', '>=6,5 et <=9', True),
+    ('9,5', '>=6,5 et <=9', False),
+    ('>6,5', '>=6,5 et <=9', None),
+    ('12 mg/L', '', None),
+])
+def test_measure_conformity(text, limit, conform):
+    assert conform is Measure.parse('Paramètre', text, limit).conform
+
+
+@pytest.mark.parametrize('text, value, qualifier, unit', [
+    ('1,2E-3 mg/L', .0012, '', 'mg/L'),
+    ('<5e2 n/100mL', 500., '<', 'n/100mL'),
+    ('-0,5 °C', -.5, '', '°C'),
+    ('absence', None, '', ''),
+])
+def test_measure_value(text, value, qualifier, unit):
+    measure = Measure.parse('Paramètre', text)
+    assert (value if None is value else pytest.approx(value), qualifier, unit) == \
+        (measure.value, measure.qualifier, measure.unit)
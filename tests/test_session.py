@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+from datetime import datetime
+from io import BytesIO
+import pytest
+from requests import Response, HTTPError, Timeout
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+import orobnat
+from orobnat import Session, ReportIterator, Target
+from ratelimit import HostRateLimiter
+
+REPORT = '<html><body><div class="block-content"><h3 class="infos">Informations générales</h3><table>' \
+         '<tr><th>Date du prélèvement</th><td>01/01/2024 08h30</td></tr>' \
+         '<tr><th>Commune</th><td>DIJON</td></tr><tr><th>Installation</th><td>USINE</td></tr>' \
+         '<tr><th>Service</th><td>SERVICE</td></tr><tr><th>Responsable</th><td>RESPONSABLE</td></tr>' \
+         '<tr><th>Maître d\'ouvrage</th><td>MAITRE</td></tr></table></div></body></html>'
+
+
+class FaultyAdapter(BaseAdapter):
+    """
+    A transport adapter injecting faults : each request is answered with the next queued fault, an HTTP status code
+    with its headers or an exception, then with a 200 response holding REPORT once the faults are exhausted.
+    """
+
+    def __init__(self, *faults):
+        super(FaultyAdapter, self).__init__()
+        self.faults = deque(faults)
+        self.requests = list()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        self.requests.append(request)
+        status, headers = 200, dict()
+        if self.faults:
+            fault = self.faults.popleft()
+            if isinstance(fault, Exception):
+                raise fault
+            status, headers = fault if isinstance(fault, tuple) else (fault, dict())
+        content = REPORT.encode('utf-8') if 200 == status else b'<html><body>Erreur</body></html>'
+        response = Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = 'utf-8'
+        response.raw = BytesIO(content)
+        response._content = content
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """
+    :return: list : Delays slept between retries, which are not actually waited.
+    """
+    slept = list()
+    monkeypatch.setattr(orobnat.time, 'sleep', slept.append)
+    return slept
+
+
+def session_with(*faults):
+    """
+    :return: tuple : (Session, FaultyAdapter) : An opened session, whose next requests meet the given faults.
+    """
+    adapter = FaultyAdapter()
+    session = Session({})
+    session.mount('https://', adapter)
+    session.retries = 2
+    session.backoff = 0.
+    session.start()
+    adapter.faults.extend(faults)
+    adapter.requests.clear()
+    return session, adapter
+
+
+def test_server_error_retried(delays):
+    session, adapter = session_with(503)
+    report = session.dl_report(Target('27', '021', '21231', '021000001').payload)
+    assert datetime(2024, 1, 1, 8, 30) == report['date du prélèvement']
+    assert 2 == len(adapter.requests)
+    assert 1 == len(delays)
+
+
+def test_server_error_exhausts_retries(delays):
+    session, adapter = session_with(*[500] * 3)
+    with pytest.raises(HTTPError):
+        session.dl_report(Target('27', '021', '21231', '021000001').payload)
+    assert session.retries + 1 == len(adapter.requests)
+
+
+def test_client_error_not_retried(delays):
+    session, adapter = session_with(404)
+    with pytest.raises(HTTPError):
+        session.dl_report(Target('27', '021', '21231', '021000001').payload)
+    assert 1 == len(adapter.requests)
+    assert [] == delays
+
+
+def test_timeout_retried(delays):
+    session, adapter = session_with(Timeout())
+    session.dl_report(Target('27', '021', '21231', '021000001').payload)
+    assert 2 == len(adapter.requests)
+
+
+def test_timeout_exhausts_retries(delays):
+    session, adapter = session_with(*[Timeout()] * 3)
+    with pytest.raises(Timeout):
+        session.dl_report(Target('27', '021', '21231', '021000001').payload)
+    assert session.retries + 1 == len(adapter.requests)
+
+
+def test_retry_after(delays):
+    session, adapter = session_with((429, {'Retry-After': '7'}), (503, {'Retry-After': '3600'}))
+    session.dl_report(Target('27', '021', '21231', '021000001').payload)
+    assert [7., Session.MAX_BACKOFF] == delays
+
+
+def test_error_does_not_end_iteration(delays):
+    # the third report fails on every try : the iteration fails instead of ending as if there was no more report.
+    session, adapter = session_with(200, 200, *[503] * 3)
+    iterator = ReportIterator(session, Target('27', '021', '21231', '021000001').payload)
+    next(iterator)
+    next(iterator)
+    with pytest.raises(HTTPError):
+        next(iterator)
+
+
+def test_rate_limiter_feedback(delays):
+    session, adapter = session_with(503)
+    session.limiter = HostRateLimiter(10., adaptive=True)
+    session.dl_report(Target('27', '021', '21231', '021000001').payload)
+    # halved by the failure, then increased by the success.
+    assert 5.5 == pytest.approx(session.limiter.bucket(Session.URL_RECHERCHE).rate)